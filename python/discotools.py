@@ -1,54 +1,89 @@
 """
 This module is the main interface to the programs in this package.
 
+Commands are declared in a manifest (see `COMMANDS`) and the module of a command is only imported if the command is selected,
+thus, for example, `discotools preprocessing doctext --help` does not pay for numpy, scipy or nltk.
+
+Global options (see `discourse.profiling`) precede the class of the command, e.g. `discotools --profile DIR scripts pipeline ...`.
+
 @author: wilkeraziz
 """
 
+import sys
 import argparse
-from discourse import itercommands, iterclasses
-
-
-def importall():
-    """Import modules which contain commands"""
-    import discourse.docsgml
-    import discourse.doctext
-    import discourse.preprocessing.parsedoctext
-    import discourse.rankings
-    import discourse.entity_based.grid
-    import discourse.entity_based.grid_decoder
-    import discourse.syntax_based.dseq
-    import discourse.syntax_based.ibm1
-    import discourse.syntax_based.ibm1_decoder
-    import discourse.syntax_based.alouis
-    import discourse.syntax_based.alouis_decoder
-    import corpus.corpus_pipeline
-    
-
-def configure_commands(cls, parser):
+from discourse import declare, itermanifest, load_command
+from discourse.profiling import add_arguments
+
+
+# (class, command, module)
+COMMANDS = [
+        ('preprocessing', 'docsgml', 'discourse.docsgml'),
+        ('preprocessing', 'fixwmt', 'discourse.docsgml'),
+        ('preprocessing', 'doctext', 'discourse.doctext'),
+        ('preprocessing', 'docindex', 'discourse.docindex'),
+        ('preprocessing', 'encode', 'discourse.encoded'),
+        ('preprocessing', 'vocab', 'discourse.vocabulary'),
+        ('analysis', 'parsedocs', 'discourse.preprocessing.parsedoctext'),
+        ('analysis', 'dseq', 'discourse.syntax_based.dseq'),
+        ('scripts', 'rankings', 'discourse.rankings'),
+        ('scripts', 'sigtest', 'discourse.significance'),
+        ('scripts', 'pipeline', 'discourse.pipeline'),
+        ('scripts', 'benchmark', 'discourse.benchmark.run'),
+        ('pipeline', 'sweep', 'discourse.sweep'),
+        ('entity-based', 'grid', 'discourse.entity_based.grid'),
+        ('entity-based', 'grid_decoder', 'discourse.entity_based.grid_decoder'),
+        ('syntax-based', 'ibm1', 'discourse.syntax_based.ibm1'),
+        ('syntax-based', 'ibm1_decoder', 'discourse.syntax_based.ibm1_decoder'),
+        ('syntax-based', 'alouis', 'discourse.syntax_based.alouis'),
+        ('syntax-based', 'alouis_decoder', 'discourse.syntax_based.alouis_decoder'),
+        ('corpus', 'corpus_pipeline', 'corpus.corpus_pipeline'),
+        ]
+
+
+def declareall():
+    """Declare commands (without importing their modules)"""
+    for cls, name, module in COMMANDS:
+        declare(name, cls, module)
+
+
+def configure_commands(cls, parser, commands, selected=None):
     subparsers = parser.add_subparsers(title='subcommands',
             dest='subparser_name', 
             help='additional help')
 
-    for prog_name, prog_parser in sorted(itercommands(cls), key=lambda (n, c): n):
-        prog_parser(subparsers.add_parser(prog_name))
+    for prog_name in sorted(commands):
+        prog_parser = subparsers.add_parser(prog_name)
+        # only the selected command is configured (which imports its module)
+        if prog_name == selected:
+            load_command(prog_name, cls)(prog_parser)
+
 
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
 
-def parse_args():
     parser = argparse.ArgumentParser(prog='discotools',
             description="Discourse tools for MT (MODIST)")
+    # e.g. discotools --profile DIR CLASS COMMAND [options]
+    add_arguments(parser)
 
     subparsers = parser.add_subparsers(title='subcommands',
             dest='subparser_name', 
             help='additional help')
 
-    importall()
+    declareall()
+    classes = {}
+    for cls, name, module in itermanifest():
+        classes.setdefault(cls, []).append(name)
 
-    for cls in sorted(iterclasses()):
+    # discotools [global options] CLASS COMMAND [options]
+    positional = add_arguments(argparse.ArgumentParser(add_help=False)).parse_known_args(argv)[1]
+    selected_cls, selected = (positional + [None, None])[:2]
+    for cls in sorted(classes):
         subparser = subparsers.add_parser(cls)
-        configure_commands(cls, subparser)
-    
+        configure_commands(cls, subparser, classes[cls], selected if cls == selected_cls else None)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     args.func(args)
 
     return args
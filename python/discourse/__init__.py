@@ -4,12 +4,22 @@ This module declares a helper class which can be used as a decorator to declare
 A command function should receive an empty argument parser and configure it.
 As part of the configuration process, the function should assign a default function to be called in case the command is used.
 
+Commands accept profiling options (see `discourse.profiling`), which are added to their parsers by the decorator.
+
+Commands can also be declared ahead of time (see `declare`), in which case their modules are only imported
+when they are selected (see `load_command`), this keeps command line interfaces (e.g. discotools) quick to start.
+
 @author: wilkeraziz
 """
 
+import argparse
+import importlib
 from collections import defaultdict
+from discourse.profiling import add_arguments, ProfiledCommand
 
 _COMMANDS_ = defaultdict(dict)
+# commands declared ahead of import: class -> name -> module
+_MANIFEST_ = defaultdict(dict)
 
 
 class command(object):
@@ -24,10 +34,33 @@ class command(object):
 
     def __call__(self, command):
         existing = _COMMANDS_[self.cls_].get(self.name_, None)
-        if existing is not None and existing is not command:
+        if existing is not None and existing.command is not command:
             raise Exception('Conflicting command: %s (class=%s)', self.name_, self.cls_)
-        _COMMANDS_[self.cls_][self.name_] = command
-        return command
+        configure = _Configure(self.name_, command)
+        _COMMANDS_[self.cls_][self.name_] = configure
+        return configure
+
+
+class _Configure(object):
+    """
+    Configures a parser by calling a command function,
+    then adds profiling options and makes sure the default function runs under the profiler when asked to.
+    """
+
+    def __init__(self, name, command):
+        self.name = name
+        self.command = command
+        self.__doc__ = command.__doc__
+
+    def __call__(self, *args, **kwargs):
+        parser = self.command(*args, **kwargs)
+        if isinstance(parser, argparse.ArgumentParser):
+            # no defaults: options given to discotools itself are not overridden
+            add_arguments(parser, suppress=True)
+            func = parser.get_default('func')
+            if func is not None and not isinstance(func, ProfiledCommand):
+                parser.set_defaults(func=ProfiledCommand(self.name, func))
+        return parser
 
 
 def itercommands(cls):
@@ -37,3 +70,25 @@ def itercommands(cls):
 
 def iterclasses():
     return _COMMANDS_.iterkeys()
+
+
+def declare(name, cls, module):
+    """declares that a module (e.g. 'discourse.doctext') defines a command (without importing the module)"""
+    _MANIFEST_[cls][name] = module
+
+
+def itermanifest():
+    """iterates over declared commands: (class, name, module)"""
+    for cls, commands in _MANIFEST_.iteritems():
+        for name, module in commands.iteritems():
+            yield cls, name, module
+
+
+def load_command(name, cls):
+    """returns a declared command (see `declare`), its module is imported if need be"""
+    if name not in _COMMANDS_[cls]:
+        module = _MANIFEST_[cls][name]
+        importlib.import_module(module)
+        if name not in _COMMANDS_[cls]:
+            raise Exception('Module %s does not define command %s (class=%s)' % (module, name, cls))
+    return _COMMANDS_[cls][name]
@@ -0,0 +1,204 @@
+"""
+Runs benchmark scenarios (see `discourse.benchmark.scenarios`) on synthetic data and compares them to a baseline.
+
+Example:
+
+    # save a baseline
+    python -m discourse.benchmark.run /tmp/bench --preset small --save baseline.json
+    # ... change something ...
+    python -m discourse.benchmark.run /tmp/bench --preset small --baseline baseline.json
+
+Each scenario is run a number of times (after preparing its inputs), wall and CPU times are recorded,
+and the median wall time is compared to the baseline's (the ratio is current over baseline).
+
+@author: wilkeraziz
+"""
+
+import sys
+import gc
+import json
+import time
+import socket
+import logging
+import argparse
+import platform
+import numpy as np
+from discourse import command
+from discourse.util import tabulate
+from discourse.benchmark.scenarios import PRESETS, Workspace, iterscenarios
+
+
+def time_scenario(run, repeat):
+    """runs a scenario a number of times, returns a list of (wall, cpu) in seconds"""
+    times = []
+    for _ in xrange(repeat):
+        gc.collect()
+        wall, cpu = time.time(), time.clock()
+        run()
+        times.append((time.time() - wall, time.clock() - cpu))
+    return times
+
+
+def run_scenarios(ws, names, repeat):
+    """
+    Returns
+    -------
+    an ordered list of results (one dictionary per scenario)
+    """
+    results = []
+    for name, factory in iterscenarios():
+        if names and name not in names:
+            continue
+        logging.info('Preparing %s', name)
+        run = factory(ws)
+        logging.info('Running %s', name)
+        times = time_scenario(run, repeat)
+        wall = [w for w, c in times]
+        cpu = [c for w, c in times]
+        results.append({'scenario': name,
+            'wall': wall,
+            'cpu': cpu,
+            'median': float(np.median(wall)),
+            'best': min(wall),
+            'cpu_median': float(np.median(cpu))})
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the median wall time of each scenario to the baseline's.
+
+    Returns
+    -------
+    rows (scenario, baseline, current, ratio, verdict) and the number of regressions
+    """
+    previous = {r['scenario']: r for r in baseline['results']}
+    rows = []
+    regressions = 0
+    for r in results:
+        b = previous.get(r['scenario'], None)
+        if b is None:
+            rows.append([r['scenario'], '', r['median'], '', 'new'])
+            continue
+        ratio = r['median'] / b['median'] if b['median'] > 0 else float('inf')
+        if ratio > 1 + tolerance:
+            verdict = 'slower'
+            regressions += 1
+        elif ratio < 1 / (1 + tolerance):
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        rows.append([r['scenario'], b['median'], r['median'], ratio, verdict])
+    return rows, regressions
+
+
+def main(args):
+
+    logging.basicConfig(
+            level=(logging.DEBUG if args.verbose else logging.INFO),
+            format='%(asctime)s %(levelname)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+    if not args.verbose:
+        # models are chatty
+        logging.getLogger().setLevel(logging.WARNING)
+
+    if args.list:
+        for name, factory in iterscenarios():
+            print name
+        return
+
+    config = PRESETS[args.preset]._replace(**{k: v for k, v in [('seed', args.seed),
+        ('docs', args.docs), ('sentences', args.sentences), ('length', args.length), ('vocab', args.vocab),
+        ('systems', args.systems), ('entities', args.entities), ('rounds', args.rounds)] if v is not None})
+    ws = Workspace(args.workspace, config)
+    print >> sys.stderr, 'Configuration: %s' % ' '.join('{0}={1}'.format(k, v) for k, v in config._asdict().iteritems())
+
+    results = run_scenarios(ws, frozenset(args.scenario), args.repeat)
+    report = {'config': config._asdict(),
+            'repeat': args.repeat,
+            'started': time.time(),
+            'host': socket.gethostname(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'results': results}
+
+    print tabulate([[r['scenario'], r['median'], r['best'], r['cpu_median']] for r in results],
+            headers=['scenario', 'median (s)', 'best (s)', 'cpu (s)'], floatfmt='.4f')
+
+    if args.save:
+        with open(args.save, 'w') as fo:
+            json.dump(report, fo, indent=2, sort_keys=True)
+        logging.warning('Results saved to %s', args.save)
+
+    if args.baseline:
+        with open(args.baseline) as fi:
+            baseline = json.load(fi)
+        if baseline['config'] != report['config']:
+            logging.warning('The baseline was run with a different configuration: %s', baseline['config'])
+        rows, regressions = compare(results, baseline, args.tolerance)
+        print
+        print tabulate(rows, headers=['scenario', 'baseline (s)', 'current (s)', 'ratio', 'verdict'], floatfmt='.4f')
+        if regressions and args.strict:
+            raise SystemExit('%d scenarios are slower than the baseline (tolerance=%.2f)' % (regressions, args.tolerance))
+
+
+@command('benchmark', 'scripts')
+def argparser(parser=None, func=main):
+    """parse command line arguments"""
+
+    if parser is None:
+        parser = argparse.ArgumentParser(prog='benchmark')
+
+    parser.description = 'Benchmarks coherence models (and evaluation) on synthetic data'
+    parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
+
+    parser.add_argument('workspace',
+            type=str,
+            help='where synthetic data are generated (and reused by later runs)')
+    parser.add_argument('--preset',
+            type=str, default='small', choices=PRESETS.keys(),
+            help='size of the synthetic data')
+    parser.add_argument('--scenario',
+            default=[], action='append',
+            help='run a scenario (by default all scenarios run), see --list')
+    parser.add_argument('--list',
+            action='store_true',
+            help='list scenarios and exit')
+    parser.add_argument('--repeat', '-r',
+            type=int, default=3,
+            help='number of times each scenario runs')
+    parser.add_argument('--save',
+            type=str,
+            help='save results (JSON) to be used as a baseline')
+    parser.add_argument('--baseline',
+            type=str,
+            help='compare results to a baseline (see --save)')
+    parser.add_argument('--tolerance',
+            type=float, default=0.1,
+            help='relative change in median wall time below which scenarios are considered unchanged')
+    parser.add_argument('--strict',
+            action='store_true',
+            help='exit with an error if any scenario is slower than the baseline')
+    parser.add_argument('--verbose', '-v',
+            action='store_true',
+            help='increase the verbosity level')
+
+    synthetic_group = parser.add_argument_group('Synthetic data (overrides the preset)')
+    synthetic_group.add_argument('--seed', type=int, help='random seed')
+    synthetic_group.add_argument('--docs', type=int, help='number of documents')
+    synthetic_group.add_argument('--sentences', type=int, help='average number of sentences per document')
+    synthetic_group.add_argument('--length', type=int, help='average number of patterns per sentence')
+    synthetic_group.add_argument('--vocab', type=int, help='number of distinct patterns')
+    synthetic_group.add_argument('--systems', type=int, help='number of systems (for rankings and significance)')
+    synthetic_group.add_argument('--entities', type=int, help='average number of entities per grid')
+    synthetic_group.add_argument('--rounds', type=int, help='bootstrap rounds (and permutations)')
+
+    if func is not None:
+        parser.set_defaults(func=func)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = argparser().parse_args()
+    args.func(args)
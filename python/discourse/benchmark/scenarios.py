@@ -0,0 +1,271 @@
+"""
+Timed benchmark scenarios.
+
+A scenario is declared with the `scenario` decorator, it receives a `Workspace` (where synthetic data lives),
+does whatever preparation it needs (e.g. trains a model to be used for decoding) and returns a function
+which performs the work to be timed (see `discourse.benchmark.run`).
+
+    @scenario('ibm1:decode')
+    def ibm1_decode(ws):
+        model = ws.ibm1_model()
+        return lambda: decode_file((ws.dseqs(), ws.scratch('probs')), model)
+
+@author: wilkeraziz
+"""
+
+import os
+import zlib
+import logging
+import numpy as np
+from collections import OrderedDict, namedtuple
+from discourse.benchmark import synthetic
+from discourse.executor import load_once
+from discourse.util import iterdocuments, encode_documents
+
+
+# sizes of the synthetic data
+Config = namedtuple('Config', 'seed docs sentences length vocab systems entities depth rounds')
+
+# presets (laptop-sized: 'small' runs every scenario in a few seconds on a single CPU)
+PRESETS = OrderedDict([
+    ('tiny', Config(seed=1, docs=20, sentences=10, length=5, vocab=200, systems=5, entities=10, depth=5, rounds=100)),
+    ('small', Config(seed=1, docs=200, sentences=20, length=8, vocab=1000, systems=10, entities=20, depth=6, rounds=1000)),
+    ('medium', Config(seed=1, docs=1000, sentences=30, length=10, vocab=5000, systems=20, entities=30, depth=7, rounds=1000)),
+    ])
+
+# scenario name -> factory (see `scenario`)
+_SCENARIOS_ = OrderedDict()
+
+
+class scenario(object):
+    """A decorator which declares a scenario by name (e.g. 'ibm1:train')"""
+
+    def __init__(self, name):
+        self.name_ = name
+
+    def __call__(self, factory):
+        if self.name_ in _SCENARIOS_ and _SCENARIOS_[self.name_] is not factory:
+            raise Exception('Conflicting scenario: %s' % self.name_)
+        _SCENARIOS_[self.name_] = factory
+        return factory
+
+
+def iterscenarios():
+    """iterates over (name, factory) in the order scenarios were declared"""
+    return _SCENARIOS_.iteritems()
+
+
+class Workspace(object):
+    """
+    Synthetic data for a given configuration, files are generated on demand and reused across scenarios (and runs).
+    Every artifact is generated from its own RandomState (seeded by the configuration seed and the artifact),
+    thus an artifact does not depend on which other artifacts were generated before it.
+    """
+
+    def __init__(self, path, config):
+        self.config = config
+        self.path = '{0}/{1}'.format(path, '-'.join(str(v) for v in config))
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._memo = {}
+
+    def rng(self, artifact):
+        return np.random.RandomState([self.config.seed, zlib.crc32(artifact) & 0xffffffff])
+
+    def scratch(self, name):
+        """a path for outputs of scenarios"""
+        return '{0}/scratch.{1}'.format(self.path, name)
+
+    def _file(self, name, write):
+        path = '{0}/{1}'.format(self.path, name)
+        if not os.path.exists(path):
+            logging.info('Generating %s', path)
+            with open(path + '.tmp', 'w') as fo:
+                write(fo, self.rng(name))
+            os.rename(path + '.tmp', path)
+        return path
+
+    def dseqs(self):
+        """a corpus of d-sequences (doctext)"""
+        c = self.config
+        return self._file('dseqs', lambda fo, rng: synthetic.write_dseqs(fo, rng, c.docs, c.sentences, c.length, c.vocab))
+
+    def trees(self):
+        """a corpus of parse trees (doctext), a tenth of the size of the d-sequence corpus"""
+        c = self.config
+        return self._file('trees', lambda fo, rng: synthetic.write_trees(fo, rng, max(1, c.docs // 10), c.sentences, c.depth))
+
+    def grids(self):
+        """a corpus of entity grids (doctext)"""
+        c = self.config
+        return self._file('grids', lambda fo, rng: synthetic.write_grids(fo, rng, c.docs, c.sentences, c.entities))
+
+    def scores(self):
+        """scores[s,d] of systems (rounded to produce ties)"""
+        if 'scores' not in self._memo:
+            c = self.config
+            self._memo['scores'] = synthetic.scores(self.rng('scores'), c.systems, c.docs * 10, decimals=1)
+        return self._memo['scores']
+
+    def rankings(self):
+        """R[d,s]: rankings of systems (as read by `discourse.significance`) and system names"""
+        if 'rankings' not in self._memo:
+            from discourse.rankings import rank_systems
+            order, ranks = rank_systems(self.scores())
+            self._memo['rankings'] = (ranks.T, synthetic.system_names(self.config.systems))
+        return self._memo['rankings']
+
+    def ibm1_model(self):
+        from discourse.syntax_based.ibm1 import train_model
+        path = '{0}/ibm1.t1'.format(self.path)
+        if not os.path.exists(path):
+            with open(self.dseqs()) as fi, open(path, 'w') as fo:
+                train_model(fi, fo, max_iterations=5)
+        return path
+
+    def alouis_model(self):
+        from discourse.syntax_based.alouis import train_model
+        prefix = '{0}/alouis'.format(self.path)
+        if not os.path.exists(prefix + '.bigrams'):
+            with open(self.dseqs()) as fi:
+                train_model(fi, prefix, smoothing=0.001)
+        return prefix + '.unigrams', prefix + '.bigrams'
+
+    def grid_model(self):
+        from discourse.entity_based.grid import train_model
+        prefix = '{0}/grid'.format(self.path)
+        if not os.path.exists(prefix + '.bigrams'):
+            with open(self.grids()) as fi:
+                train_model(fi, prefix)
+        return prefix + '.unigrams', prefix + '.bigrams'
+
+
+@scenario('util:encode_documents')
+def encode(ws):
+    path = ws.dseqs()
+    def run():
+        with open(path) as fi:
+            encode_documents(iterdocuments(fi))
+    return run
+
+
+@scenario('util:smart_open:write')
+def gzip_write(ws):
+    from discourse.util import smart_open
+    with open(ws.dseqs()) as fi:
+        data = fi.read()
+    def run():
+        with smart_open(ws.scratch('dseqs.gz'), 'w') as fo:
+            fo.write(data)
+    return run
+
+
+@scenario('util:smart_open:read')
+def gzip_read(ws):
+    from discourse.util import smart_open
+    path = ws.scratch('dseqs.gz')
+    with open(ws.dseqs()) as fi, smart_open(path, 'w') as fo:
+        fo.write(fi.read())
+    def run():
+        with smart_open(path) as fi:
+            for line in fi:
+                pass
+    return run
+
+
+@scenario('ibm1:train')
+def ibm1_train(ws):
+    from discourse.syntax_based.ibm1 import train_model
+    path = ws.dseqs()
+    def run():
+        with open(path) as fi, open(ws.scratch('ibm1.t1'), 'w') as fo:
+            train_model(fi, fo, max_iterations=5)
+    return run
+
+
+@scenario('ibm1:decode')
+def ibm1_decode(ws):
+    from discourse.syntax_based.ibm1_decoder import decode_file, load_model
+    model = ws.ibm1_model()
+    load_once(load_model, model)  # loading the model is not part of the scenario
+    return lambda: decode_file((ws.dseqs(), ws.scratch('ibm1.probs')), model)
+
+
+@scenario('alouis:train')
+def alouis_train(ws):
+    from discourse.syntax_based.alouis import train_model
+    path = ws.dseqs()
+    def run():
+        with open(path) as fi:
+            train_model(fi, ws.scratch('alouis'), smoothing=0.001)
+    return run
+
+
+@scenario('alouis:decode')
+def alouis_decode(ws):
+    from discourse.syntax_based.alouis_decoder import decode_file, load_model
+    unigrams, bigrams = ws.alouis_model()
+    load_once(load_model, unigrams, bigrams)
+    return lambda: decode_file((ws.dseqs(), ws.scratch('alouis.probs')), unigrams, bigrams, 0.001)
+
+
+@scenario('grid:train')
+def grid_train(ws):
+    from discourse.entity_based.grid import train_model
+    path = ws.grids()
+    def run():
+        with open(path) as fi:
+            train_model(fi, ws.scratch('grid'))
+    return run
+
+
+@scenario('grid:decode')
+def grid_decode(ws):
+    from discourse.entity_based.grid_decoder import decode_file, load_model
+    unigrams, bigrams = ws.grid_model()
+    load_once(load_model, unigrams, bigrams)
+    return lambda: decode_file((ws.grids(), ws.scratch('grid.probs')), unigrams, bigrams, 0)
+
+
+@scenario('dseq:extract')
+def dseq_extract(ws):
+    from discourse.doctext import iterdoctext
+    from discourse.syntax_based.dseq import dseqs
+    import nltk  # importing nltk is not part of the scenario
+    path = ws.trees()
+    def run():
+        with open(path) as fi:
+            for trees, attrs in iterdoctext(fi):
+                [dseqs(tree, depth=2) for tree in trees]
+    return run
+
+
+@scenario('rankings:rank')
+def rankings_rank(ws):
+    from discourse.rankings import rank_systems, format_rankings
+    scores = ws.scores()
+    names = synthetic.system_names(ws.config.systems)
+    def run():
+        order, ranks = rank_systems(scores)
+        format_rankings(order, ranks, names)
+    return run
+
+
+@scenario('significance:bootstrap')
+def significance_bootstrap(ws):
+    from discourse.significance import Resampler, assess_first, assess_comparisons
+    R, systems = ws.rankings()
+    rounds = ws.config.rounds
+    def run():
+        resampler = Resampler(ws.config.seed)
+        resampler.confidence_intervals('first', R, rounds, assess_first)
+        resampler.paired_bootstrap_resampling_pairwise('comparisons', R, rounds, assess_comparisons)
+    return run
+
+
+@scenario('significance:randomization')
+def significance_randomization(ws):
+    from discourse.significance import Resampler
+    R, systems = ws.rankings()
+    rounds = ws.config.rounds
+    return lambda: Resampler(ws.config.seed).approximate_randomization_pairwise('ar', R, rounds)
@@ -0,0 +1,115 @@
+"""
+Deterministic synthetic data for benchmarks: d-sequence corpora, parse trees, entity grids and scores of systems.
+
+Everything is drawn from a numpy RandomState, thus the same seed (and sizes) always produces the same data.
+Corpora are written in the formats the models read (doctext), so that benchmarks exercise the actual I/O paths.
+
+    * d-sequences: patterns follow a Zipfian distribution (as syntactic patterns do), sentence lengths are Poisson
+    * parse trees: PTB-formatted strings with a vocabulary of labels and words (see `discourse.syntax_based.dseq`)
+    * entity grids: sentences by entities, most cells are empty ('-') and mentioned entities take roles S, O or X
+    * scores: per system and document, systems are slightly shifted so that rankings are neither random nor constant
+
+@author: wilkeraziz
+"""
+
+import numpy as np
+from discourse.doctext import writedoctext
+
+
+def zipf_probabilities(vocab_size, exponent=1.1):
+    """p(k) proportional to 1/(k+1)^exponent"""
+    p = 1.0 / np.arange(1, vocab_size + 1) ** exponent
+    return p / p.sum()
+
+
+def patterns(vocab_size):
+    """names of synthetic d-sequence patterns (they look like 'NP*DT')"""
+    return ['P{0}*C{1}'.format(i // 10, i % 10) for i in xrange(vocab_size)]
+
+
+def dseq_documents(rng, docs, sentences, length, vocab_size, exponent=1.1):
+    """
+    Generates documents of d-sequences.
+
+    Arguments
+    ---------
+    rng: a RandomState
+    docs: number of documents
+    sentences: average number of sentences per document (Poisson, at least 1)
+    length: average number of patterns per sentence (Poisson, at least 1)
+    vocab_size: number of distinct patterns
+    exponent: of the Zipfian distribution over patterns
+
+    Returns
+    -------
+    generator of documents, each a list of sentences (strings of space separated patterns)
+    """
+    vocab = np.array(patterns(vocab_size), dtype=object)
+    p = zipf_probabilities(vocab_size, exponent)
+    for d in xrange(docs):
+        n = max(1, rng.poisson(sentences))
+        lengths = np.maximum(1, rng.poisson(length, size=n))
+        tokens = vocab[rng.choice(vocab_size, size=lengths.sum(), p=p)]
+        bounds = np.concatenate(([0], np.cumsum(lengths)))
+        yield [' '.join(tokens[bounds[i]:bounds[i + 1]]) for i in xrange(n)]
+
+
+def write_dseqs(ostream, rng, docs, sentences, length, vocab_size, prefix='doc'):
+    """writes a corpus of d-sequences in doctext format (see `dseq_documents`)"""
+    for d, lines in enumerate(dseq_documents(rng, docs, sentences, length, vocab_size)):
+        writedoctext(ostream, lines, id='{0}{1}'.format(prefix, d))
+
+
+def ptb_tree(rng, labels, words, depth, branching=3):
+    """
+    Generates a PTB-formatted tree whose leaves are at most `depth` levels below the root.
+    Internal nodes have between 1 and `branching` children, preterminals dominate a single word.
+    """
+    if depth <= 1:
+        return '({0} {1})'.format(labels[rng.randint(len(labels))], words[rng.randint(len(words))])
+    children = [ptb_tree(rng, labels, words, depth - 1 - rng.randint(2), branching)
+            for _ in xrange(1 + rng.randint(branching))]
+    return '({0} {1})'.format(labels[rng.randint(len(labels))], ' '.join(children))
+
+
+def write_trees(ostream, rng, docs, sentences, depth, labels=40, words=1000, prefix='doc'):
+    """writes a corpus of parse trees in doctext format (one tree per line, wrapped by a ROOT node)"""
+    labels = ['L{0}'.format(i) for i in xrange(labels)]
+    words = ['w{0}'.format(i) for i in xrange(words)]
+    for d in xrange(docs):
+        n = max(1, rng.poisson(sentences))
+        writedoctext(ostream, ['(ROOT {0})'.format(ptb_tree(rng, labels, words, depth)) for _ in xrange(n)],
+                id='{0}{1}'.format(prefix, d))
+
+
+# roles of the entity grid and how often an entity takes each of them in a sentence
+_ROLES_ = np.array(['-', 'X', 'O', 'S'])
+_ROLE_PROBABILITIES_ = np.array([0.85, 0.05, 0.04, 0.06])
+
+
+def write_grids(ostream, rng, docs, sentences, entities, prefix='doc'):
+    """
+    Writes a corpus of entity grids in doctext format (one line per sentence, one character per entity).
+    Documents have on average `sentences` sentences and `entities` entities (Poisson, at least 1).
+    """
+    for d in xrange(docs):
+        n = max(1, rng.poisson(sentences))
+        m = max(1, rng.poisson(entities))
+        grid = _ROLES_[rng.choice(len(_ROLES_), size=(n, m), p=_ROLE_PROBABILITIES_)]
+        writedoctext(ostream, [''.join(row) for row in grid], id='{0}{1}_grid'.format(prefix, d))
+
+
+def system_names(systems):
+    """names of synthetic systems, the last one is a reference (see `discourse.significance.get_refsysid`)"""
+    return ['sys{0}'.format(s) for s in xrange(systems - 1)] + ['sys.ref']
+
+
+def scores(rng, systems, docs, spread=1.0, decimals=None):
+    """
+    Generates scores[s,d]: a document effect plus a system effect plus noise.
+    With `decimals` scores are rounded (which produces ties).
+    """
+    S = rng.normal(0, 10, size=docs)[np.newaxis,:] + \
+            np.linspace(0, spread, systems)[:,np.newaxis] + \
+            rng.normal(0, 1, size=(systems, docs))
+    return np.round(S, decimals) if decimals is not None else S
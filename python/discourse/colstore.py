@@ -0,0 +1,120 @@
+"""
+A columnar binary store for per-document scores and rankings.
+
+A store is a single file made of a small JSON header followed by named columns (numpy arrays),
+each column is laid out contiguously (and aligned) so that readers memory-map it rather than parse it.
+The header also keeps an index of systems (e.g. the systems of a ranking matrix) and arbitrary attributes.
+
+    ---------------------------------------------------
+    MAGIC (8 bytes)
+    header length H (8 bytes, little-endian)
+    header (H bytes of JSON)
+    padding up to a multiple of ALIGNMENT
+    columns (each starts at a multiple of ALIGNMENT)
+    ---------------------------------------------------
+
+Example:
+
+    write_columns('scores', [('doc', np.arange(3)), ('logprob', np.array([-1.5, -2., -0.3]))])
+    store = ColumnStore('scores')
+    store['logprob']  # a read-only memory map
+    store[1]          # columns can also be selected by position (as the columns of a text file)
+
+@author: wilkeraziz
+"""
+
+import json
+import struct
+import numpy as np
+from collections import OrderedDict
+
+
+MAGIC = '\x93DCOLS1\n'
+# columns start at multiples of this many bytes
+ALIGNMENT = 64
+
+
+def _aligned(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_store(path):
+    """whether a file is a columnar store (rather than, say, a text file)"""
+    try:
+        with open(path, 'rb') as fi:
+            return fi.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def write_columns(output, columns, systems=None, **attrs):
+    """
+    Writes a columnar store.
+
+    Arguments
+    ---------
+    output: a path or a binary output stream
+    columns: a list of (name, array)
+    systems: an (optional) index of systems (a list of names)
+    attrs: (optional) JSON-serialisable attributes
+    """
+    columns = [(name, np.ascontiguousarray(array)) for name, array in columns]
+    specs = []
+    offset = 0
+    for name, array in columns:
+        specs.append({'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset})
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({'columns': specs, 'systems': systems, 'attrs': attrs})
+    start = _aligned(len(MAGIC) + 8 + len(header))
+
+    ostream = open(output, 'wb') if isinstance(output, basestring) else output
+    try:
+        ostream.write(MAGIC)
+        ostream.write(struct.pack('<Q', len(header)))
+        ostream.write(header)
+        ostream.write('\0' * (start - len(MAGIC) - 8 - len(header)))
+        position = 0
+        for spec, (name, array) in zip(specs, columns):
+            ostream.write('\0' * (spec['offset'] - position))
+            ostream.write(array.tobytes())
+            position = spec['offset'] + array.nbytes
+    finally:
+        if ostream is not output:
+            ostream.close()
+
+
+class ColumnStore(object):
+    """
+    A columnar store opened for reading, columns are memory-mapped (read-only) on demand.
+    Columns are selected by name or by position.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fi:
+            if fi.read(len(MAGIC)) != MAGIC:
+                raise ValueError('Not a columnar store: %s' % path)
+            size, = struct.unpack('<Q', fi.read(8))
+            header = json.loads(fi.read(size))
+        self._start = _aligned(len(MAGIC) + 8 + size)
+        self._specs = OrderedDict((spec['name'], spec) for spec in header['columns'])
+        self.systems = header['systems']
+        self.attrs = header['attrs']
+
+    @property
+    def names(self):
+        """column names in order"""
+        return self._specs.keys()
+
+    def __len__(self):
+        return len(self._specs)
+
+    def __contains__(self, name):
+        return name in self._specs
+
+    def __getitem__(self, key):
+        spec = self._specs[self.names[key] if isinstance(key, (int, long)) else key]
+        dtype, shape = np.dtype(str(spec['dtype'])), tuple(spec['shape'])
+        if not np.prod(shape, dtype=int):  # empty arrays cannot be mapped
+            return np.empty(shape, dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=self._start + spec['offset'], shape=shape)
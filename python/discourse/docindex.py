@@ -0,0 +1,423 @@
+"""
+Byte-offset indexes of doctext files: random access to documents and balanced shards of large files.
+
+The index of a file PATH is kept in a sidecar PATH.idx (a columnar store, see `discourse.colstore`) with,
+for every document, the byte range from its header to its last line, its number of lines (sentences) and its header.
+An index is rebuilt whenever the file it describes changes (size, modification time or inode, see `signature`).
+
+Gzipped files are indexed by uncompressed offsets, along with the offsets at which gzip members start.
+A document is fetched by decompressing from the start of the member which contains it,
+thus files written in blocks (see `write_blocks`: each member holds whole documents, or `util.smart_open`) are fetched
+in time proportional to the size of a block, whereas a file made of a single member is decompressed from its beginning.
+
+Example:
+
+    index = DocIndex.load('newstest2014.trees')   # built and saved if need be
+    lines, attrs = index[10]                       # the 11th document
+    k = index.find('0184159f2a3e6320801b38d99683139f')
+    for i, j in index.shards(4):                   # 4 ranges of documents with about the same number of sentences
+        for lines, attrs in index.iterdocs(i, j):
+            ...
+
+@author: wilkeraziz
+"""
+
+import io
+import os
+import logging
+import argparse
+import numpy as np
+from itertools import izip
+from cStringIO import StringIO
+from discourse import command
+from discourse.doctext import scandoctext, iterdoctext, parseheader
+from discourse.colstore import ColumnStore, write_columns, is_store
+from discourse.util import smart_open
+from discourse.pgzip import GzipMembers, compress_member
+
+
+SUFFIX = '.idx'
+# bumped whenever the layout of the sidecar (or the signature of its source) changes
+VERSION = 2
+# uncompressed bytes per member written by `write_blocks`
+_BLOCK_SIZE_ = 1 << 20
+
+
+def is_gzip(path):
+    with open(path, 'rb') as fi:
+        return fi.read(2) == '\x1f\x8b'
+
+
+class DocIndex(object):
+    """
+    An index of the documents in a doctext file (plain or gzipped).
+
+    Attributes
+    ----------
+    path: the doctext file
+    starts, ends: byte ranges of documents (uncompressed offsets)
+    lines: number of lines (sentences) per document
+    headers: header lines
+    members: for gzipped files, (compressed offsets, uncompressed starts) of gzip members, None otherwise
+    """
+
+    def __init__(self, path, starts, ends, lines, headers, members=None):
+        self.path = path
+        self.starts = starts
+        self.ends = ends
+        self.lines = lines
+        self.headers = headers
+        self.members = members
+        self._positions = {}
+
+    @classmethod
+    def build(cls, path, chunk_size=1 << 23):
+        """scans a file and indexes its documents"""
+        gzipped = is_gzip(path)
+        with open(path, 'rb') as fi:
+            istream = GzipMembers(fi) if gzipped else fi
+            starts, ends, lines, headers = [], [], [], []
+            for start, end, n, header in scandoctext(istream, chunk_size):
+                starts.append(start)
+                ends.append(end)
+                lines.append(n)
+                headers.append(header)
+            members = (np.array(istream.offsets, dtype=np.int64), np.array(istream.starts, dtype=np.int64)) if gzipped else None
+        logging.info('Indexed %d documents in %s', len(starts), path)
+        return cls(path, np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64), np.array(lines, dtype=np.int64),
+                headers, members)
+
+    @classmethod
+    def load(cls, path, build=True, save=True):
+        """
+        Loads the index of a file from its sidecar.
+
+        Arguments
+        ---------
+        path: the doctext file
+        build: whether to (re)build the index if the sidecar is missing or stale (otherwise an IOError is raised)
+        save: whether to save a (re)built index (failing silently if the sidecar cannot be written)
+
+        >>> import tempfile, shutil
+        >>> tmp = tempfile.mkdtemp()
+        >>> path = os.path.join(tmp, 'docs')
+        >>> with open(path, 'w') as fo:
+        ...     fo.write('# id=a\\n1\\n2\\n\\n# id=b\\n3\\n')
+        >>> DocIndex.load(path, build=False)  # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        IOError: No index for .../docs
+        >>> DocIndex.load(path)[0], os.path.exists(path + SUFFIX)
+        ((['1', '2'], {'id': 'a'}), True)
+
+        A file replaced by another of the same size (even within the same second) makes its index stale
+
+        >>> with open(path + '.new', 'w') as fo:
+        ...     fo.write('# id=a\\n1\\n\\n# id=b\\n2\\n3\\n')
+        >>> os.rename(path + '.new', path)
+        >>> DocIndex.load(path, build=False)  # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        IOError: No index for .../docs
+        >>> index = DocIndex.load(path)
+        >>> index[0], index[1]
+        ((['1'], {'id': 'a'}), (['2', '3'], {'id': 'b'}))
+        >>> shutil.rmtree(tmp)
+        """
+        sidecar = path + SUFFIX
+        if is_store(sidecar):
+            store = ColumnStore(sidecar)
+            if store.attrs.get('version') == VERSION and store.attrs.get('source') == signature(path):
+                blob = store['headers'].tobytes()
+                bounds = np.concatenate(([0], store['header_ends']))
+                headers = [blob[a:b] for a, b in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+                members = (np.array(store['member_offsets']), np.array(store['member_starts'])) if 'member_offsets' in store else None
+                return cls(path, np.array(store['starts']), np.array(store['ends']), np.array(store['lines']), headers, members)
+            logging.info('Stale index: %s', sidecar)
+        if not build:
+            raise IOError('No index for %s' % path)
+        index = cls.build(path)
+        if save:
+            try:
+                index.save()
+            except (IOError, OSError) as e:
+                logging.warning('Could not save the index of %s: %s', path, e)
+        return index
+
+    def save(self, sidecar=None):
+        """saves the index (by default, next to the file it describes)"""
+        headers = np.frombuffer(''.join(self.headers), dtype=np.uint8)
+        columns = [('starts', self.starts), ('ends', self.ends), ('lines', self.lines), ('headers', headers),
+                ('header_ends', np.cumsum([len(h) for h in self.headers], dtype=np.int64))]
+        if self.members is not None:
+            columns.extend([('member_offsets', self.members[0]), ('member_starts', self.members[1])])
+        sidecar = self.path + SUFFIX if sidecar is None else sidecar
+        # written aside and renamed, so that processes which load the index concurrently never see half of it
+        tmp = '{0}.{1}.tmp'.format(sidecar, os.getpid())
+        write_columns(tmp, columns, version=VERSION, source=signature(self.path))
+        os.rename(tmp, sidecar)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def attrs(self, k):
+        """the attributes (header) of the kth document"""
+        return parseheader(self.headers[k])
+
+    def find(self, value, key='docid'):
+        """the position of the document whose attribute `key` has a certain value (a KeyError is raised if none does)"""
+        positions = self._positions.get(key, None)
+        if positions is None:
+            positions = {}
+            for k, header in enumerate(self.headers):
+                positions.setdefault(parseheader(header).get(key, None), k)
+            self._positions[key] = positions
+        return positions[value]
+
+    def text(self, i, j):
+        """
+        the bytes spanned by documents i to j-1
+
+        >>> import tempfile
+        >>> text = ''.join('# id={0}\\na b\\nc\\n\\n'.format(k) for k in range(5))
+        >>> with tempfile.NamedTemporaryFile(suffix='.gz') as fo:
+        ...     write_blocks(StringIO(text), fo, block_size=20)
+        ...     fo.flush()
+        ...     index = DocIndex.build(fo.name)
+        ...     len(index.members[0]), index.text(1, 4) == text[14:14 * 4 - 2], index[4]
+        (3, True, (['a b', 'c'], {'id': '4'}))
+        """
+        if i >= j:
+            return ''
+        a, b = int(self.starts[i]), int(self.ends[j - 1])
+        with open(self.path, 'rb') as fi:
+            if self.members is None:
+                fi.seek(a)
+                return fi.read(b - a)
+            # decompresses from the member where the first document starts
+            m = int(np.searchsorted(self.members[1], a, side='right')) - 1
+            istream = GzipMembers(fi, int(self.members[0][m]), int(self.members[1][m]))
+            position = int(self.members[1][m])
+            chunks = []
+            while position < b:
+                data = istream.read(min(_BLOCK_SIZE_, b - position))
+                if not data:
+                    break
+                chunks.append(data)
+                position += len(data)
+            data = ''.join(chunks)
+            skip = a - int(self.members[1][m])
+            return data[skip:skip + b - a]
+
+    def iterdocs(self, i=0, j=None):
+        """iterates over documents i to j-1: (lines, attrs)"""
+        j = len(self) if j is None else min(j, len(self))
+        return iterdoctext(StringIO(self.text(i, j)))
+
+    def __getitem__(self, k):
+        """the kth document: (lines, attrs)"""
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError('No document %d in %s' % (k, self.path))
+        return next(self.iterdocs(k, k + 1))
+
+    def shards(self, n):
+        """
+        Splits the documents in at most n contiguous ranges with about the same number of sentences.
+
+        Returns
+        -------
+        a list of (first, last + 1) document positions
+        """
+        return balanced_ranges(self.lines, n)
+
+
+def balanced_ranges(sizes, n):
+    """
+    Splits a sequence of items (with sizes) into at most n contiguous non-empty ranges with about the same total size.
+
+    >>> balanced_ranges([5, 1, 1, 1, 1, 1, 5], 3)
+    [(0, 1), (1, 6), (6, 7)]
+    >>> balanced_ranges([1, 1], 4)
+    [(0, 1), (1, 2)]
+    """
+    if not len(sizes):
+        return []
+    cumulative = np.cumsum(sizes)
+    targets = cumulative[-1] * np.arange(1, n) / float(n)
+    # a range ends after the item at which the cumulative size reaches its target
+    cuts = np.searchsorted(cumulative, targets) + 1
+    bounds = np.unique(np.concatenate(([0], np.minimum(cuts, len(sizes)), [len(sizes)])))
+    return zip(bounds[:-1].tolist(), bounds[1:].tolist())
+
+
+def shard_files(paths, n):
+    """
+    Splits the documents in several files into about n tasks with about the same number of sentences,
+    each file gets a number of shards proportional to its number of sentences (at least one).
+
+    Returns
+    -------
+    a list of (path, first, last + 1) in the order of the files
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> paths = [os.path.join(tmp, name) for name in ['big', 'small', 'empty']]
+    >>> for path, n in zip(paths, [6, 1, 0]):
+    ...     with open(path, 'w') as fo:
+    ...         fo.write(''.join('# id={0}\\na\\nb\\n\\n'.format(k) for k in range(n)))
+    >>> [(os.path.basename(path), i, j) for path, i, j in shard_files(paths, 4)]
+    [('big', 0, 2), ('big', 2, 4), ('big', 4, 6), ('small', 0, 1), ('empty', 0, 0)]
+    >>> shutil.rmtree(tmp)
+    """
+    indexes = [DocIndex.load(path) for path in paths]
+    total = float(sum(index.lines.sum() for index in indexes)) or 1.0
+    tasks = []
+    for path, index in zip(paths, indexes):
+        k = max(1, int(round(n * index.lines.sum() / total)))
+        tasks.extend((path, i, j) for i, j in (index.shards(k) or [(0, 0)]))
+    return tasks
+
+
+def open_documents(path, first=0, last=None):
+    """
+    Opens a doctext file (plain or gzipped) for reading, or only documents first to last-1 if a range is given
+    (in which case the file is indexed, see `DocIndex.load`).
+    """
+    if first == 0 and last is None:
+        return smart_open(path)
+    index = DocIndex.load(path)
+    return io.BytesIO(index.text(first, len(index) if last is None else last))
+
+
+def map_shards(executor, func, paths, n, **kwargs):
+    """
+    Runs func((path, first, last), **kwargs) in an executor for balanced shards of several files (see `shard_files`).
+
+    Returns
+    -------
+    for each file (in order), the results of its shards (in order)
+    """
+    tasks = shard_files(paths, n)
+    logging.info('Distributing %d shards of %d files', len(tasks), len(paths))
+    results = executor.map(func, tasks, **kwargs)
+    grouped = dict((path, []) for path in paths)
+    for (path, first, last), result in izip(tasks, results):
+        grouped[path].append(result)
+    return [grouped[path] for path in paths]
+
+
+class _Recorder(object):
+    """a stream which keeps what is read from another one (until `take` is called)"""
+
+    def __init__(self, istream):
+        self.istream = istream
+        self.chunks = []
+
+    def read(self, size=-1):
+        data = self.istream.read(size)
+        self.chunks.append(data)
+        return data
+
+    def take(self):
+        data = ''.join(self.chunks)
+        del self.chunks[:]
+        return data
+
+
+def write_blocks(istream, ostream, block_size=_BLOCK_SIZE_):
+    """
+    Writes documents (doctext) as a gzip file made of several members, each of which holds whole documents
+    (about block_size uncompressed bytes), thus documents can be fetched by decompressing a single member.
+    The output is a regular gzip file (tools such as zcat read it as usual).
+    The input is read once (it need not be seekable, e.g. a gzip file).
+
+    Arguments
+    ---------
+    istream: doctext (uncompressed)
+    ostream: a binary stream
+
+    >>> text = 'leading\\n' + ''.join('# id={0}\\na b\\nc\\n\\n'.format(k) for k in range(5)) + 'trailing'
+    >>> fo = StringIO()
+    >>> write_blocks(StringIO(text), fo, block_size=20)
+    >>> members = GzipMembers(StringIO(fo.getvalue()))
+    >>> members.read() == text, len(members.offsets)
+    (True, 3)
+    """
+    recorder = _Recorder(istream)
+    pending = ''  # bytes read but not yet written
+    offset = 0  # offset of pending in the stream
+    # text before the first document and after the last one is kept (with the first and last blocks)
+    for k, (start, end, n, header) in enumerate(scandoctext(recorder)):
+        if k and start - offset >= block_size:
+            pending += recorder.take()
+            ostream.write(compress_member(pending[:start - offset]))
+            pending = pending[start - offset:]
+            offset = start
+    ostream.write(compress_member(pending + recorder.take()))
+
+
+def signature(path):
+    """identifies the state of a file (its index is stale if this changes): size, modification time (with its fraction) and inode"""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime, st.st_ino]
+
+
+def main(args):
+    logging.basicConfig(
+            level=(logging.DEBUG if args.verbose else logging.INFO),
+            format='%(levelname)s %(message)s')
+    for path in args.input:
+        if args.blocks:
+            output = args.blocks if len(args.input) == 1 else '{0}/{1}.gz'.format(args.blocks, os.path.basename(path))
+            with smart_open(path) as fi, open(output, 'wb') as fo:
+                write_blocks(fi, fo, args.block_size)
+            path = output
+        index = DocIndex.build(path) if args.force else DocIndex.load(path)
+        if args.force:
+            index.save()
+        print '{0}\t{1}\t{2}'.format(path, len(index), index.lines.sum())
+        if args.shards:
+            for i, j in index.shards(args.shards):
+                print '\t{0}\t{1}\t{2}'.format(i, j, index.lines[i:j].sum())
+
+
+@command('docindex', 'preprocessing')
+def argparser(parser=None, func=main):
+    """parse command line arguments"""
+
+    if parser is None:
+        parser = argparse.ArgumentParser(prog='docindex')
+
+    parser.description = 'Index doctext files (byte offsets of documents) for random access and sharding'
+    parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
+
+    parser.add_argument('input', nargs='+',
+            type=str,
+            help='doctext files (plain or gzipped), their indexes are saved next to them (with suffix %s)' % SUFFIX)
+    parser.add_argument('--force', '-f',
+            action='store_true',
+            help='rebuild indexes even if they are up to date')
+    parser.add_argument('--shards', '-s',
+            type=int, default=0,
+            help='also print this many shards (ranges of documents) balanced by number of sentences')
+    parser.add_argument('--blocks', '-b',
+            type=str,
+            help='rewrite input as a gzip file made of blocks of whole documents (a path, or a directory for several inputs) and index that instead')
+    parser.add_argument('--block-size',
+            type=int, default=_BLOCK_SIZE_,
+            help='uncompressed bytes per block (see --blocks)')
+    parser.add_argument('--verbose', '-v',
+            action='store_true',
+            help='increase the verbosity level')
+
+    if func is not None:
+        parser.set_defaults(func=func)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = argparser().parse_args()
+    args.func(args)
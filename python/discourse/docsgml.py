@@ -5,6 +5,7 @@ It deals with multiple documents in a single XML file.
 
 In addition, it implements a wrapper to mini dom that eases the creation of simple 
 sgml-formatted document container files.
+`SGMLDocsWriter` writes such files as documents are added (rather than keeping a DOM in memory).
 
 @author: wilkeraziz
 """
@@ -17,6 +18,10 @@ from functools import partial
 from discourse import command
 
 
+# bytes fed to expat at a time (see `TextFromSGML.iterstream`)
+_CHUNK_SIZE_ = 1 << 20
+
+
 class TextFromSGML(object):
 
     def __init__(self, content, text_under, root=None):
@@ -26,6 +31,59 @@ class TextFromSGML(object):
         :param str text_under: tag name under which we will find text (e.g. doc, text)
         :param str root: if not None, it is interpreted as the single root tag name to be added to the XML content
         """
+        parser, state = TextFromSGML._make_parser(text_under)
+        # add root if necessary
+        if root is None:
+            parser.Parse(content, 1)
+        else:
+            parser.Parse('<{0}>{1}</{0}>'.format(root, content), 1)
+        # store parser's state
+        self._state = state
+
+    def iterdocs(self):
+        """Iterates over documents in a given sgm file -> content, attributes"""
+        for content, attrs in self._state['documents']:
+            yield content, attrs
+
+    @staticmethod
+    def iterstream(istream, text_under, root=None, chunk_size=_CHUNK_SIZE_):
+        """
+        Parses the XML content of a stream incrementally (expat is fed chunk_size bytes at a time),
+        documents are yielded as soon as they end, thus memory is bounded by the largest document (rather than the file).
+
+        :param istream: a file-like object (e.g. a gzip file) with a read method
+        :param str text_under: tag name under which we will find text (e.g. doc, text)
+        :param str root: if not None, it is interpreted as the single root tag name to be added to the XML content
+        :param int chunk_size: bytes read at a time
+        :returns: a generator of (content, attributes) as in `iterdocs`
+
+        >>> from StringIO import StringIO
+        >>> sgml = '<doc id="1">\\na\\nb &amp; c\\n</doc>\\n<doc id="2">\\nd\\n</doc>'
+        >>> list(TextFromSGML.iterstream(StringIO(sgml), text_under='doc', root='sgml', chunk_size=4))
+        [(['a', 'b & c'], {u'id': u'1'}), (['d'], {u'id': u'2'})]
+        >>> list(TextFromSGML(sgml, text_under='doc', root='sgml').iterdocs())
+        [(['a', 'b & c'], {u'id': u'1'}), (['d'], {u'id': u'2'})]
+        """
+        parser, state = TextFromSGML._make_parser(text_under)
+        documents = state['documents']
+        if root is not None:
+            parser.Parse('<{0}>'.format(root), 0)
+        while True:
+            chunk = istream.read(chunk_size)
+            if not chunk:
+                break
+            parser.Parse(chunk, 0)
+            # hands over the documents which ended within this chunk
+            for doc in documents:
+                yield doc
+            del documents[:]
+        parser.Parse('' if root is None else '</{0}>'.format(root), 1)
+        for doc in documents:
+            yield doc
+
+    @staticmethod
+    def _make_parser(text_under):
+        """creates an expat parser whose handlers collect documents in a state dict -> parser, state"""
         assert text_under is not None, 'You need to specify a text tag'
         parser = xml.parsers.expat.ParserCreate()
         # parser state
@@ -35,28 +93,19 @@ class TextFromSGML(object):
         # temporary data (e.g. curent document's id, sentences and status)
         state['_attrs'] = None
         state['_doc'] = None
+        state['_text'] = []
         state['_reading'] = False
         state['_text_under'] = text_under
         # handlers
         parser.StartElementHandler = partial(TextFromSGML._start_element, state=state)
         parser.EndElementHandler = partial(TextFromSGML._end_element, state=state)
         parser.CharacterDataHandler = partial(TextFromSGML._char_data, state=state)
-        # add root if necessary
-        if root is None:
-            parser.Parse(content, 1)
-        else:
-            parser.Parse('<{0}>{1}</{0}>'.format(root, content), 1)
-        # store parser's state
-        self._state = state
-
-    def iterdocs(self):
-        """Iterates over documents in a given sgm file -> content, attributes"""
-        for content, attrs in self._state['documents']:
-            yield content, attrs
+        return parser, state
 
     @staticmethod
     def _start_element(name, attrs, state):
         """starts a document"""
+        TextFromSGML._flush_text(state)
         if name.lower() == 'doc':
             state['_doc'] = []
             state['_attrs'] = dict(attrs)
@@ -66,6 +115,7 @@ class TextFromSGML(object):
     @staticmethod
     def _end_element(name, state):
         """ends a document"""
+        TextFromSGML._flush_text(state)
         if name.lower() == 'doc':
             state['documents'].append((state['_doc'], state['_attrs']))
             state['_doc'] = None
@@ -75,12 +125,20 @@ class TextFromSGML(object):
 
     @staticmethod
     def _char_data(txt_data, state):
-        """stores non blank lines in a document"""
+        """buffers text (expat may split a line across calls, e.g. where a chunk ends)"""
         if state['_reading']:
+            state['_text'].append(txt_data)
+
+    @staticmethod
+    def _flush_text(state):
+        """stores non blank lines of the buffered text in a document"""
+        if state['_text']:
             # encode utf-8 into a python string
-            line = txt_data.encode('utf-8').strip()
-            if line:
-                state['_doc'].append(line)
+            for line in ''.join(state['_text']).encode('utf-8').split('\n'):
+                line = line.strip()
+                if line:
+                    state['_doc'].append(line)
+            state['_text'] = []
 
 
 class MakeSGMLDocs(object):
@@ -125,6 +183,58 @@ class MakeSGMLDocs(object):
         ostream.write(self._docs.toprettyxml(encoding='utf-8'))
 
 
+class SGMLDocsWriter(object):
+    """
+    Writes documents to a stream as they are added, in the format of `MakeSGMLDocs.write` (documents as strings, see `add`),
+    thus a container file is written without keeping its documents in memory.
+
+    >>> import sys
+    >>> with SGMLDocsWriter(sys.stdout, file='x') as fo:  # doctest: +NORMALIZE_WHITESPACE
+    ...     fo.add('a < b\\nc', id='1')
+    ...     fo.add('d', id='2')
+    <?xml version="1.0" encoding="utf-8"?>
+    <docs file="x">
+        <doc id="1">a &lt; b
+    c</doc>
+        <doc id="2">d</doc>
+    </docs>
+    """
+
+    def __init__(self, ostream, **kwargs):
+        self._ostream = ostream
+        self._attrs = kwargs
+        self._docs = 0
+
+    @staticmethod
+    def _tag(name, attrs):
+        return '<{0}{1}'.format(name, ''.join(' {0}="{1}"'.format(k, _escape(v)) for k, v in sorted(attrs.iteritems())))
+
+    def add(self, doc_text, **kwargs):
+        """adds a document (as a string)"""
+        if not self._docs:
+            self._ostream.write('<?xml version="1.0" encoding="utf-8"?>\n{0}>\n'.format(SGMLDocsWriter._tag('docs', self._attrs)))
+        # checks that python strings are utf-8
+        self._ostream.write('\t{0}>{1}</doc>\n'.format(SGMLDocsWriter._tag('doc', kwargs), _escape(doc_text.decode('utf-8').encode('utf-8'))))
+        self._docs += 1
+
+    def close(self):
+        if not self._docs:
+            self._ostream.write('<?xml version="1.0" encoding="utf-8"?>\n{0}/>\n'.format(SGMLDocsWriter._tag('docs', self._attrs)))
+        else:
+            self._ostream.write('</docs>\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _escape(data):
+    """escapes text and attribute values as minidom does (unicode is encoded into utf-8)"""
+    return escape(data.encode('utf-8') if isinstance(data, unicode) else data, {'"': '&quot;'})
+
+
 def wmtbadsgml_iterdoc(istream, empty=''):
     """
     Parses WMT's baddly formatted SGML files.
@@ -376,7 +486,8 @@ def fixwmt_argparser(parser=None, func=fixwmt_main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
 
 
 _WMT_SGML_EXAMPLE_ =  \
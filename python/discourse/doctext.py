@@ -19,24 +19,101 @@ It has two sentences.
 # id=doc2
 This is another, this one has a single sentence.
 
+Readers:
+
+    * `iterdoctext`: (lines, attrs) per document, line by line
+    * `iterdocviews`: a `DocView` per document, that is, a buffer and the offsets of its lines (nothing is copied)
+    and a header which is only parsed if need be
+    * `scandoctext`: byte ranges and number of lines of documents in a stream (see `discourse.docindex`)
+
+Views are found by scanning large chunks with numpy (line breaks, blank lines and headers), thus without a Python loop per line.
+Consumers which can work with offsets (e.g. counting sentences, indexing, tokenising a document in one go,
+see `util.encode_docviews`) should prefer views,
+materialising lines (see `DocView.lines`) costs about as much as reading line by line, which is already as fast as
+allocating the strings.
+All readers agree on the semantics of the format.
+
 @author: wilkeraziz
 """
-from itertools import ifilter
+import mmap
+from itertools import ifilter, izip
 from discourse import command
 
 
+# bytes of input scanned at a time (chunks grow if a single document does not fit)
+_CHUNK_SIZE_ = 1 << 23
+# bytes which str.strip removes (other than the line break)
+_SPACES_ = ' \t\r\x0b\x0c'
+
+
+# bytes accumulated by a LineBuffer before a write
+_WRITE_SIZE_ = 1 << 20
+
+
+class LineBuffer(object):
+    """
+    Accumulates what is written (e.g. with print >>) and writes it out in large chunks, a single write per chunk.
+    The buffer is flushed when full, by flush and on exit (the underlying stream is left open).
+
+    >>> import sys
+    >>> with LineBuffer(sys.stdout) as fo:
+    ...     print >> fo, 'a', 1
+    ...     fo.writelines(['b\\n', 'c\\n'])
+    a 1
+    b
+    c
+    """
+
+    def __init__(self, ostream, size=_WRITE_SIZE_):
+        self._ostream = ostream
+        self._size = size
+        self._chunks = []
+        self._buffered = 0
+        self.softspace = 0  # for print >>
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self._size:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self._chunks:
+            self._ostream.write(''.join(self._chunks))
+            self._chunks = []
+            self._buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+
 def writedoctext(ostream, lines, **kwargs):
     """
     Dumps a document (this function never writes empty lines within the document)
     :param ostream: where we are printing to
     :param lines: list of sentences in the document
     :param **kwargs: attributes of the document
+    The document is written with a single write (see `LineBuffer` to gather several documents in a write).
     """
     attr_str = ' '.join('{0}={1}'.format(k, v) for k, v in kwargs.iteritems())
-    print >> ostream, '# %s' % attr_str
-    for line in ifilter(lambda x: x.strip(), lines):
-        print >> ostream, line
-    print >> ostream
+    ostream.write('# %s\n%s\n' % (attr_str, ''.join(['%s\n' % line for line in ifilter(lambda x: x.strip(), lines)])))
+
+
+def parseheader(header):
+    """
+    Parses the attributes of a document from its header line.
+
+    >>> sorted(parseheader('# id=doc1 docid=abc').items())
+    [('docid', 'abc'), ('id', 'doc1')]
+    """
+    return {k:v for k, v in [kv.split('=') for kv in header.replace('#', '').split()]}
 
 
 def iterdoctext(istream):
@@ -50,8 +127,7 @@ def iterdoctext(istream):
         line = line.strip()
         if doc is None:
             if line.startswith('#'):
-                line = line.replace('#', '')
-                doc = {'attrs': {k:v for k, v in [kv.split('=') for kv in line.split()]},
+                doc = {'attrs': parseheader(line),
                         'lines': []}
         else:
             if line:
@@ -64,6 +140,225 @@ def iterdoctext(istream):
         yield doc['lines'], doc['attrs']
 
 
+class DocView(object):
+    """
+    A document as a view over a buffer (a string or a memory map): lines are buffer[starts[i]:ends[i]] (already stripped)
+    and the header is only parsed on demand (see `attrs`).
+    Views of a memory-mapped file are valid as long as the reader which produced them has not been exhausted or closed.
+    """
+
+    __slots__ = ['buffer', 'starts', 'ends', '_header', '_attrs', '_contiguous']
+
+    def __init__(self, buffer, header, starts, ends, contiguous):
+        self.buffer = buffer
+        self.starts = starts
+        self.ends = ends
+        self._header = header
+        self._attrs = None
+        self._contiguous = contiguous
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def header(self):
+        """the header line (as a string)"""
+        return str(self.buffer[self._header[0]:self._header[1]])
+
+    @property
+    def attrs(self):
+        """attributes of the document (parsed the first time they are needed)"""
+        if self._attrs is None:
+            self._attrs = parseheader(self.header)
+        return self._attrs
+
+    def lines(self):
+        """the content of the document (as a list of strings)"""
+        if not len(self.starts):
+            return []
+        if self._contiguous:  # lines need no stripping, thus a single split does
+            return self.buffer[self.starts[0]:self.ends[-1]].split('\n')
+        return [self.buffer[a:b] for a, b in izip(self.starts.tolist(), self.ends.tolist())]
+
+    def materialise(self):
+        """(lines, attrs) as produced by `iterdoctext`"""
+        return self.lines(), self.attrs
+
+
+def _scan(data, eof, base=0):
+    """
+    Finds documents in a chunk of data (a uint8 array which starts at offset `base` of a buffer).
+    Documents are delimited by blank lines, thus blocks of lines between blank lines can be scanned independently,
+    unless this is the last chunk (eof), the block after the last blank line is left for the next chunk.
+
+    Returns
+    -------
+    a list of documents (header start, header end, line starts, line ends, contiguous) and the number of bytes consumed,
+    offsets are relative to the buffer
+    """
+    import numpy as np
+    breaks = np.flatnonzero(data == 10)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [len(data)]))
+    if not eof or starts[-1] == len(data):  # an incomplete line or nothing at all after the last line break
+        starts, ends = starts[:-1], ends[:-1]
+    raw_starts, raw_ends = starts, ends
+    # strips lines (one byte at a time, but all lines at once)
+    spaces = _spaces()
+    starts = starts.copy()
+    padded = np.flatnonzero(starts < ends)
+    while len(padded):
+        padded = padded[spaces[data[starts[padded]]]]
+        starts[padded] += 1
+        padded = padded[starts[padded] < ends[padded]]
+    ends = ends.copy()
+    padded = np.flatnonzero(starts < ends)
+    while len(padded):
+        padded = padded[spaces[data[ends[padded] - 1]]]
+        ends[padded] -= 1
+        padded = padded[starts[padded] < ends[padded]]
+    blank = np.flatnonzero(starts == ends)
+    if eof:
+        consumed = len(data)
+        limit = len(starts)
+    elif len(blank):
+        consumed = raw_ends[blank[-1]] + 1
+        limit = blank[-1]
+    else:
+        return [], 0
+    # a header is the first line of a block which starts with '#'
+    hashed = np.flatnonzero(starts[:limit] < ends[:limit])
+    hashed = hashed[data[starts[hashed]] == 35]
+    block = np.searchsorted(blank, hashed)
+    first = np.ones(len(hashed), dtype=bool)
+    first[1:] = block[1:] != block[:-1]
+    headers = hashed[first]
+    stops = np.append(blank, len(starts))[block[first]]
+    # documents whose lines need no stripping can be split in one go
+    dirty = np.concatenate(([0], np.cumsum((starts != raw_starts) | (ends != raw_ends)))).tolist()
+    if base:
+        starts += base
+        ends += base
+    docs = []
+    for h, e, hs, he in izip(headers.tolist(), stops.tolist(), starts[headers].tolist(), ends[headers].tolist()):
+        docs.append((hs, he, starts[h + 1:e], ends[h + 1:e], dirty[e] == dirty[h + 1]))
+    return docs, consumed
+
+
+def _spaces():
+    """a lookup table of bytes which str.strip removes (other than the line break)"""
+    global _SPACES_TABLE_
+    if _SPACES_TABLE_ is None:
+        import numpy as np
+        _SPACES_TABLE_ = np.zeros(256, dtype=bool)
+        _SPACES_TABLE_[[ord(c) for c in _SPACES_]] = True
+    return _SPACES_TABLE_
+
+_SPACES_TABLE_ = None
+
+
+def _iterbuffer(buffer, chunk_size):
+    """scans a buffer (e.g. a memory map) in chunks, views point into the buffer"""
+    import numpy as np
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    offset, size = 0, chunk_size
+    while offset < len(data):
+        eof = offset + size >= len(data)
+        docs, consumed = _scan(data[offset:offset + size], eof, offset)
+        if not consumed:  # a single block does not fit in a chunk
+            size *= 2
+            continue
+        for hs, he, starts, ends, contiguous in docs:
+            yield DocView(buffer, (hs, he), starts, ends, contiguous)
+        offset += consumed
+        size = chunk_size
+
+
+def _iterstream(istream, chunk_size):
+    """scans a stream in chunks, views point into (a copy of) the chunk"""
+    import numpy as np
+    pending = ''
+    while True:
+        chunk = istream.read(chunk_size)
+        eof = not chunk
+        text = pending + chunk if pending else chunk
+        if not text:
+            return
+        docs, consumed = _scan(np.frombuffer(text, dtype=np.uint8), eof)
+        for hs, he, starts, ends, contiguous in docs:
+            yield DocView(text, (hs, he), starts, ends, contiguous)
+        if eof:
+            return
+        pending = text[consumed:]
+
+
+def scandoctext(istream, chunk_size=_CHUNK_SIZE_):
+    """
+    Scans a stream for documents without materialising them (e.g. to index a file).
+    :param istream: where we are reading from (anything with a `read` method)
+    :param chunk_size: number of bytes scanned at a time
+    :yields: (start, end, lines, header) per document, where [start, end) is the byte range from the header
+        to the end of the last line of the document and lines is the number of lines (sentences) in the document
+
+    >>> from StringIO import StringIO
+    >>> list(scandoctext(StringIO('# id=1\\na\\nb\\n\\nignored\\n# id=2\\n\\n# id=3\\nc')))
+    [(0, 10, 2, '# id=1'), (20, 26, 0, '# id=2'), (28, 36, 1, '# id=3')]
+    """
+    import numpy as np
+    pending = ''
+    base = 0  # offset of pending in the stream
+    while True:
+        chunk = istream.read(chunk_size)
+        eof = not chunk
+        text = pending + chunk if pending else chunk
+        if not text:
+            return
+        docs, consumed = _scan(np.frombuffer(text, dtype=np.uint8), eof)
+        for hs, he, starts, ends, contiguous in docs:
+            yield base + hs, base + (int(ends[-1]) if len(ends) else he), len(starts), text[hs:he]
+        if eof:
+            return
+        pending = text[consumed:]
+        base += consumed
+
+
+def iterdocviews(source, chunk_size=_CHUNK_SIZE_):
+    """
+    Iterates over documents as views (see `DocView`).
+
+    :param source: a path (the file is memory-mapped), a stream (read in chunks) or a buffer (e.g. a bytearray or an mmap)
+    :param chunk_size: number of bytes scanned at a time
+    :yields: a DocView per document
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile() as fo:
+    ...     fo.write('# id=1\\na b \\n c\\n\\nignored\\n# id=2\\n\\t\\n# id=3\\nd')
+    ...     fo.flush()
+    ...     for view in iterdocviews(fo.name):
+    ...         print view.attrs['id'], view.lines()
+    1 ['a b', 'c']
+    2 []
+    3 ['d']
+    """
+    if isinstance(source, basestring):
+        with open(source, 'rb') as fi:
+            try:
+                buffer = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                return
+        try:
+            for view in _iterbuffer(buffer, chunk_size):
+                yield view
+        finally:
+            buffer.close()
+    elif hasattr(source, 'read'):
+        for view in _iterstream(source, chunk_size):
+            yield view
+    else:
+        for view in _iterbuffer(source, chunk_size):
+            yield view
+
+
 def iteraddheader(istream):
     """
     Iterates over documents adding headers
@@ -159,4 +454,5 @@ def argparser(parser=None, func=main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
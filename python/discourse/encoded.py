@@ -0,0 +1,217 @@
+"""
+Encoded corpora: documents of tokenised sentences (e.g. d-sequences) as flat arrays of pattern ids,
+see `discourse.util.RaggedCorpus` for the layout.
+
+Ids refer to a vocabulary (a list of tokens) in which '<null>' takes id 0 and '<unk>' takes id 1,
+other tokens are numbered in order of first occurrence (as by `discourse.util.encode_documents`).
+
+The encoding of a doctext file PATH is saved once in a sidecar (a columnar store, see `discourse.colstore`),
+PATH.enc (or PATH.b.enc with document boundary tokens), which is rebuilt whenever the file changes.
+Loading a corpus from its sidecar memory-maps it, thus it is (nearly) instantaneous and pages are shared by processes.
+
+Example:
+
+    corpus, tokens = load_encoded('dseqs2/newstest2014.de-en.ref', boundary=True)
+    for D in corpus:  # a document is a list of sentences (arrays of ids)
+        ...
+    corpus, vocab = load_corpus(training_files, boundary=True)  # several files under a single vocabulary
+
+@author: wilkeraziz
+"""
+
+import os
+import logging
+import argparse
+import numpy as np
+from collections import defaultdict
+from discourse import command
+from discourse.util import RaggedCorpus, encode_docviews, register_token, smart_open
+from discourse.colstore import ColumnStore, write_columns, is_store
+from discourse.docindex import signature, is_gzip
+from discourse.doctext import iterdocviews
+
+
+SUFFIX = '.enc'
+# bumped whenever the layout of the sidecar changes
+VERSION = 2
+
+
+def sidecar(path, boundary=False):
+    """where the encoding of a doctext file is saved"""
+    return '{0}{1}{2}'.format(path, '.b' if boundary else '', SUFFIX)
+
+
+def save_encoded(path, corpus, tokens, boundary=False):
+    """saves the encoding of a doctext file (next to it)"""
+    output = sidecar(path, boundary)
+    # written aside and renamed, so that processes which load the encoding concurrently never see half of it
+    tmp = '{0}.{1}.tmp'.format(output, os.getpid())
+    corpus = corpus.compact()
+    write_columns(tmp, [('data', corpus.data.astype(np.int32)), ('sentences', corpus.sentences), ('documents', corpus.documents),
+        ('vocab', np.frombuffer('\n'.join(tokens), dtype=np.uint8))],
+        version=VERSION, boundary=boundary, source=signature(path))
+    os.rename(tmp, output)
+
+
+def load_encoded(path, boundary=False, build=True, save=True):
+    """
+    Loads the encoding of a doctext file (plain or gzipped).
+
+    Arguments
+    ---------
+    path: a doctext file
+    boundary: whether documents are wrapped in boundary tokens (see `util.iterdocuments`)
+    build: whether to encode the file if the sidecar is missing or stale (otherwise an IOError is raised)
+    save: whether to save a new encoding (failing silently if the sidecar cannot be written)
+
+    Returns
+    -------
+    corpus (a `util.RaggedCorpus`, memory-mapped if loaded from a sidecar) and tokens (the vocabulary in order of ids)
+
+    >>> import tempfile, shutil
+    >>> tmp = tempfile.mkdtemp()
+    >>> path = os.path.join(tmp, 'docs')
+    >>> with open(path, 'w') as fo:
+    ...     fo.write('# id=a\\nx y\\nz\\n\\n# id=b\\ny\\n')
+    >>> load_encoded(path, build=False)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    IOError: No encoding for .../docs
+    >>> corpus, tokens = load_encoded(path)
+    >>> tokens, [[S.tolist() for S in D] for D in corpus]
+    (['<null>', '<unk>', 'x', 'y', 'z'], [[[2, 3], [4]], [[3]]])
+    >>> load_encoded(path, build=False)[1] == tokens, os.path.exists(sidecar(path, boundary=True))
+    (True, False)
+
+    A sidecar is stale once the file changes
+
+    >>> with open(path, 'a') as fo:
+    ...     fo.write('\\n# id=c\\nw\\n')
+    >>> load_encoded(path, build=False)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    IOError: No encoding for .../docs
+    >>> corpus, tokens = load_encoded(path)
+    >>> len(corpus), tokens[-1], load_encoded(path, build=False)[1] == tokens
+    (3, 'w', True)
+    >>> shutil.rmtree(tmp)
+    """
+    output = sidecar(path, boundary)
+    if is_store(output):
+        store = ColumnStore(output)
+        if store.attrs.get('version') == VERSION and store.attrs.get('source') == signature(path):
+            tokens = store['vocab'].tobytes().split('\n')
+            return RaggedCorpus(store['data'], store['sentences'], store['documents']), tokens
+        logging.info('Stale encoding: %s', output)
+    if not build:
+        raise IOError('No encoding for %s' % path)
+    if is_gzip(path):
+        with smart_open(path) as fi:
+            corpus, vocab = encode_docviews(iterdocviews(fi), boundary)
+    else:  # memory-mapped
+        corpus, vocab = encode_docviews(iterdocviews(path), boundary)
+    tokens = [t for t, i in sorted(vocab.iteritems(), key=lambda (t, i): i)]
+    logging.info('Encoded %s: %d documents, %d sentences, %d patterns, %d tokens',
+            path, len(corpus), corpus.num_sentences(), corpus.num_patterns(), len(tokens))
+    if save:
+        try:
+            save_encoded(path, corpus, tokens, boundary)
+        except (IOError, OSError) as e:
+            logging.warning('Could not save the encoding of %s: %s', path, e)
+    return corpus, tokens
+
+
+def load_corpus(paths, boundary=False, null='<null>', unk='<unk>'):
+    """
+    Loads the encoding of several doctext files under a single vocabulary,
+    which is the same as encoding the concatenation of the files (e.g. `util.iterfiles`).
+    A single file is memory-mapped, several files are merged in memory.
+
+    Returns
+    -------
+    corpus (a `util.RaggedCorpus`) and vocab (a defaultdict as returned by `util.encode_documents`)
+    """
+    vocab = defaultdict()
+    register_token(null, vocab)
+    register_token(unk, vocab)
+    parts = []
+    for path in paths:
+        corpus, tokens = load_encoded(path, boundary)
+        mapping = np.array([register_token(t, vocab) for t in tokens], dtype=np.int32)
+        if not np.array_equal(mapping, np.arange(len(tokens))):
+            corpus = corpus.translate(mapping)
+        parts.append(corpus)
+    if len(parts) == 1:
+        return parts[0], vocab
+    if not parts:
+        return RaggedCorpus(np.zeros(0, np.int32), np.zeros(1, np.int64), np.zeros(1, np.int64)), vocab
+    # offsets of each part are shifted by the sizes of the parts before it
+    parts = [C.compact() for C in parts]
+    data = np.concatenate([C.data for C in parts])
+    sentences = [np.zeros(1, np.int64)]
+    documents = [np.zeros(1, np.int64)]
+    npatterns, nsentences = 0, 0
+    for C in parts:
+        sentences.append(C.sentences[1:] + npatterns)
+        documents.append(C.documents[1:] + nsentences)
+        npatterns += len(C.data)
+        nsentences += C.num_sentences()
+    return RaggedCorpus(data, np.concatenate(sentences), np.concatenate(documents)), vocab
+
+
+def test_mapping(tokens, vocab, unk='<unk>'):
+    """
+    Maps the ids of a corpus (whose vocabulary is tokens) to ids of a fixed (training) vocab,
+    unknown tokens are mapped to unk (see `util.encode_test_documents`).
+
+    >>> test_mapping(['<null>', '<unk>', 'a', 'z', 'c'], {'<null>': 0, '<unk>': 1, 'a': 2, 'c': 3})
+    array([0, 1, 2, 1, 3], dtype=int32)
+    """
+    assert unk in vocab, 'Your vocab does not assign an id to unknonw symbols'
+    unk_id = vocab[unk]
+    return np.array([vocab.get(t, unk_id) for t in tokens], dtype=np.int32)
+
+
+def main(args):
+    logging.basicConfig(
+            level=(logging.DEBUG if args.verbose else logging.INFO),
+            format='%(levelname)s %(message)s')
+    for path in args.input:
+        if args.force and os.path.exists(sidecar(path, args.boundary)):
+            os.remove(sidecar(path, args.boundary))
+        corpus, tokens = load_encoded(path, args.boundary)
+        print '{0}\t{1}\t{2}\t{3}\t{4}'.format(path, len(corpus), corpus.num_sentences(), corpus.num_patterns(), len(tokens))
+
+
+@command('encode', 'preprocessing')
+def argparser(parser=None, func=main):
+    """parse command line arguments"""
+
+    if parser is None:
+        parser = argparse.ArgumentParser(prog='encode')
+
+    parser.description = 'Encode doctext files (e.g. d-sequences) as flat arrays of pattern ids for models to memory-map'
+    parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
+
+    parser.add_argument('input', nargs='+',
+            type=str,
+            help='doctext files (plain or gzipped), their encodings are saved next to them (with suffix %s)' % SUFFIX)
+    parser.add_argument('--boundary', '-b',
+            action='store_true',
+            help='add document boundary tokens')
+    parser.add_argument('--force', '-f',
+            action='store_true',
+            help='encode files even if their encodings are up to date')
+    parser.add_argument('--verbose', '-v',
+            action='store_true',
+            help='increase the verbosity level')
+
+    if func is not None:
+        parser.set_defaults(func=func)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = argparser().parse_args()
+    args.func(args)
@@ -14,9 +14,10 @@ import numpy as np
 import sys
 import logging
 import itertools
-from discourse.util import pairwise, bar
+from discourse.util import pairwise, bar, write_table
 from discourse.doctext import iterdoctext
 from discourse import command
+from discourse import instrument
 import functools
 
 # TODO: generalise vocabulary of roles
@@ -53,6 +54,29 @@ def get_role_count(entity_roles):
     
     return temp - roles[0]
 
+def train_model(istream, output, salience=0):
+    """
+    Counts role transitions in a training corpus of grids (doctext format) and dumps them to '<output>.unigrams' and '<output>.bigrams'.
+    The input can be any iterable of lines (e.g. an open file or `util.iterfiles`).
+    """
+    training = read_grids(istream, r2i)
+    logging.info('Training set contains %d docs', len(training))
+    instrument.count(documents=len(training), sentences=sum(G.shape[0] for G in training))
+    unigrams, bigrams = train(training, len(r2i), salience) 
+    logging.info('%d unigrams and %d bigrams', unigrams.size, bigrams.size)
+    
+    # save unigrams and bigrams
+    # this is nice ;) but perhaps for now we are interested in a more human readable format
+    # np.savetxt('{0}.unigrams'.format(output), unigrams)
+    # np.savetxt('{0}.bigrams'.format(output), bigrams)
+    roles = np.array([i2r[rid] for rid in xrange(len(r2i))], dtype=object)
+    with open('{0}.unigrams'.format(output), 'w') as fu:
+        write_table(fu, '#role\t#count', [roles, unigrams])
+    with open('{0}.bigrams'.format(output), 'w') as fb:
+        # every pair of roles (r1, r2) in lexicographic order of ids
+        write_table(fb, '#role\t#role\t#count', [np.repeat(roles, len(roles)), np.tile(roles, len(roles)), bigrams.ravel()])
+
+
 def main(args):
     """load grids and extract unigrams and bigrams"""
 
@@ -60,23 +84,7 @@ def main(args):
             level=(logging.DEBUG if args.verbose else logging.INFO), 
             format='%(levelname)s %(message)s')
 
-    training = read_grids(args.input, r2i)
-    logging.info('Training set contains %d docs', len(training))
-    unigrams, bigrams = train(training, len(r2i), args.salience) 
-    logging.info('%d unigrams and %d bigrams', unigrams.size, bigrams.size)
-    
-    # save unigrams and bigrams
-    # this is nice ;) but perhaps for now we are interested in a more human readable format
-    # np.savetxt('{0}.unigrams'.format(args.output), unigrams)
-    # np.savetxt('{0}.bigrams'.format(args.output), bigrams)
-    with open('{0}.unigrams'.format(args.output), 'w') as fu:
-        print >> fu, '#role\t#count'
-        for rid, count in enumerate(unigrams):
-            print >> fu, '{0}\t{1}'.format(i2r[rid], count)
-    with open('{0}.bigrams'.format(args.output), 'w') as fb:
-        print >> fb, '#role\t#role\t#count'
-        for r1, r2 in itertools.product(xrange(len(r2i)), xrange(len(r2i))):
-            print >> fb, '{0}\t{1}\t{2}'.format(i2r[r1], i2r[r2], bigrams[r1,r2])
+    train_model(args.input, args.output, args.salience)
     
 
 @command('grid', 'entity-based')
@@ -112,4 +120,5 @@ def argparser(parser=None, func=main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
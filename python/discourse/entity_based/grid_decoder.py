@@ -11,11 +11,13 @@ import logging
 import itertools
 import traceback
 import numpy as np
-from discourse.util import pairwise, smart_open
+from discourse.util import pairwise, smart_open, write_table
 from grid import read_grids, r2i, i2r
+from discourse.executor import borrow, load_once
 from discourse import command
-from multiprocessing import Pool
-from functools import partial
+from discourse import instrument
+from discourse.colstore import write_columns
+from discourse.docindex import open_documents, map_shards
 
 
 def read_unigrams(istream, str2int):
@@ -68,38 +70,86 @@ def wrapped_loglikelihood(corpus, U, B, salience):
         raise Exception(''.join(traceback.format_exception(*sys.exc_info())))
 
 
-def decode_many(unigrams, bigrams, salience, ipaths, opaths, jobs, estream=sys.stderr):
-
-    # reads in the model
+def load_model(unigrams, bigrams):
+    """Loads unigram and bigram counts of role transitions"""
     logging.info('Reading unigrams from: %s', unigrams)
     U = read_unigrams(smart_open(unigrams), r2i)
     logging.info('Read in %d unigrams', U.size)
-
     logging.info('Reading bigrams from: %s', bigrams)
     B = read_bigrams(smart_open(bigrams), r2i)
     logging.info('Read in %d bigrams', B.size)
-    
-    
-    tests = [None] * len(ipaths)
-    for i, ipath in enumerate(ipaths):
-        documents = read_grids(smart_open(ipath), r2i)
-        logging.info('%s: %d test documents read', ipath, len(documents))
-        tests[i] = documents 
-
-    # computes the log likelihood of each document in each test file
-    pool = Pool(jobs)
-    all_L = pool.map(partial(wrapped_loglikelihood, U=U, B=B, salience=salience), tests)
+    return U, B
+
+
+def score_file((ipath, first, last), unigrams, bigrams, salience):
+    """
+    Scores the grids in a file (or only documents first to last-1, see `discourse.docindex.open_documents`).
+    The model is loaded at most once per process (see `discourse.executor.load_once`).
+
+    Returns
+    -------
+    the log likelihood, the number of sentences and the number of entities of each document
+    """
+    U, B = load_once(load_model, unigrams, bigrams)
+    test = read_grids(open_documents(ipath, first, last), r2i)
+    logging.info('%s: %d test documents read', ipath, len(test))
+
+    # computes the log likelihood of each document
+    L = loglikelihood(test, U, B, salience)
+
+    num_sentences = np.array([G.shape[0] for G in test], int)
+    num_entities = np.array([G.shape[1] for G in test], int)
+    instrument.count(documents=len(test), sentences=int(num_sentences.sum()))
+    return L, num_sentences, num_entities
+
+
+def write_scores(opath, L, num_sentences, num_entities, binary=False):
+    """Writes scores out, in text format or, if binary, as a columnar store (see `discourse.colstore`)"""
+    if binary:
+        # dumps scores as columns (in the order of the text format)
+        write_columns(opath, [('doc', np.arange(len(L))), ('logprob', L), 
+            ('sentences', num_sentences), ('entities', num_entities)])
+    else:
+        with smart_open(opath, 'w') as ostream:
+            # dumps scores (formatted column-wise)
+            write_table(ostream, '#doc\t#logprob\t#sentences\t#entities', [np.arange(len(L)), L, num_sentences, num_entities])
+
+
+def decode_file((ipath, opath), unigrams, bigrams, salience, binary=False):
+    """
+    Scores the grids in a file and writes their scores out (see `write_scores`).
+
+    Returns
+    -------
+    the sum and the mean of the log likelihood of the documents
+    """
+    L, num_sentences, num_entities = score_file((ipath, 0, None), unigrams, bigrams, salience)
+    write_scores(opath, L, num_sentences, num_entities, binary)
+    return L.sum(), np.mean(L)
+
+
+def decode_many(unigrams, bigrams, salience, ipaths, opaths, jobs, estream=sys.stderr, executor=None, binary=False, shards=0):
+    """
+    Decodes several files in parallel (one task per file).
+    If an executor is given, its (warm) workers are used, otherwise a pool of `jobs` workers is created and shut down at the end.
+    With shards, files are rather split into about so many tasks with the same number of sentences
+    (see `discourse.docindex.map_shards`), whose scores are gathered and written out here.
+    """
+    logging.info('Decoding %d files with: %s and %s', len(ipaths), unigrams, bigrams)
+    with borrow(executor, jobs, [__name__]) as executor:
+        if not shards:
+            results = executor.map(decode_file, zip(ipaths, opaths), unigrams=unigrams, bigrams=bigrams, salience=salience, binary=binary)
+        else:
+            results = []
+            for opath, parts in itertools.izip(opaths, map_shards(executor, score_file, ipaths, shards, 
+                    unigrams=unigrams, bigrams=bigrams, salience=salience)):
+                L, num_sentences, num_entities = [np.concatenate(column) for column in zip(*parts)]
+                write_scores(opath, L, num_sentences, num_entities, binary)
+                results.append((L.sum(), np.mean(L)))
 
     print >> estream, '#file\t#sum\t#mean'
-    for ipath, opath, test, L in itertools.izip(ipaths, opaths, tests, all_L):
-        with smart_open(opath, 'w') as ostream:
-            # dumps scores
-            print >> ostream, '#doc\t#logprob\t#sentences\t#entities'
-            for i, ll in enumerate(L):
-                num_sentences = test[i].shape[0]
-                num_entities = test[i].shape[1]
-                print >> ostream, '{0}\t{1}\t{2}\t{3}'.format(i, ll, num_sentences, num_entities)
-            print >> estream, '{0}\t{1}\t{2}'.format(opath, L.sum(), np.mean(L))
+    for opath, (total, mean) in itertools.izip(opaths, results):
+        print >> estream, '{0}\t{1}\t{2}'.format(opath, total, mean)
 
 
 def main(args):
@@ -113,10 +163,8 @@ def main(args):
     logging.info('Read in %d bigrams', B.size)
     test = read_grids(args.input, r2i)
     logging.info('Scoring %d documents', len(test)) 
-    print >> args.output, '#docid\t#loglikelihood'
-    for i, grid in enumerate(test):
-        ll = grid_loglikelihood(grid, U, B, args.salience)
-        print >> args.output, '{0}\t{1}'.format(i, ll)
+    L = loglikelihood(test, U, B, args.salience)
+    write_table(args.output, '#docid\t#loglikelihood', [np.arange(len(L)), L])
             
 
 @command('grid_decoder', 'entity-based')
@@ -154,4 +202,5 @@ def argparser(parser=None, func=main):
     return parser
     
 if __name__ == '__main__':
-     main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
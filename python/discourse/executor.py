@@ -0,0 +1,211 @@
+"""
+A pool of warm workers which can be shared by several stages (and concurrent tracks) of a pipeline.
+
+* workers are forked once: modules are imported up front, and models are loaded lazily at most once per worker (see `load_once`)
+* errors in a task are propagated to whoever is waiting for the task (along with the worker's traceback)
+* the executor keeps track of how busy each worker was, see `Executor.utilisation` and `Executor.report`
+* tasks are measured in the worker (see `discourse.instrument`) and attributed to the stage which submitted them
+
+Example:
+
+    with Executor(4, modules=['discourse.syntax_based.ibm1_decoder']) as executor:
+        results = executor.map(decode_file, paths, model=model_path)
+
+@author: wilkeraziz
+"""
+
+import os
+import sys
+import time
+import logging
+import importlib
+import threading
+import traceback
+from collections import defaultdict
+from contextlib import contextmanager
+from multiprocessing import Pool, cpu_count
+from discourse.instrument import usage, counting, measure, current_stage, start_peak, read_peak
+from discourse.profiling import start_worker
+from discourse.docindex import signature
+from discourse.pgzip import set_threads
+
+
+# models loaded by this process along with the signatures of their files (see `load_once`)
+_MODELS_ = {}
+
+
+class TaskError(Exception):
+    """An exception raised by a task, its message contains the traceback as formatted by the worker"""
+    pass
+
+
+def load_once(loader, *args):
+    """
+    Loads a model at most once per process, subsequent calls (with the same loader and arguments) return the cached model,
+    unless a file among the arguments changed since (e.g. a model retrained while the workers are alive), then it is reloaded.
+
+    Arguments
+    ---------
+    loader: a function which loads a model (e.g. `ibm1_decoder.load_model`)
+    args: hashable arguments to the loader (e.g. paths)
+    """
+    key = (loader.__module__, loader.__name__) + args
+    stamp = [tuple(signature(arg)) if isinstance(arg, basestring) and os.path.isfile(arg) else None for arg in args]
+    cached = _MODELS_.get(key, None)
+    if cached is None or cached[0] != stamp:
+        logging.info('(pid=%d) loading model %s%s', os.getpid(), loader.__name__, repr(args))
+        # replaces a stale model (if any)
+        _MODELS_[key] = cached = (stamp, loader(*args))
+    return cached[1]
+
+
+def _warmup(modules, threads):
+    """
+    worker initialiser: imports modules so that tasks do not pay for it (and starts profiling if need be),
+    and shares the CPUs among workers for gzip threads (see `discourse.pgzip.set_threads`)
+    """
+    start_worker()
+    set_threads(threads)
+    for name in modules:
+        importlib.import_module(name)
+
+
+def _run(func, args, kwargs):
+    """runs a task in a worker and returns its result along with some bookkeeping"""
+    peak = start_peak()
+    before = usage()
+    try:
+        with counting() as counts:
+            result = func(*args, **kwargs)
+    except:
+        raise TaskError(''.join(traceback.format_exception(*sys.exc_info())))
+    finally:
+        peak = read_peak(peak, stop=True)
+    return result, os.getpid(), measure(before, usage(), counts, peak)
+
+
+class Task(object):
+    """A handle to a task which is running (or waiting to run) in the executor"""
+
+    def __init__(self, executor, async_result):
+        self._executor = executor
+        self._async_result = async_result
+        self._stage = current_stage()
+
+    def result(self):
+        """waits for the task and returns its result (or raises TaskError)"""
+        result, pid, metrics = self._async_result.get()
+        self._executor._account(pid, metrics['wall'])
+        if self._stage is not None:
+            self._stage.add_task(pid, metrics)
+        return result
+
+
+class Executor(object):
+    """
+    A pool of workers shared across stages.
+    It is safe to submit tasks from several threads.
+    """
+
+    def __init__(self, workers, modules=[], start=True):
+        """
+        Arguments
+        ---------
+        workers: number of worker processes
+        modules: modules imported by every worker up front
+        start: whether to fork the workers now, otherwise they are forked when the first task is submitted
+            (thus never if no task is, e.g. in a dry run)
+        """
+        self.workers = workers
+        self._modules = list(modules)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._busy = defaultdict(float)
+        self._tasks = defaultdict(int)
+        self._started = time.time()
+        self._stopped = None
+        if start:
+            self._start()
+
+    def _start(self):
+        """forks the workers (once)"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = Pool(self.workers, _warmup, (self._modules, cpu_count() // self.workers))
+                logging.info('Executor with %d workers', self.workers)
+        return self._pool
+
+    def _account(self, pid, wall):
+        with self._lock:
+            self._busy[pid] += wall
+            self._tasks[pid] += 1
+
+    def submit(self, func, *args, **kwargs):
+        """submits a task, returns a `Task`"""
+        pool = self._pool or self._start()
+        return Task(self, pool.apply_async(_run, (func, args, kwargs)))
+
+    def apply(self, func, *args, **kwargs):
+        """runs a task and waits for its result"""
+        return self.submit(func, *args, **kwargs).result()
+
+    def map(self, func, iterable, **kwargs):
+        """
+        Runs func(x, **kwargs) for every x in iterable and returns the results in order.
+        The first task which fails raises a TaskError (the remaining ones are not cancelled).
+        """
+        tasks = [self.submit(func, x, **kwargs) for x in iterable]
+        return [task.result() for task in tasks]
+
+    def close(self):
+        """waits for pending tasks and stops the workers"""
+        if self._stopped is None:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+            self._stopped = time.time()
+
+    def terminate(self):
+        """stops the workers immediately"""
+        if self._stopped is None:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+            self._stopped = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def utilisation(self):
+        """fraction of the available worker time which was spent running tasks"""
+        wall = (self._stopped or time.time()) - self._started
+        return sum(self._busy.itervalues()) / (self.workers * wall) if wall > 0 else 0.0
+
+    def report(self):
+        """
+        Returns one row per worker (pid, number of tasks, busy time in seconds)
+        and one row for the whole executor (total tasks, total busy time, utilisation).
+        """
+        with self._lock:
+            rows = [(pid, self._tasks[pid], self._busy[pid]) for pid in sorted(self._busy.iterkeys())]
+        total = ('all', sum(n for _, n, _ in rows), sum(t for _, _, t in rows))
+        return rows + [total], self.utilisation()
+
+
+@contextmanager
+def borrow(executor, workers, modules=[]):
+    """
+    Yields the given executor, or a new one (with a number of workers) in case executor is None.
+    A new executor is shut down on exit, a borrowed one is left alone.
+    """
+    if executor is not None:
+        yield executor
+    else:
+        with Executor(workers, modules) as executor:
+            yield executor
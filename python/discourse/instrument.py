@@ -0,0 +1,252 @@
+"""
+Instrumentation of pipeline runs: wall time, CPU time, resident memory (RSS) and throughput per stage and per worker task.
+
+* code declares stages with `stage(name)` (a context manager), stages are recorded by the active `RunReport`
+* code (possibly running in a worker) declares how much work it did with `count(documents=..., sentences=..., patterns=...)`
+* tasks run by `discourse.executor.Executor` are measured in the worker and attributed to the stage which submitted them
+
+Without an active report, stages cost next to nothing and counts are simply discarded.
+
+Memory is the peak RSS of a process during a task or stage ('peak_rss'), its RSS at the end ('rss') and its growth over
+the task or stage ('rss_growth'). Peaks are read from the high-water mark the kernel keeps per process, which is reset
+when a task or stage starts (see `start_peak`), thus a task run by a reused worker gets its own peak.
+Where the mark cannot be reset (e.g. no procfs), a peak is that of the process so far.
+
+Example:
+
+    report = RunReport()
+    with report.activate():
+        with stage('decode:ibm1'):
+            ...
+    report.write('report.json')
+    print report.table()
+
+@author: wilkeraziz
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from discourse.util import tabulate
+from discourse.profiling import rss, peak_rss, reset_peak_rss
+
+
+# the active report (see `RunReport.activate`)
+_REPORT_ = None
+# per thread state: the current stage (in the main process) and counts gathered by the current task
+_LOCAL_ = threading.local()
+# peaks of the measurements in progress in this process (see `start_peak`)
+_PEAKS_ = {}
+_PEAKS_LOCK_ = threading.Lock()
+
+
+def usage():
+    """a snapshot of the resources used so far by this process: (wall, cpu, current rss in MB)"""
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return time.time(), ru.ru_utime + ru.ru_stime, rss()
+
+
+def start_peak():
+    """
+    Starts measuring the peak RSS of this process (e.g. over a task), returns a key (see `read_peak`).
+    The kernel keeps a single high-water mark per process, thus before it is reset the mark is folded into
+    every measurement in progress (e.g. stages of concurrent tracks), none of which misses a peak.
+
+    >>> import numpy as np
+    >>> outer = start_peak()
+    >>> big = np.ones(1 << 24)  # 128MB
+    >>> del big
+    >>> inner = start_peak()
+    >>> small = np.ones(1 << 20)  # 8MB
+    >>> read_peak(outer) - read_peak(inner) > 100
+    True
+    """
+    with _PEAKS_LOCK_:
+        mark = peak_rss()
+        for key in _PEAKS_:
+            _PEAKS_[key] = max(_PEAKS_[key], mark)
+        reset_peak_rss()
+        key = object()
+        _PEAKS_[key] = rss()
+    return key
+
+
+def read_peak(key, stop=False):
+    """the peak RSS (in MB) since `start_peak` returned key, with stop the measurement ends"""
+    with _PEAKS_LOCK_:
+        peak = max(_PEAKS_.pop(key) if stop else _PEAKS_[key], peak_rss())
+    return peak
+
+
+def count(**kwargs):
+    """declares units of work (e.g. documents=10, sentences=300) done by the current task or stage"""
+    counts = getattr(_LOCAL_, 'counts', None)
+    if counts is not None:
+        counts.update(kwargs)
+
+
+@contextmanager
+def counting():
+    """gathers the counts declared within the block, yields a Counter"""
+    previous = getattr(_LOCAL_, 'counts', None)
+    _LOCAL_.counts = Counter()
+    try:
+        yield _LOCAL_.counts
+    finally:
+        counts = _LOCAL_.counts
+        _LOCAL_.counts = previous
+        if previous is not None:  # nested blocks also contribute to the enclosing one
+            previous.update(counts)
+
+
+def measure(before, after, counts, peak):
+    """summarises two `usage` snapshots, the peak RSS in between (see `read_peak`) and counts into a dictionary"""
+    wall = after[0] - before[0]
+    return {'wall': wall,
+            'cpu': after[1] - before[1],
+            'rss': after[2],
+            'rss_growth': after[2] - before[2],
+            'peak_rss': peak,
+            'counts': dict(counts),
+            'rates': {k: n / wall for k, n in counts.iteritems()} if wall > 0 else {}}
+
+
+def current_stage():
+    """the stage the current thread is in (or None)"""
+    return getattr(_LOCAL_, 'stage', None)
+
+
+class StageRecord(object):
+    """Measurements of a stage and of the worker tasks it submitted"""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.track = threading.current_thread().name
+        self.tasks = []
+        self.metrics = None
+        self._lock = threading.Lock()
+
+    def add_task(self, pid, metrics):
+        with self._lock:
+            self.tasks.append(dict(metrics, pid=pid))
+
+    def finish(self, before, after, counts, peak):
+        metrics = measure(before, after, counts, peak)
+        # work done by tasks is attributed to the stage
+        task_counts = Counter()
+        for task in self.tasks:
+            task_counts.update(task['counts'])
+        metrics['counts'] = dict(task_counts + Counter(metrics['counts']))
+        metrics['rates'] = {k: n / metrics['wall'] for k, n in metrics['counts'].iteritems()} if metrics['wall'] > 0 else {}
+        metrics['task_cpu'] = sum(task['cpu'] for task in self.tasks)
+        metrics['task_peak_rss'] = max([task['peak_rss'] for task in self.tasks] or [0.0])
+        self.metrics = metrics
+
+    def todict(self):
+        return dict(name=self.name, track=self.track, attrs=self.attrs, tasks=self.tasks, **(self.metrics or {}))
+
+
+class _NullStage(object):
+    """stands for a stage when there is no active report"""
+
+    def add_task(self, pid, metrics):
+        pass
+
+
+_NULL_STAGE_ = _NullStage()
+
+
+@contextmanager
+def stage(name, **attrs):
+    """
+    Declares a stage of the active report (e.g. 'decode:ibm1'), the stage is measured and yielded.
+    Without an active report this is a no-op.
+
+    Remarks: CPU time and RSS of a stage concern the main process,
+    when tracks run concurrently the CPU time of the main process is shared by all stages running at the time.
+    Work done by worker tasks is reported separately (see 'task_cpu' and 'task_peak_rss').
+    """
+    report = _REPORT_
+    if report is None:
+        yield _NULL_STAGE_
+        return
+    record = StageRecord(name, attrs)
+    previous = current_stage()
+    _LOCAL_.stage = record
+    peak = start_peak()
+    before = usage()
+    try:
+        with counting() as counts:
+            yield record
+    finally:
+        record.finish(before, usage(), counts, read_peak(peak, stop=True))
+        _LOCAL_.stage = previous
+        report.add(record)
+
+
+class RunReport(object):
+    """A machine-readable account of a run (see `write`) and a human-readable summary (see `table`)"""
+
+    def __init__(self, **attrs):
+        self.attrs = attrs
+        self.stages = []
+        self.extra = {}
+        self._lock = threading.Lock()
+        self._peak_key = start_peak()
+        self._peak = None
+        self._before = usage()
+        self._after = None
+
+    def add(self, record):
+        with self._lock:
+            self.stages.append(record)
+
+    @contextmanager
+    def activate(self):
+        """makes this the active report within the block"""
+        global _REPORT_
+        previous = _REPORT_
+        _REPORT_ = self
+        try:
+            yield self
+        finally:
+            _REPORT_ = previous
+            self._after = usage()
+            self._peak = read_peak(self._peak_key, stop=True)
+
+    def todict(self):
+        after = self._after or usage()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        run = measure(self._before, after, {}, read_peak(self._peak_key) if self._peak is None else self._peak)
+        run['children_cpu'] = children.ru_utime + children.ru_stime
+        run['task_peak_rss'] = max([record.metrics['task_peak_rss'] for record in self.stages if record.metrics] or [0.0])
+        return {'argv': sys.argv,
+                'pid': os.getpid(),
+                'started': self._before[0],
+                'attrs': self.attrs,
+                'run': run,
+                'stages': [record.todict() for record in self.stages],
+                'extra': self.extra}
+
+    def write(self, path):
+        """dumps the report in JSON format"""
+        with open(path, 'w') as fo:
+            json.dump(self.todict(), fo, indent=2, sort_keys=True, default=str)
+
+    def table(self, tablefmt='simple'):
+        """summarises stages in a table (one row per stage)"""
+        rows = []
+        for record in self.stages:
+            m = record.metrics
+            rates = ' '.join('{0}={1:.1f}/s'.format(k, v) for k, v in sorted(m['rates'].iteritems()))
+            rows.append([record.name, record.track, len(record.tasks), m['wall'], m['cpu'], m['task_cpu'],
+                m['peak_rss'], m['task_peak_rss'], rates])
+        return tabulate(rows,
+                headers=['stage', 'track', 'tasks', 'wall (s)', 'cpu (s)', 'task cpu (s)', 'peak rss (MB)', 'task peak rss (MB)', 'throughput'],
+                tablefmt=tablefmt, floatfmt='.2f')
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.stats import spearmanr
 
 
 def ranks_higher(R, sysid, strictly=True):
@@ -21,22 +20,14 @@ def ranks_higher(R, sysid, strictly=True):
     #   for each document
     #       computes the rate at which the references scores higher than other systems (the denominator S-1 excludes the ref)
     #   and returns the average across documents for that given model
-
-    with_ties = np.zeros(M, float)
-    no_ties = np.zeros(M, float)
-    for m in xrange(M):
-        for d in xrange(D):
-            for s in xrange(S):
-                if s == sysid:  # we must exclude the reference
-                    continue
-                if R[m,d,sysid] < R[m,d,s]:
-                    no_ties[m] += 1
-                if R[m,d,sysid] <= R[m,d,s]:
-                    with_ties[m] += 1
-    # we must exclude the reference
-    with_ties /= (S-1) * D 
-    no_ties /= (S-1) * D  
-    return no_ties if strictly else with_ties
+    # the reference is compared to every system by broadcasting over a (M,D,S) tensor
+    ref = R[:,:,sysid:sysid+1]
+    if strictly:
+        higher = (ref < R).sum(2).sum(1)
+    else:
+        # we must exclude the reference (which is never worse than itself)
+        higher = (ref <= R).sum(2).sum(1) - D
+    return higher.astype(float) / ((S-1) * D)
 
 
 
@@ -54,24 +45,17 @@ def expected_win(R, sysid):
     expectedwin[m]
     """
     M, D, S = R.shape
-    ref_wins = np.zeros((M, S))
-    ref_loses = np.zeros((M, S))
-    for m in xrange(M):
-        for d in xrange(D):
-            for s in xrange(S):
-                if s == sysid:
-                    continue
-                if R[m,d,sysid] < R[m,d,s]:
-                    ref_wins[m,s] += 1
-                elif R[m,d,sysid] > R[m,d,s]:
-                    ref_loses[m,s] += 1
+    # how many times the reference wins (and loses) against each system (the reference itself never wins nor loses)
+    ref = R[:,:,sysid:sysid+1]
+    ref_wins = (ref < R).sum(1).astype(float)
+    ref_loses = (ref > R).sum(1).astype(float)
 
+    # systems are accumulated in order (rather than reduced) so that the result is exactly that of a sequential sum
     score = np.zeros(M)
-    for m in xrange(M):
-        for s in xrange(S):
-            if s == sysid: 
-                continue
-            score[m] += ref_wins[m,s]/(ref_wins[m,s] + ref_loses[m,s])
+    for s in xrange(S):
+        if s == sysid: 
+            continue
+        score += ref_wins[:,s]/(ref_wins[:,s] + ref_loses[:,s])
 
     return score/S
 
@@ -92,14 +76,10 @@ def top1(R, sysid, exclusive=False):
     #   for each document
     #       computes the rate at which the references scores higher than other systems (the denominator S-1 excludes the ref)
     #   and returns the average across documents for that given model
-    with_ties = np.zeros(M, float)
-    no_ties = np.zeros(M, float)
-    for m in xrange(M):
-        for d in xrange(D):
-            if R[m,d,sysid] == 1:
-                with_ties[m] += 1
-                if sum(r == 1 for r in R[m,d,:]) == 1:
-                    no_ties[m] += 1
+    first = R[:,:,sysid] == 1
+    with_ties = first.sum(1).astype(float)
+    # exclusively first: nobody else shares the first rank
+    no_ties = (first & ((R == 1).sum(2) == 1)).sum(1).astype(float)
     return no_ties/D if exclusive else with_ties/D
 
 
@@ -114,6 +94,7 @@ def rho(R, sysid, gold_rankings):
     -------
     goodness[m] = average spearman rank correlation between model and gold standard excluding the reference system
     """
+    from scipy.stats import spearmanr  # scipy is slow to import
     M, D, S = R.shape
     # for each model
     #   for each document
@@ -125,3 +106,69 @@ def rho(R, sysid, gold_rankings):
     ids.remove(sysid)
     hyp = mean_rankings[:,ids]
     return np.array([spearmanr(hyp[m], gold)[0] for m in xrange(M)])
+
+
+# Metrics as weighted averages of per-document statistics.
+# Statistics are computed once for R[m,d,s] and returned with documents along the first axis (i.e. S[d,k]),
+# columns are laid out model by model (i.e. S[d,m*K:(m+1)*K] concern model m),
+# a metric is then recovered from weighted totals T[i,k] (e.g. one row per bootstrap sample) 
+# and total weights w[i] (e.g. the number of documents in a sample).
+# With unit weights the result is exactly that of the metric itself.
+
+
+def ranks_higher_statistics(R, sysid, strictly=True):
+    """S[d,m]: the number of systems which model m ranks lower than sysid in document d (see `ranks_higher`)"""
+    ref = R[:,:,sysid:sysid+1]
+    if strictly:
+        higher = (ref < R).sum(2)
+    else:
+        higher = (ref <= R).sum(2) - 1  # the reference is not compared to itself
+    return higher.T.astype(float)
+
+
+def ranks_higher_weighted(T, w, shape, sysid, strictly=True):
+    """recovers `ranks_higher` from weighted totals of `ranks_higher_statistics` (shape is that of R)"""
+    S = shape[-1]
+    return T / ((S-1) * w[:,np.newaxis])
+
+
+def top1_statistics(R, sysid, exclusive=False):
+    """S[d,m]: whether model m ranks sysid first in document d (see `top1`)"""
+    first = R[:,:,sysid] == 1
+    if exclusive:
+        first &= (R == 1).sum(2) == 1
+    return first.T.astype(float)
+
+
+def top1_weighted(T, w, shape, sysid, exclusive=False):
+    """recovers `top1` from weighted totals of `top1_statistics` (shape is that of R)"""
+    return T / w[:,np.newaxis]
+
+
+def expected_win_statistics(R, sysid):
+    """S[d,(m,o,s)]: whether model m ranks sysid higher (o=0) or lower (o=1) than s in document d (see `expected_win`)"""
+    M, D, S = R.shape
+    ref = R[:,:,sysid:sysid+1]
+    outcomes = np.concatenate((ref < R, ref > R), 2)  # (M,D,2S)
+    return outcomes.transpose(1, 0, 2).reshape(D, M * 2 * S).astype(float)
+
+
+def expected_win_weighted(T, w, shape, sysid):
+    """recovers `expected_win` from weighted totals of `expected_win_statistics` (shape is that of R)"""
+    M, S = shape[0], shape[-1]
+    outcomes = T.reshape(len(T), M, 2, S)
+    ref_wins, ref_loses = outcomes[:,:,0,:], outcomes[:,:,1,:]
+    score = np.zeros((len(T), M))
+    for s in xrange(S):
+        if s == sysid:
+            continue
+        score += ref_wins[:,:,s]/(ref_wins[:,:,s] + ref_loses[:,:,s])
+    return score/S
+
+
+# metric: (statistics, weighted)
+WEIGHTED_METRICS = {
+        ranks_higher: (ranks_higher_statistics, ranks_higher_weighted),
+        top1: (top1_statistics, top1_weighted),
+        expected_win: (expected_win_statistics, expected_win_weighted)
+        }
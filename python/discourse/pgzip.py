@@ -0,0 +1,365 @@
+"""
+Block-parallel gzip: files made of several gzip members (blocks) which are compressed and decompressed by a pool of threads
+(zlib releases the GIL), see `util.smart_open`.
+
+A file written by `GzipWriter` is a regular gzip file (a sequence of members, which gzip readers such as zcat or
+`gzip.open` read as a single stream), every member holds about `block_size` uncompressed bytes (cut at the end of a line)
+and records its compressed size in an extra field of its header (subfield 'DC'), which other readers ignore.
+Sizes let `open_reader` find members without decompressing them, thus members are decompressed in parallel (and ahead of
+the consumer). Other gzip files (e.g. a single member written by `gzip.open`) are decompressed sequentially,
+as are members without sizes which follow members with sizes (e.g. files concatenated with cat).
+
+Example:
+
+    with GzipWriter('corpus.gz') as fo:  # or util.smart_open('corpus.gz', 'w')
+        for line in lines:
+            fo.write(line)
+    with open_reader('corpus.gz') as fi:  # or util.smart_open('corpus.gz')
+        for line in fi:
+            ...
+
+@author: wilkeraziz
+"""
+
+import io
+import zlib
+import struct
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+
+# uncompressed bytes per member
+_BLOCK_SIZE_ = 1 << 20
+# threads of a reader or a writer (by default, see `set_threads`)
+_THREADS_ = cpu_count()
+# subfield of the gzip header which holds the compressed size of a member
+_SUBFIELD_ = 'DC'
+# magic, deflate, FEXTRA, mtime=0, no extra flags, unknown OS, XLEN=8, subfield 'DC' of 4 bytes
+_HEADER_ = struct.Struct('<4sIBBH2sHI')
+_FEXTRA_ = 4
+
+
+class GzipMembers(object):
+    """
+    Reads (decompresses) a gzip file which may consist of several members,
+    keeping track of where members start in the file (`offsets`) and in the uncompressed stream (`starts`).
+    """
+
+    def __init__(self, fileobj, offset=0, start=0):
+        self._raw = fileobj
+        self._raw.seek(offset)
+        self._position = offset  # compressed bytes consumed
+        self._size = start  # uncompressed bytes produced
+        self._inflate = None
+        self.offsets = []
+        self.starts = []
+
+    def _member(self):
+        self.offsets.append(self._position)
+        self.starts.append(self._size)
+        self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def read(self, size=-1):
+        """returns some uncompressed data (at most size bytes are requested from the file at a time), '' at the end"""
+        size = _BLOCK_SIZE_ if size < 0 else size
+        while True:
+            data = self._raw.read(size)
+            if not data:
+                return ''
+            out = []
+            while data:
+                if self._inflate is None:
+                    if not data.strip('\0'):  # padding after the last member
+                        self._position += len(data)
+                        break
+                    self._member()
+                out.append(self._inflate.decompress(data))
+                self._size += len(out[-1])
+                # data past the end of a member is left unused (it is the next member, or padding)
+                unused = self._inflate.unused_data
+                self._position += len(data) - len(unused)
+                if unused:
+                    self._inflate = None
+                data = unused
+            out = ''.join(out)
+            if out:
+                return out
+
+
+def compress_member(data, level=6):
+    """
+    Compresses data as a gzip member whose header records its compressed size (see `member_size`).
+
+    >>> import gzip, io
+    >>> member = compress_member('one\\ntwo\\n')
+    >>> member_size(member) == len(member), gzip.GzipFile(fileobj=io.BytesIO(member)).read()
+    (True, 'one\\ntwo\\n')
+    """
+    deflate = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = deflate.compress(data) + deflate.flush()
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+    size = _HEADER_.size + len(body) + len(trailer)
+    header = _HEADER_.pack('\x1f\x8b\x08' + chr(_FEXTRA_), 0, 0, 255, 8, _SUBFIELD_, 4, size)
+    return header + body + trailer
+
+
+def member_size(header):
+    """the compressed size recorded in the header of a gzip member (as written by `compress_member`), None if it is not there"""
+    if len(header) < _HEADER_.size or header[:3] != '\x1f\x8b\x08' or not ord(header[3]) & _FEXTRA_:
+        return None
+    magic, mtime, xfl, os, xlen, subfield, slen, size = _HEADER_.unpack_from(header)
+    if xlen != 8 or subfield != _SUBFIELD_ or slen != 4:
+        return None
+    return size
+
+
+def decompress_member(member):
+    """decompresses a gzip member (its checksum and size are verified)"""
+    return zlib.decompress(member, 16 + zlib.MAX_WBITS)
+
+
+class _Deferred(object):
+    """a task run when its result is requested (see `_Ordered`)"""
+
+    def __init__(self, func, item):
+        self.func = func
+        self.item = item
+
+    def get(self):
+        return self.func(self.item)
+
+
+class _Ordered(object):
+    """
+    Runs a function on items in a pool of threads, results come out in the order items went in.
+    The pool is only started for a second pending item, thus small files do not pay for threads.
+    """
+
+    def __init__(self, func, threads):
+        self._func = func
+        self._threads = threads
+        self._pool = None
+        self._pending = deque()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, item):
+        if self._pool is None and self._pending and self._threads > 1:
+            self._pool = ThreadPool(self._threads)
+            self._pending = deque(self._pool.apply_async(task.func, (task.item,)) if isinstance(task, _Deferred) else task
+                    for task in self._pending)
+        if self._pool is None:
+            self._pending.append(_Deferred(self._func, item))
+        else:
+            self._pending.append(self._pool.apply_async(self._func, (item,)))
+
+    def get(self):
+        return self._pending.popleft().get()
+
+    def close(self):
+        self._pending.clear()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+class _RawReader(io.RawIOBase):
+    """uncompressed bytes of a gzip file, members with sizes are decompressed ahead in a pool of threads"""
+
+    def __init__(self, path, threads, ahead):
+        io.RawIOBase.__init__(self)
+        self.name = path
+        self._fi = open(path, 'rb')
+        self._tasks = _Ordered(decompress_member, threads)
+        self._ahead = ahead
+        self._sequential = None  # members without sizes
+        self._block = ''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def _fetch(self):
+        """submits members with sizes (as many as we read ahead), the first member without size makes us go sequential"""
+        while self._sequential is None and len(self._tasks) < self._ahead:
+            offset = self._fi.tell()
+            header = self._fi.read(_HEADER_.size)
+            size = member_size(header)
+            if size is None:
+                if header.strip('\0'):
+                    self._sequential = GzipMembers(self._fi, offset)
+                    continue
+                self._sequential = False  # end of file (or padding)
+                break
+            member = header + self._fi.read(size - len(header))
+            if len(member) != size:
+                raise IOError('Truncated gzip member in %s' % self.name)
+            self._tasks.put(member)
+
+    def _next_block(self):
+        self._fetch()
+        if self._tasks:
+            return self._tasks.get()
+        if self._sequential:
+            data = self._sequential.read()
+            if not data:
+                self._sequential = False
+            return data
+        return ''
+
+    def readinto(self, b):
+        while self._offset >= len(self._block):
+            self._block = self._next_block()
+            self._offset = 0
+            if not self._block and not self._tasks and not self._sequential:
+                return 0
+        n = min(len(b), len(self._block) - self._offset)
+        b[:n] = self._block[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._tasks.close()
+            self._fi.close()
+        io.RawIOBase.close(self)
+
+
+def set_threads(threads):
+    """
+    Sets the number of threads of readers and writers (which do not say otherwise) in this process,
+    e.g. a worker of a pool of processes had better not start as many threads as there are CPUs (see `discourse.executor`).
+    """
+    global _THREADS_
+    _THREADS_ = max(1, threads)
+
+
+def open_reader(path, threads=None, ahead=None, buffer_size=_BLOCK_SIZE_):
+    """
+    Opens a gzip file for reading (a buffered binary stream, which iterates over lines),
+    members written by `GzipWriter` are decompressed in parallel.
+
+    Arguments
+    ---------
+    path: a gzip file
+    threads: number of threads which decompress members (defaults to the number of CPUs, see `set_threads`)
+    ahead: number of members decompressed ahead of the consumer (defaults to twice the number of threads)
+
+    Files may be concatenated (members with sizes, then members without sizes, and so on) and padded with zeros:
+
+    >>> import gzip, tempfile
+    >>> plain = io.BytesIO()
+    >>> with gzip.GzipFile(fileobj=plain, mode='wb') as fo:
+    ...     _ = fo.write('e\\n')
+    >>> with tempfile.NamedTemporaryFile(suffix='.gz') as tmp:
+    ...     with GzipWriter(tmp.name, threads=2, block_size=4) as fo:
+    ...         fo.write('a\\nb\\nc\\nd\\n')
+    ...     with open(tmp.name, 'ab') as fo:
+    ...         fo.write(plain.getvalue() + compress_member('f\\n') + '\\0' * 16)
+    ...     with open_reader(tmp.name, threads=2, ahead=1) as fi:
+    ...         data = fi.read()
+    ...     with open(tmp.name, 'rb') as fi:
+    ...         members = GzipMembers(fi)
+    ...         same = ''.join(iter(members.read, '')) == data
+    >>> data, same, members.starts
+    ('a\\nb\\nc\\nd\\ne\\nf\\n', True, [0, 4, 8, 10])
+    """
+    threads = threads or _THREADS_
+    return io.BufferedReader(_RawReader(path, threads, ahead or 2 * threads), buffer_size)
+
+
+class GzipWriter(object):
+    """
+    Writes a gzip file made of members of about block_size uncompressed bytes (cut at the end of a line),
+    which are compressed in a pool of threads.
+    """
+
+    def __init__(self, path, mode='wb', compresslevel=6, threads=None, ahead=None, block_size=_BLOCK_SIZE_):
+        self.name = path
+        self._fo = open(path, mode.replace('b', '') + 'b')
+        self._level = compresslevel
+        threads = threads or _THREADS_
+        self._tasks = _Ordered(self._compress, threads)
+        self._ahead = ahead or 2 * threads
+        self._block_size = block_size
+        self._buffer = []
+        self._buffered = 0
+        self._members = 0
+        self.closed = False
+        self.softspace = 0  # for print >>
+
+    def _compress(self, data):
+        return compress_member(data, self._level)
+
+    def _put(self, data):
+        self._tasks.put(data)
+        self._members += 1
+        while len(self._tasks) > self._ahead:
+            self._fo.write(self._tasks.get())
+
+    def write(self, data):
+        """
+        Buffers data, whole blocks are handed to the threads (data spanning several blocks is joined once).
+
+        >>> import gzip, tempfile
+        >>> text = ''.join('line {0}\\n'.format(k) for k in range(10))
+        >>> with tempfile.NamedTemporaryFile() as tmp:
+        ...     with GzipWriter(tmp.name, threads=2, block_size=16) as fo:
+        ...         fo.write(text)
+        ...     members = fo._members
+        ...     same = gzip.open(tmp.name).read() == text
+        >>> members, same
+        (5, True)
+        """
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered < self._block_size:
+            return
+        data = ''.join(self._buffer)
+        offset = 0
+        while len(data) - offset >= self._block_size:
+            # members are cut at the end of a line (if there is one)
+            cut = data.rfind('\n', offset, offset + self._block_size) + 1 or len(data)
+            self._put(data[offset:cut])
+            offset = cut
+        self._buffer = [data[offset:]] if offset < len(data) else []
+        self._buffered = len(data) - offset
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """writes out the members compressed so far (buffered data waits for a whole block)"""
+        while self._tasks:
+            self._fo.write(self._tasks.get())
+        self._fo.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # an empty file is still a gzip file
+            if self._buffered or not self._members:
+                self._put(''.join(self._buffer))
+            self.flush()
+        finally:
+            self._tasks.close()
+            self._fo.close()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_gzip(path, mode='rb', compresslevel=6, threads=None):
+    """Opens a gzip file for reading (see `open_reader`), or for writing or appending (see `GzipWriter`)"""
+    if 'w' in mode or 'a' in mode:
+        return GzipWriter(path, mode, compresslevel, threads)
+    return open_reader(path, threads)
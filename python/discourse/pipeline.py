@@ -7,23 +7,42 @@ import os
 import logging
 import argparse
 import traceback
+import threading
 import itertools
 import shlex
+import shutil
+import tempfile
+import time
 import subprocess as sp
 import numpy as np
 from discourse import command
 from glob import glob
 from functools import partial
-from multiprocessing import Pool
-from discourse.doctext import iterdoctext, writedoctext
+from discourse.doctext import iterdoctext, writedoctext, LineBuffer
 from discourse.syntax_based.dseq import dseqs
+from discourse.syntax_based.ibm1 import train_encoded as ibm1_train, argparser as ibm1_argparser
+from discourse.syntax_based.alouis import train_encoded as alouis_train, argparser as alouis_argparser
+from discourse.entity_based.grid import train_model as grid_train, argparser as grid_argparser
 from discourse.syntax_based.ibm1_decoder import decode_many as ibm1_decode_many
 from discourse.syntax_based.alouis_decoder import decode_many as alouis_decode_many
 from discourse.entity_based.grid_decoder import decode_many as grid_decode_many
-from discourse.util import smart_open, tabulate, partial_ordering
+from discourse.util import smart_open, iterfiles, tabulate
+from discourse.rankings import load_scores, rank_systems, write_rankings, write_binary_rankings
+from discourse.executor import Executor
+from discourse.docindex import SUFFIX as INDEX_SUFFIX, open_documents, map_shards
+from discourse.encoded import SUFFIX as ENCODED_SUFFIX, load_corpus
+from discourse.vocabulary import build_vocab
+from discourse.instrument import RunReport, stage, count
 
 
-def make_namespace(args):
+# modules imported by workers before any task runs
+STAGE_MODULES = ['discourse.syntax_based.dseq', 
+        'discourse.syntax_based.ibm1', 'discourse.syntax_based.ibm1_decoder', 
+        'discourse.syntax_based.alouis', 'discourse.syntax_based.alouis_decoder',
+        'discourse.entity_based.grid', 'discourse.entity_based.grid_decoder']
+
+
+def make_namespace(args, models=['ibm1', 'alouis', 'grid']):
     # these are the output folders for each type of model
     # the folder is a function of the hyperparameters of the experiment
     ibm1_experiment = '{0}.d{1}.m{2}'.format(args.training, args.depth, args.m1)
@@ -34,6 +53,14 @@ def make_namespace(args):
     if args.unk:
         ibm1_experiment += '.u'
         alouis_experiment += '.u'
+    # a frozen vocabulary (see discourse.vocabulary) is shared by both syntax-based models
+    vocab_suffix = ''
+    if args.min_count:
+        vocab_suffix += '.mc{0}'.format(args.min_count)
+    if args.top_k:
+        vocab_suffix += '.k{0}'.format(args.top_k)
+    ibm1_experiment += vocab_suffix
+    alouis_experiment += vocab_suffix
     if args.insertion:
         alouis_experiment += '.i'
 
@@ -50,7 +77,9 @@ def make_namespace(args):
         'grids': '{0}/grids'.format(args.data),
         # output stuff
         'workspace': args.workspace,
+        'reports': '{0}/reports'.format(args.workspace),
         'dseqs': '{0}/dseqs{1}'.format(args.workspace, args.depth),
+        'vocab': '{0}/vocab/{1}.d{2}{3}'.format(args.workspace, args.training, args.depth, vocab_suffix) if vocab_suffix else None,
         'ibm1': '{0}/ibm1/{1}'.format(args.workspace, ibm1_experiment),
         'ibm1_model': '{0}/ibm1/{1}/model'.format(args.workspace, ibm1_experiment),
         'ibm1_probs': '{0}/ibm1/{1}/probs'.format(args.workspace, ibm1_experiment),
@@ -80,35 +109,56 @@ def make_namespace(args):
     logging.info('Namespace: %s', names)
 
     if not args.dry_run:
-        for path in [names.workspace, names.dseqs] + [v for k, v in paths.iteritems() if k.split('_')[0] in ['ibm1', 'alouis', 'grid']]:
+        for path in [names.workspace, names.reports, names.dseqs] + [v for k, v in paths.iteritems() if k.split('_')[0] in models]:
+            if not os.path.exists(path):
+                os.makedirs(path)
+        if names.vocab:
+            path = os.path.dirname(names.vocab)
             if not os.path.exists(path):
                 os.makedirs(path)
 
     return names
 
+def find_files(pattern):
+    """files matching a pattern, except for sidecars left next to inputs (see `discourse.docindex` and `discourse.encoded`)"""
+    return [path for path in glob(pattern) if not path.endswith((INDEX_SUFFIX, ENCODED_SUFFIX))]
+
 def file_check(corpus, input_dir, output_dir):
-    todo = frozenset(os.path.basename(path) for path in glob('{0}/{1}*'.format(input_dir, corpus)))
+    todo = frozenset(os.path.basename(path) for path in find_files('{0}/{1}*'.format(input_dir, corpus)))
     logging.info('%d files matching %s', len(todo), '{0}/{1}*'.format(input_dir, corpus))
-    done = frozenset(os.path.basename(path) for path in glob('{0}/{1}*'.format(output_dir, corpus)))
+    done = frozenset(os.path.basename(path) for path in find_files('{0}/{1}*'.format(output_dir, corpus)))
     logging.info('%d files matching %s', len(done), '{0}/{1}*'.format(output_dir, corpus))
     missing = todo - done
     return todo, done, missing
 
-def wrap_dseqs((i, ipath, opath), depth, **kwargs):
+def wrap_dseqs((i, ipath, opath), depth, first=0, last=None, **kwargs):
     """
-    Wrap a call to dseqs. To be used with Pool.map.
+    Wrap a call to dseqs. To be used with Executor.map.
+    A range of documents (first to last-1) may be selected (see `discourse.docindex.open_documents`).
     """
-    try:
-        logging.info('(%d) %s ', i, ipath)
-        fi = smart_open(ipath, 'r')
-        fo = smart_open(opath, 'w')
-        for trees, attrs in iterdoctext(fi):
-            sequences = [' '.join(dseqs(tree, depth=depth, **kwargs)) for tree in trees]
-            writedoctext(fo, sequences, **attrs)
-    except:
-        raise Exception(''.join(traceback.format_exception(*sys.exc_info())))
+    logging.info('(%d) %s ', i, ipath)
+    with open_documents(ipath, first, last) as fi:
+        with smart_open(opath, 'w') as fo, LineBuffer(fo) as fo:
+            for trees, attrs in iterdoctext(fi):
+                sequences = [' '.join(dseqs(tree, depth=depth, **kwargs)) for tree in trees]
+                writedoctext(fo, sequences, **attrs)
+                count(documents=1, sentences=len(trees))
+
+def wrap_dseqs_shard((ipath, first, last), parts_dir, depth, **kwargs):
+    """
+    Wrap a call to dseqs for documents first to last-1 of a file, which are written to a part of the output.
+    To be used with `discourse.docindex.map_shards`.
+
+    Returns
+    -------
+    the path to the part
+    """
+    # parts keep the name of the file as a suffix, so that they are compressed alike (see `discourse.util.smart_open`)
+    part = '{0}/{1}-{2}.{3}'.format(parts_dir, first, last, os.path.basename(ipath))
+    wrap_dseqs((first, ipath, part), depth, first=first, last=last, **kwargs)
+    return part
 
-def extract_dseqs(corpus, args, namespace, **kwargs):
+def extract_dseqs(corpus, args, namespace, executor, **kwargs):
     """
     Extracts dsequences for a certain corpus
     """
@@ -122,17 +172,83 @@ def extract_dseqs(corpus, args, namespace, **kwargs):
         logging.info('all d-sequences of depth %d are there, nothing to be done', args.depth)
         return 
     
-    jobs = [(j, '{0}/{1}'.format(input_dir, name), '{0}/{1}'.format(output_dir, name)) for j, name in enumerate(missing)]
-    pool = Pool(args.jobs)
-    logging.info('Distributing %d jobs to %d workers', len(jobs), args.jobs)
+    tasks = [(j, '{0}/{1}'.format(input_dir, name), '{0}/{1}'.format(output_dir, name)) for j, name in enumerate(missing)]
+    logging.info('Distributing %d jobs to %d workers', len(tasks), executor.workers)
    
     if args.dry_run:
         return 
 
-    pool.map(partial(wrap_dseqs, depth=args.depth, **kwargs), jobs)
+    if not args.shards:
+        executor.map(wrap_dseqs, tasks, depth=args.depth, **kwargs)
+        return
 
+    # files are split in shards (with about the same number of sentences) whose parts are then concatenated in order
+    parts_dir = tempfile.mkdtemp(prefix='parts.', dir=namespace.workspace)
+    try:
+        ipaths = [ipath for j, ipath, opath in tasks]
+        results = map_shards(executor, wrap_dseqs_shard, ipaths, args.shards, parts_dir=parts_dir, depth=args.depth, **kwargs)
+        for (j, ipath, opath), parts in zip(tasks, results):
+            with open(opath, 'wb') as fo:
+                for part in parts:
+                    with open(part, 'rb') as fi:
+                        shutil.copyfileobj(fi, fo)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+
+def make_vocab(args, namespace):
+    """Builds the frozen vocabulary of the syntax-based models from the training d-sequences (see `discourse.vocabulary`)"""
+    if namespace.vocab is None:
+        return
+    if not args.retrain and os.path.exists(namespace.vocab):
+        logging.info('Vocabulary already exists: %s', namespace.vocab)
+        return
+    input_prefix = '{0}/{1}'.format(namespace.dseqs, args.training)
+    training_files = find_files(input_prefix + '*')
+    logging.info('Building vocabulary from %d files matching %s*: %s', len(training_files), input_prefix, namespace.vocab)
+    if args.dry_run:
+        return
+    build_vocab(training_files, namespace.vocab, boundary=True, min_count=args.min_count, top_k=args.top_k)
 
-def train_alouis(args, namespace):
+
+def run_trainer(cmd_args, training_files, workspace):
+    """
+    Runs a trainer as an external process which reads the concatenation of the training files from stdin.
+
+    The training data is staged in a temporary file rather than piped: 
+    workers forked by concurrent tracks would otherwise inherit the write end of the pipe, 
+    and the trainer would never see the end of its input.
+    """
+    with tempfile.TemporaryFile(dir=workspace) as tmp:
+        for path in training_files:
+            with smart_open(path) as fi:
+                shutil.copyfileobj(fi, tmp)
+        tmp.seek(0)
+        proc = sp.Popen(cmd_args, stdin=tmp, close_fds=True)
+        proc.wait()
+    if proc.returncode != 0:
+        raise Exception('Trainer failed (exit code %d): %s' % (proc.returncode, ' '.join(cmd_args)))
+
+
+def train_files(train, training_files, *args, **kwargs):
+    """Calls a trainer (e.g. `alouis.train_model`) streaming the training files, to be used with Executor.apply"""
+    train(iterfiles(training_files), *args, **kwargs)
+
+
+def ibm1_train_files(training_files, output_path, boundary=False, **kwargs):
+    """Trains IBM model 1 on the encodings of the training files (see `discourse.encoded`), to be used with Executor.apply"""
+    corpus, vocab = load_corpus(training_files, boundary)
+    with open(output_path, 'w') as fo:
+        ibm1_train(corpus, vocab, fo, **kwargs)
+
+
+def alouis_train_files(training_files, output, boundary=False, **kwargs):
+    """Trains A. Louis's model on the encodings of the training files (see `discourse.encoded`), to be used with Executor.apply"""
+    corpus, vocab = load_corpus(training_files, boundary)
+    alouis_train(corpus, vocab, output, **kwargs)
+
+
+def train_alouis(args, namespace, executor):
     logging.info("Training A. Louis's model with: %s", args.training)
     output_prefix = '{0}/counts'.format(namespace.alouis_model)
     unigram_path = namespace.dseq_unigrams
@@ -143,26 +259,34 @@ def train_alouis(args, namespace):
         return 
     
     input_prefix = '{0}/{1}'.format(namespace.dseqs, args.training)
-    training_files = glob(input_prefix + '*')
+    training_files = find_files(input_prefix + '*')
     logging.info('%d training files matching %s*', len(training_files), input_prefix)
-    istream = itertools.chain(*map(smart_open, training_files))
     opt_flags = []
     if args.unk:
         opt_flags.append('--unk')
     if args.insertion:
         opt_flags.append('--insertion')
-    cmd_line = 'python -m discourse.syntax_based.alouis -b --smoothing {0} {1} {2} {3}'.format(args.smoothing, args.alouis_config, ' '.join(opt_flags), output_prefix)
-    logging.info(cmd_line)
-    cmd_args = shlex.split(cmd_line)
+    if namespace.vocab:
+        opt_flags.append('--vocab ' + namespace.vocab)
+    options = '-b --smoothing {0} {1} {2} {3}'.format(args.smoothing, args.alouis_config, ' '.join(opt_flags), output_prefix)
+    logging.info('alouis %s', options)
 
     if args.dry_run:
         return
 
-    proc = sp.Popen(cmd_args, stdin=sp.PIPE)
-    proc.communicate(''.join(istream))
+    if args.subprocess:
+        run_trainer(shlex.split('python -m discourse.syntax_based.alouis ' + options), training_files, namespace.workspace)
+    else:
+        config = alouis_argparser(func=None).parse_args(shlex.split(options))
+        executor.apply(alouis_train_files, training_files, config.output, 
+                smoothing=config.smoothing, 
+                insertion=config.insertion, 
+                boundary=config.boundary, 
+                unk=config.unk, 
+                frozen=config.vocab)
 
 
-def decode_alouis(corpus, args, namespace):
+def decode_alouis(corpus, args, namespace, executor):
 
     logging.info("Decoding with A. Louis's model: %s", corpus)
     input_dir = namespace.dseqs
@@ -182,10 +306,11 @@ def decode_alouis(corpus, args, namespace):
     
     ipaths = ['{0}/{1}'.format(input_dir, name) for name in missing]
     opaths = ['{0}/{1}'.format(output_dir, name) for name in missing]
-    alouis_decode_many(namespace.dseq_unigrams, namespace.dseq_bigrams, args.smoothing, ipaths, opaths, jobs=args.jobs)
+    alouis_decode_many(namespace.dseq_unigrams, namespace.dseq_bigrams, args.smoothing, ipaths, opaths, jobs=executor.workers, executor=executor, binary=args.binary, shards=args.shards, 
+            frozen=namespace.vocab)
 
 
-def train_ibm1(args, namespace):
+def train_ibm1(args, namespace, executor):
     logging.info('Training IBM model 1 with: %s', args.training)
     ll_path = '{0}/likelihood'.format(namespace.ibm1_model)
     output_path = namespace.t1  #'{0}/t1'.format(namespace.ibm1_model)
@@ -194,22 +319,33 @@ def train_ibm1(args, namespace):
         return 
     
     input_prefix = '{0}/{1}'.format(namespace.dseqs, args.training)
-    training_files = glob(input_prefix + '*')
+    training_files = find_files(input_prefix + '*')
     logging.info('%d training files matching %s*', len(training_files), input_prefix)
-    istream = itertools.chain(*map(smart_open, training_files))
     unkflag = '--unk' if args.unk else ''
-    cmd_line = 'python -m discourse.syntax_based.ibm1 -m {0} -g 0 -b -p {1} --ll {2} {3} - {4}'.format(args.m1, args.m1_config, ll_path, unkflag, output_path)
-    logging.info(cmd_line)
-    cmd_args = shlex.split(cmd_line)
+    if namespace.vocab:
+        unkflag += ' --vocab ' + namespace.vocab
+    options = '-m {0} -g 0 -b -p {1} --ll {2} {3}'.format(args.m1, args.m1_config, ll_path, unkflag)
+    logging.info('ibm1 %s - %s', options, output_path)
 
     if args.dry_run:
         return
 
-    proc = sp.Popen(cmd_args, stdin=sp.PIPE)
-    proc.communicate(''.join(istream))
-
-
-def decode_ibm1(corpus, args, namespace):
+    if args.subprocess:
+        run_trainer(shlex.split('python -m discourse.syntax_based.ibm1 {0} - {1}'.format(options, output_path)), training_files, namespace.workspace)
+    else:
+        # input and output are left to their defaults, the latter is opened by the forked process
+        config = ibm1_argparser(func=None).parse_args(shlex.split(options))
+        executor.apply(ibm1_train_files, training_files, output_path, 
+                max_iterations=config.max_iterations, 
+                min_gain=config.min_gain, 
+                boundary=config.boundary, 
+                unk=config.unk, 
+                progress=config.progress, 
+                ll=config.ll, 
+                frozen=config.vocab)
+
+
+def decode_ibm1(corpus, args, namespace, executor):
     """
     Computes IBM 1 probabilities for a certain corpus.
     """
@@ -231,10 +367,11 @@ def decode_ibm1(corpus, args, namespace):
     
     ipaths = ['{0}/{1}'.format(input_dir, name) for name in missing]
     opaths = ['{0}/{1}'.format(output_dir, name) for name in missing]
-    ibm1_decode_many(namespace.t1, ipaths, opaths, jobs=args.jobs)
+    ibm1_decode_many(namespace.t1, ipaths, opaths, jobs=executor.workers, executor=executor, binary=args.binary, shards=args.shards, 
+            frozen=namespace.vocab)
 
 
-def train_grid(args, namespace):
+def train_grid(args, namespace, executor):
     logging.info('Training an entity grid model with: %s', args.training)
     ll_path = '{0}/likelihood'.format(namespace.ibm1_model)
     unigram_path = namespace.role_unigrams
@@ -245,21 +382,22 @@ def train_grid(args, namespace):
     
     input_prefix = '{0}/{1}'.format(namespace.grids, args.training)
     output_prefix = '{0}/counts'.format(namespace.grid_model)
-    training_files = glob(input_prefix + '*')
+    training_files = find_files(input_prefix + '*')
     logging.info('%d training files matching %s*', len(training_files), input_prefix)
-    istream = itertools.chain(*map(smart_open, training_files))
-    cmd_line = 'python -m discourse.entity_based.grid - {0} --salience {1}'.format(output_prefix, args.salience)
-    logging.info(cmd_line)
-    cmd_args = shlex.split(cmd_line)
+    options = '- {0} --salience {1}'.format(output_prefix, args.salience)
+    logging.info('grid %s', options)
 
     if args.dry_run:
         return
 
-    proc = sp.Popen(cmd_args, stdin=sp.PIPE)
-    proc.communicate(''.join(istream))
+    if args.subprocess:
+        run_trainer(shlex.split('python -m discourse.entity_based.grid ' + options), training_files, namespace.workspace)
+    else:
+        config = grid_argparser(func=None).parse_args(shlex.split(options))
+        executor.apply(train_files, grid_train, training_files, config.output, salience=config.salience)
 
 
-def decode_grid(corpus, args, namespace):
+def decode_grid(corpus, args, namespace, executor):
     """
     Computes entity grids probabilities for a certain corpus.
     """
@@ -281,7 +419,7 @@ def decode_grid(corpus, args, namespace):
     
     ipaths = ['{0}/{1}'.format(input_dir, name) for name in missing]
     opaths = ['{0}/{1}'.format(output_dir, name) for name in missing]
-    grid_decode_many(namespace.role_unigrams, namespace.role_bigrams, args.salience, ipaths, opaths, jobs=args.jobs)
+    grid_decode_many(namespace.role_unigrams, namespace.role_bigrams, args.salience, ipaths, opaths, jobs=executor.workers, executor=executor, binary=args.binary, shards=args.shards)
 
 
 def evaluate(corpus, model, probs_dir, eval_dir, args, namespace):
@@ -291,29 +429,18 @@ def evaluate(corpus, model, probs_dir, eval_dir, args, namespace):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    names = sorted([os.path.basename(path) for path in glob('{0}/{1}*'.format(input_dir, corpus))])
+    names = sorted([os.path.basename(path) for path in find_files('{0}/{1}*'.format(input_dir, corpus))])
     if not names:
         logging.info('nothing to do')
         return 
     logging.info('Evaluating %d systems for %s', len(names), corpus)
 
-    results = []
-    for name in names:
-        results.append(np.loadtxt('{0}/{1}'.format(input_dir, name))[:,args.column])
-        logging.debug('%s: %d documents', name, len(results[-1]))
-    
-    # checks that every system produced the same number of documents
-    n_docs = [len(R) for R in results]
-    if len(frozenset(n_docs)) != 1:
-        raise Exception("Not all files contain the same number of documents (could you be mixing different language pairs?)")
+    scores = load_scores(['{0}/{1}'.format(input_dir, name) for name in names], args.column)
 
     if args.dry_run:
         return 
 
-    # total number of documents
-    n_docs = n_docs[0]
-    # makes the results a numpy array
-    results = np.array(results)
+    count(documents=scores.shape[1], systems=len(names))
     refsys = None
     if args.refsys:
         if args.refsys in names:
@@ -321,51 +448,160 @@ def evaluate(corpus, model, probs_dir, eval_dir, args, namespace):
             refsys = args.refsys
         else:
             logging.info('Unknown system %s cannot be used as reference', args.refsys)
-    with open('{0}/rankings'.format(output_dir), 'w') as fo:
-        print >> fo, '#best-to-worst'
-        # computes and stores rankings
-        # and counts how many times each system ranked first
-        for i in range(n_docs):
-            ranking = partial_ordering(results[:,i], reverse=True, shuf=False)  # random oder for ties
-            print >> fo, ' > '.join(' '.join(names[sysid] for sysid in group) for r, group in ranking)
-            #ranking = sorted(enumerate(results[:,i]), key=lambda (_, score): score, reverse=True)
-            #print >> fo, ' '.join(names[sysid] for sysid, score in ranking)
+    # ranks systems in every document (tied systems share a rank)
+    order, ranks = rank_systems(scores)
+    if args.binary:
+        write_binary_rankings('{0}/rankings'.format(output_dir), ranks, names)
+    else:
+        with open('{0}/rankings'.format(output_dir), 'w') as fo:
+            write_rankings(fo, order, ranks, names)
 
 
-def main(args):
-
-    # make namespace
-    namespace = make_namespace(args)
+class Track(threading.Thread):
+    """
+    A chain of stages (e.g. train, decode and evaluate a model) which runs concurrently with other tracks.
+    A track starts once the tracks it requires are done, and it is aborted if any of them failed.
+    Errors are kept (as formatted tracebacks) so that the pipeline can report them at the end.
+    """
 
-    # pipeline
-    extract_dseqs(args.training, args, namespace, backoff='[*]')
-   
+    def __init__(self, name, target, requires=[]):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.target = target
+        self.requires = requires
+        self.error = None
+
+    def run(self):
+        for track in self.requires:
+            track.join()
+            if track.error is not None:
+                self.error = 'Track %s requires %s which failed' % (self.name, track.name)
+                return
+        try:
+            logging.info('Starting track: %s', self.name)
+            self.target()
+            logging.info('Track done: %s', self.name)
+        except:
+            self.error = ''.join(traceback.format_exception(*sys.exc_info()))
+
+
+def dseqs_track(args, namespace, executor):
+    with stage('dseqs:' + args.training, depth=args.depth):
+        extract_dseqs(args.training, args, namespace, executor, backoff='[*]')
+    if namespace.vocab:
+        with stage('vocab:' + args.training, depth=args.depth):
+            make_vocab(args, namespace)
     if args.dev:
-        extract_dseqs(args.dev, args, namespace, backoff=['*'])
+        with stage('dseqs:' + args.dev, depth=args.depth):
+            extract_dseqs(args.dev, args, namespace, executor, backoff=['*'])
     if args.test:
-        extract_dseqs(args.test, args, namespace, backoff=['*'])
+        with stage('dseqs:' + args.test, depth=args.depth):
+            extract_dseqs(args.test, args, namespace, executor, backoff=['*'])
 
-    if args.ibm1:
-        train_ibm1(args, namespace)
-        
-        if args.test:
-            decode_ibm1(args.test, args, namespace)
+
+def ibm1_track(args, namespace, executor):
+    with stage('train:ibm1', corpus=args.training):
+        train_ibm1(args, namespace, executor)
+    if args.test:
+        with stage('decode:ibm1', corpus=args.test):
+            decode_ibm1(args.test, args, namespace, executor)
+        with stage('evaluate:ibm1', corpus=args.test):
             evaluate(args.test, namespace.ibm1, namespace.ibm1_probs, namespace.ibm1_eval, args, namespace)
 
-    if args.alouis:
-        train_alouis(args, namespace)
-        if args.test:
-            decode_alouis(args.test, args, namespace)
+
+def alouis_track(args, namespace, executor):
+    with stage('train:alouis', corpus=args.training):
+        train_alouis(args, namespace, executor)
+    if args.test:
+        with stage('decode:alouis', corpus=args.test):
+            decode_alouis(args.test, args, namespace, executor)
+        with stage('evaluate:alouis', corpus=args.test):
             evaluate(args.test, namespace.alouis, namespace.alouis_probs, namespace.alouis_eval, args, namespace)
-    
-    if args.grid:
-        train_grid(args, namespace)
-        if args.test:
-            pass
-            decode_grid(args.test, args, namespace)
+
+
+def grid_track(args, namespace, executor):
+    with stage('train:grid', corpus=args.training):
+        train_grid(args, namespace, executor)
+    if args.test:
+        with stage('decode:grid', corpus=args.test):
+            decode_grid(args.test, args, namespace, executor)
+        with stage('evaluate:grid', corpus=args.test):
             evaluate(args.test, namespace.grid, namespace.grid_probs, namespace.grid_eval, args, namespace)
 
 
+def run_tracks(tracks, executor):
+    """
+    Runs tracks concurrently and shuts the executor down once they are done.
+    Returns the tracks which failed.
+    """
+    logging.info('Running tracks: %s', ' '.join(track.name for track in tracks))
+    try:
+        [track.start() for track in tracks]
+        # joining with a timeout keeps the main thread responsive to KeyboardInterrupt
+        for track in tracks:
+            while track.is_alive():
+                track.join(1)
+    except:
+        executor.terminate()
+        raise
+    executor.close()
+
+    rows, utilisation = executor.report()
+    logging.info('Workers (utilisation %.2f):\n%s', utilisation, tabulate(rows, headers=['worker', 'tasks', 'busy (s)'], floatfmt='.2f'))
+    
+    failed = [track for track in tracks if track.error is not None]
+    for track in failed:
+        logging.error('Track %s failed:\n%s', track.name, track.error)
+    return failed
+
+
+def save_report(report, executor, failed, prefix, dry_run=False):
+    """Completes a run report with the executor's accounting, writes it to '<prefix>-<time>.json' and logs a summary"""
+    rows, utilisation = executor.report()
+    report.extra['workers'] = [dict(zip(['worker', 'tasks', 'busy'], row)) for row in rows]
+    report.extra['utilisation'] = utilisation
+    report.extra['failed'] = [track.name for track in failed]
+    if not dry_run:
+        report_path = '{0}-{1}.json'.format(prefix, time.strftime('%Y%m%d-%H%M%S'))
+        report.write(report_path)
+        logging.info('Run report: %s', report_path)
+    logging.info('Stages:\n%s', report.table())
+
+
+def main(args):
+
+    logging.basicConfig(
+            level=(logging.DEBUG if args.verbose else logging.INFO), 
+            format='%(asctime)s %(levelname)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+
+    # make namespace
+    namespace = make_namespace(args)
+
+    # stages (and the worker tasks they submit) are measured and reported in the workspace
+    report = RunReport(workspace=args.workspace, training=args.training, test=args.test, jobs=args.jobs)
+
+    # workers are shared by all stages of all tracks (--jobs is the global budget)
+    # they are forked before any track starts, with the modules of every stage already imported
+    # a dry run submits no task, thus it forks no worker
+    executor = Executor(args.jobs, modules=STAGE_MODULES, start=not args.dry_run)
+
+    # each model is trained, decoded and evaluated in its own track
+    # d-sequences are only needed by syntax-based models, thus the grid track does not wait for them
+    dseqs = Track('dseqs', partial(dseqs_track, args, namespace, executor))
+    tracks = [dseqs]
+    for name, func in [('ibm1', ibm1_track), ('alouis', alouis_track), ('grid', grid_track)]:
+        if getattr(args, name):
+            requires = [dseqs] if name != 'grid' else []
+            tracks.append(Track(name, partial(func, args, namespace, executor), requires))
+    
+    with report.activate():
+        failed = run_tracks(tracks, executor)
+    save_report(report, executor, failed, '{0}/pipeline'.format(namespace.reports), args.dry_run)
+
+    if failed:
+        raise Exception('Some tracks failed: %s' % ' '.join(track.name for track in failed))
+
+
 @command('pipeline', 'scripts')
 def argparser(parser=None, func=main):
     if parser is None:
@@ -391,7 +627,7 @@ def argparser(parser=None, func=main):
             help='test corpus')
     parser.add_argument('--jobs', 
             type=int, default=10,
-            help='jobs in parallel')
+            help='number of workers (shared by all stages)')
     parser.add_argument('--dry-run', '-n',
             action='store_true',
             help='only stage operations')
@@ -410,6 +646,13 @@ def argparser(parser=None, func=main):
     parser.add_argument('--retest',
             action='store_true',
             help='overwrites existing results')
+    parser.add_argument('--shards',
+            type=int, default=0,
+            help='split the files of a stage (d-sequence extraction and decoding) into about so many tasks with the same number of sentences, '
+            'rather than one task per file (files are indexed, see discourse.docindex)')
+    parser.add_argument('--subprocess',
+            action='store_true',
+            help='run trainers as external processes (python -m ...) rather than as library functions in forked processes')
 
 
     # d-sequences
@@ -449,6 +692,12 @@ def argparser(parser=None, func=main):
     ibm1_alouis_group.add_argument('--unk', '-u',
             action='store_true',
             help='replaces singletons by an unk token')
+    ibm1_alouis_group.add_argument('--min-count',
+            type=int, default=0,
+            help='freeze a vocabulary of the patterns which occur at least so many times in the training data (see discourse.vocabulary)')
+    ibm1_alouis_group.add_argument('--top-k',
+            type=int, default=0,
+            help='freeze a vocabulary of (at most) the so many most frequent patterns in the training data (see discourse.vocabulary)')
     
     # Graph similarity
     graph_group = parser.add_argument_group("Graph similarity")
@@ -474,6 +723,9 @@ def argparser(parser=None, func=main):
     eval_group.add_argument('--refsys',
             type=str,
             help='choose a reference system (e.g. newstest2013.de-en.ref)')
+    eval_group.add_argument('--binary',
+            action='store_true',
+            help='decoders write scores and evaluation writes rankings as columnar stores (see discourse.colstore) rather than text')
     eval_group.add_argument('--tablefmt', 
             default=['plain'], action='append',
             choices=['plain', 'pipes', 'latex', 'simple', 'grid'],
@@ -496,4 +748,5 @@ def argparser(parser=None, func=main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
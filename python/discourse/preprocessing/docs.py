@@ -6,7 +6,6 @@ this modules helps get that.
 @author waziz
 """
 
-import gzip
 import sys
 import argparse
 import logging
@@ -14,9 +13,10 @@ import traceback
 import os
 from functools import partial
 from multiprocessing import Pool
-from discourse.docsgml import TextFromSGML, MakeSGMLDocs
+from discourse.docsgml import TextFromSGML, SGMLDocsWriter
 from ldc import get_ldc_name
 from discourse.doctext import writedoctext
+from discourse.util import smart_open
 
 
 def extract_and_save_sgml(sgml_gz, args):
@@ -26,14 +26,13 @@ def extract_and_save_sgml(sgml_gz, args):
         n = 0
         logging.info('Processing %s', sgml_gz)
         stem = get_ldc_name(sgml_gz)
-        with gzip.open(sgml_gz, 'rb') as fi:
-            sgmler = MakeSGMLDocs(file=stem)
-            parser = TextFromSGML(fi.read(), text_under='text', root='sgml')
-            for doc in parser.iterdocs():
-                if doc['text']:
-                    ids.append(doc['id'])
-                    sgmler.add(doc['text'], id=doc['id'])
-            sgmler.writegz('{0}/raw/{1}'.format(args.workspace, stem))
+        with smart_open(sgml_gz) as fi:
+            with smart_open('{0}/raw/{1}.gz'.format(args.workspace, stem), 'wb') as fo, SGMLDocsWriter(fo, file=stem) as sgmler:
+                # documents are parsed and written out as the file is read (see `TextFromSGML.iterstream`)
+                for content, attrs in TextFromSGML.iterstream(fi, text_under='text', root='sgml'):
+                    if content:
+                        ids.append(attrs['id'])
+                        sgmler.add('\n'.join(content), id=attrs['id'])
             logging.info('%s contains %d documents', stem, len(ids))
         return ids
     except:
@@ -46,13 +45,13 @@ def extract_and_save_txt(sgml_gz, args):
         n = 0
         logging.info('Processing %s', sgml_gz)
         stem = get_ldc_name(sgml_gz)
-        with gzip.open(sgml_gz, 'rb') as fi:
-            with gzip.open('{0}/raw/{1}.gz'.format(args.workspace, stem), 'wb') as fo:
-                parser = TextFromSGML(fi.read(), text_under='text', root='sgml')
-                for doc in parser.iterdocs():
-                    if doc['text']:
-                        ids.append(doc['id'])
-                        writedoctext(fo, doc['text'].split('\n'), id=doc['id'])
+        with smart_open(sgml_gz) as fi:
+            with smart_open('{0}/raw/{1}.gz'.format(args.workspace, stem), 'wb') as fo:
+                # documents are parsed and written out as the file is read (see `TextFromSGML.iterstream`)
+                for content, attrs in TextFromSGML.iterstream(fi, text_under='text', root='sgml'):
+                    if content:
+                        ids.append(attrs['id'])
+                        writedoctext(fo, content, id=attrs['id'])
                 logging.info('%s contains %d documents', stem, len(ids))
         return ids
     except:
@@ -9,16 +9,16 @@ import logging
 import argparse
 import sys
 import os
-import gzip
 import traceback
 import shlex
 import subprocess
 from time import time
 from functools import partial
 from multiprocessing import Pool
-from discourse.docsgml import TextFromSGML, MakeSGMLDocs
+from discourse.docsgml import TextFromSGML, SGMLDocsWriter
 from ldc import parse_ldc_name_from_path
-from discourse.doctext import iterdoctext, writedoctext
+from discourse.doctext import readdoctext, writedoctext
+from discourse.util import smart_open
 from nltk.tree import Tree
 
 
@@ -34,25 +34,23 @@ def grids_from_sgml(ldc_desc, args):
         input_path = '{0}/trees/{1}'.format(args.workspace, ldc_desc['name'])
         output_path = '{0}/grids/{1}'.format(args.workspace, ldc_desc['name'])
         logging.info('Processing %s', input_path)
-        with gzip.open(input_path + '.gz', 'r') as fi:
-            parser = TextFromSGML(fi.read(), text_under='doc')
-            sgmler = MakeSGMLDocs(file=ldc_desc['name'])
-            for doc in parser.iterdocs():
-                logging.debug('document %s', doc['id'])
-                cmd_line = args.ExtractGrid
-                cmd_args = shlex.split(cmd_line)
-                n_docs += 1
-                with gzip.open(output_path + '.gz', 'wb') as fout:
-                    if doc['id'] == 'XIN_ENG_20100101.0127':
-                        print >> sys.stderr, doc['text']
+        with smart_open(input_path + '.gz') as fi:
+            with smart_open(output_path + '.gz', 'wb') as fout, SGMLDocsWriter(fout, file=ldc_desc['name']) as sgmler:
+                # documents are parsed and written out as the file is read (see `TextFromSGML.iterstream`)
+                for content, attrs in TextFromSGML.iterstream(fi, text_under='doc'):
+                    logging.debug('document %s', attrs['id'])
+                    cmd_line = args.ExtractGrid
+                    cmd_args = shlex.split(cmd_line)
+                    n_docs += 1
+                    if attrs['id'] == 'XIN_ENG_20100101.0127':
+                        print >> sys.stderr, '\n'.join(content)
                     #ptbs = doc['text'].split('\n')
                     #for ptb in ptbs:
                     #    print ptb
                     #    print Tree(ptb).leaves()
                     proc = subprocess.Popen(cmd_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-                    (stdoutdata, stderrdata) = proc.communicate('{0}\n'.format(doc['text']))
-                    sgmler.add(stdoutdata, id=doc['id'])
-            sgmler.writegz(output_path)
+                    (stdoutdata, stderrdata) = proc.communicate('{0}\n'.format('\n'.join(content)))
+                    sgmler.add(stdoutdata, id=attrs['id'])
     except:
         raise Exception(''.join(traceback.format_exception(*sys.exc_info())))
 
@@ -70,9 +68,9 @@ def grids_from_text(ldc_desc, args):
         output_path = '{0}/grids/{1}'.format(args.workspace, ldc_desc['name'])
         logging.info('processing: %s', input_path)
         if not args.dry_run:
-            with gzip.open(input_path + '.gz', 'rb') as fi:
-                with gzip.open(output_path + '.gz', 'wb') as fo:
-                    for lines, attrs in iterdoctext(fi):
+            with smart_open(input_path + '.gz') as fi:
+                with smart_open(output_path + '.gz', 'wb') as fo:
+                    for lines, attrs in readdoctext(fi):
                         logging.debug('document %s', attrs['id'])
                         cmd_line = args.ExtractGrid
                         cmd_args = shlex.split(cmd_line)
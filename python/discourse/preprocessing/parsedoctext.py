@@ -26,9 +26,9 @@ from multiprocessing import Pool
 from functools import partial
 from ldc import get_ldc_name
 from discourse.doctext import iterdoctext, writedoctext
-from nltk.tree import Tree
 from discourse.util import tabulate
 from discourse import command
+from discourse.profiling import start_worker
 
 
 def parse(content, args):
@@ -98,9 +98,11 @@ def main(args):
     docs = list(iterdoctext(args.input))
 
     # distributes the jobs
-    pool = Pool(args.jobs)
+    pool = Pool(args.jobs, start_worker)
     logging.info('Distributing %d jobs to %d workers', len(docs), args.jobs)
     result = pool.map(partial(wrap_parse, args=args), docs)
+    pool.close()
+    pool.join()
 
     # stores the output
     times = []
@@ -154,4 +156,5 @@ def argparser(parser=None, func=main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
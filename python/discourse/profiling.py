@@ -0,0 +1,258 @@
+"""
+Profiling of commands: the main process, the threads it starts and the workers of pools it creates.
+
+Every command declared with `discourse.command` accepts `--profile DIR` (as does discotools itself),
+in which case the command runs under cProfile and leaves in DIR (for a run named after the command and the main pid):
+
+    * RUN.main.pstats: the main process (threads started by the command are merged into it)
+    * RUN.worker-PID.pstats: a worker process (see `start_worker`)
+    * RUN.pstats: all of the above merged (e.g. for snakeviz or `python -m pstats`)
+    * RUN.summary.txt: hot functions of the merged profile (by own time and by cumulative time)
+    * RUN.*.memory: with `--profile-memory SECONDS`, the resident memory (MB) of each process sampled over time
+
+Pools become profiled by using `start_worker` as (or from within) their initializer, workers dump their profiles
+when they exit normally (e.g. `pool.close(); pool.join()`), a terminated pool leaves no worker profiles.
+Without `--profile` a command is called directly, thus profiling costs nothing.
+
+Example:
+
+    discotools --profile prof scripts pipeline ws --jobs 4 ...
+    discotools analysis dseq trees dseqs --profile prof --profile-memory 0.5
+
+Remarks: Python 2 has no allocation tracer, memory is sampled at the level of the process (resident set size).
+
+@author: wilkeraziz
+"""
+
+import os
+import glob
+import time
+import logging
+import argparse
+import resource
+import threading
+
+
+# the active session (see `Session`): in the main process and (inherited) in workers forked during the session
+_SESSION_ = None
+# number of lines (functions) in each section of the summary
+_TOP_ = 40
+
+
+def add_arguments(parser, suppress=False):
+    """
+    Adds profiling options to a parser.
+    With `suppress` options have no defaults (so that a subcommand does not override options given to its parent).
+    """
+    group = parser.add_argument_group('Profiling')
+    group.add_argument('--profile',
+            type=str, metavar='DIR', default=argparse.SUPPRESS if suppress else None,
+            help='profile the command (and its workers) leaving .pstats files and a summary of hot functions in DIR')
+    group.add_argument('--profile-memory',
+            type=float, metavar='SECONDS', default=argparse.SUPPRESS if suppress else None,
+            help='with --profile, also sample the resident memory of each process every so many seconds')
+    return parser
+
+
+def rss():
+    """the current resident set size of this process (in MB), or its lifetime peak where there is no procfs"""
+    try:
+        with open('/proc/self/statm') as fi:
+            return int(fi.read().split()[1]) * resource.getpagesize() / 1048576.0
+    except IOError:  # no procfs, the peak will have to do
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def peak_rss():
+    """the high-water mark of the resident set size of this process (in MB) since it started or since `reset_peak_rss`"""
+    try:
+        with open('/proc/self/status') as fi:
+            for line in fi:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0  # in kB
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def reset_peak_rss():
+    """resets the high-water mark of this process (see `peak_rss`) to its current RSS, returns whether the kernel allowed it"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fo:
+            fo.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+class MemorySampler(threading.Thread):
+    """A daemon thread which samples the resident memory of this process every so many seconds"""
+
+    def __init__(self, interval):
+        super(MemorySampler, self).__init__(name='memory-sampler')
+        self.daemon = True
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._started = time.time()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append((time.time() - self._started, rss()))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.samples.append((time.time() - self._started, rss()))
+
+    def write(self, path):
+        with open(path, 'w') as fo:
+            print >> fo, 'time\trss'
+            for t, m in self.samples:
+                print >> fo, '{0:.3f}\t{1:.1f}'.format(t, m)
+
+
+class Session(object):
+    """
+    Profiles a run: the main thread (and threads it starts) of this process and workers which call `start_worker`.
+    Use it as a context manager.
+    """
+
+    def __init__(self, name, directory, memory=None):
+        self.directory = directory
+        self.run = '{0}-{1}'.format(name, os.getpid())
+        self.memory = memory
+        self._profiler = None
+        self._threads = []
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    def path(self, suffix):
+        return '{0}/{1}.{2}'.format(self.directory, self.run, suffix)
+
+    def _profile_thread(self, frame, event, arg):
+        """installed by `threading.setprofile`: gives every new thread a profiler of its own"""
+        import cProfile
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._threads.append(profiler)
+        profiler.enable()
+
+    def __enter__(self):
+        global _SESSION_
+        import cProfile
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        _SESSION_ = self
+        if self.memory:
+            self._sampler = MemorySampler(self.memory)
+            self._sampler.start()
+        threading.setprofile(self._profile_thread)
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global _SESSION_
+        self._profiler.disable()
+        threading.setprofile(None)
+        _SESSION_ = None
+        import pstats
+        stats = pstats.Stats(self._profiler)
+        for profiler in self._threads:
+            stats.add(profiler)
+        stats.dump_stats(self.path('main.pstats'))
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler.write(self.path('main.memory'))
+        summary = summarise(self.directory, self.run)
+        logging.info('Profile of %s: %s', self.run, summary)
+
+
+def start_worker():
+    """
+    Starts profiling a worker process (use it as, or from within, the initializer of a pool).
+    It does nothing unless the worker was forked during a session.
+    """
+    session = _SESSION_
+    if session is None:
+        return
+    import cProfile
+    from multiprocessing.util import Finalize
+    threading.setprofile(None)
+    profiler = cProfile.Profile()
+    sampler = None
+    if session.memory:
+        sampler = MemorySampler(session.memory)
+        sampler.start()
+    profiler.enable()
+    # runs as the worker exits (provided it is not terminated)
+    Finalize(None, _stop_worker, args=(session, profiler, sampler), exitpriority=100)
+
+
+def _stop_worker(session, profiler, sampler):
+    profiler.disable()
+    profiler.dump_stats(session.path('worker-{0}.pstats'.format(os.getpid())))
+    if sampler is not None:
+        sampler.stop()
+        sampler.write(session.path('worker-{0}.memory'.format(os.getpid())))
+
+
+def summarise(directory, run, top=_TOP_):
+    """
+    Merges the profiles of a run and summarises its hot functions.
+
+    Arguments
+    ---------
+    directory: where profiles were saved
+    run: the name of the run (e.g. 'pipeline-1234')
+    top: how many functions to list in each section of the summary
+
+    Returns
+    -------
+    the path to the summary
+    """
+    import pstats
+    paths = sorted(glob.glob('{0}/{1}.*.pstats'.format(directory, run)))
+    summary = '{0}/{1}.summary.txt'.format(directory, run)
+    with open(summary, 'w') as fo:
+        print >> fo, 'Run: %s' % run
+        print >> fo, 'Profiles: %s' % ' '.join(os.path.basename(path) for path in paths)
+        memory = sorted(glob.glob('{0}/{1}.*.memory'.format(directory, run)))
+        if memory:
+            print >> fo, 'Peak resident memory (MB):'
+            for path in memory:
+                with open(path) as fi:
+                    next(fi)
+                    peak = max(float(line.split('\t')[1]) for line in fi)
+                print >> fo, '  {0}: {1:.1f}'.format(os.path.basename(path), peak)
+        if not paths:
+            return summary
+        stats = pstats.Stats(*paths, stream=fo)
+        stats.dump_stats('{0}/{1}.pstats'.format(directory, run))
+        stats.strip_dirs()
+        print >> fo
+        print >> fo, '# Hot functions by own time (all processes)'
+        stats.sort_stats('tottime').print_stats(top)
+        print >> fo, '# Hot functions by cumulative time (all processes)'
+        stats.sort_stats('cumulative').print_stats(top)
+    return summary
+
+
+class ProfiledCommand(object):
+    """
+    Calls a command's function, under a `Session` in case the command line asked for it (see `add_arguments`).
+    This is a class (rather than a closure) so that arguments (which hold the function) can still be pickled.
+    """
+
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+    def __call__(self, args):
+        directory = getattr(args, 'profile', None)
+        if directory is None:
+            return self.func(args)
+        with Session(self.name, directory, getattr(args, 'profile_memory', None)):
+            return self.func(args)
@@ -1,4 +1,20 @@
 """
+A ranking engine: systems are ranked per document by the scores a model assigns to their translations.
+
+Scores are kept in a matrix (systems by documents) and all documents are ranked at once.
+Ranks are dense (1 is the best rank) and tie-aware (tied systems share a rank).
+
+Rankings can be written in text format, one document per line, from best to worst,
+where tied systems are separated by a space and groups are separated by a greater than symbol:
+
+    #best-to-worst
+    A B > C
+    C > A > B
+
+or in binary format (see `write_binary_rankings`).
+
+Scores are read from text files (one document per line, columns separated by white spaces)
+or from columnar stores (see `discourse.colstore`), the latter are memory-mapped.
 
 @author: wilkeraziz
 """
@@ -6,13 +22,144 @@
 import sys
 import argparse
 import logging
-import subprocess as sp
-import shlex
 import numpy as np
 import os
-from tabulate import tabulate
-from discourse.util import partial_ordering
 from discourse import command
+from discourse.colstore import is_store, write_columns, ColumnStore
+
+
+def load_scores(paths, column=1):
+    """
+    Loads the scores of several systems (one file per system, one document per line).
+
+    Arguments
+    ---------
+    paths: one path per system (text files or columnar stores)
+    column: the column containing the scores (0-based)
+
+    Returns
+    -------
+    scores[s,d] is the score of system s for document d
+    """
+    results = []
+    for path in paths:
+        if is_store(path):
+            results.append(ColumnStore(path)[column])
+        else:
+            results.append(np.loadtxt(path)[:,column])
+        logging.debug('%s: %d documents', path, len(results[-1]))
+
+    # checks that every system produced the same number of documents
+    if len(frozenset(len(R) for R in results)) > 1:
+        raise Exception("Not all files contain the same number of documents (could you be mixing different language pairs?)")
+    return np.array(results)
+
+
+def rank_systems(scores, reverse=True):
+    """
+    Ranks systems in every document.
+
+    Arguments
+    ---------
+    scores[s,d]: the score of system s for document d
+    reverse: higher scores rank higher (otherwise lower scores do)
+
+    Returns
+    -------
+    order[k,d]: the system in position k for document d (tied systems appear by increasing id)
+    ranks[s,d]: the dense rank of system s for document d (1 is the best rank, tied systems share a rank)
+
+    >>> order, ranks = rank_systems(np.array([[1., 3.], [2., 3.], [1., 0.]]))
+    >>> order.T
+    array([[1, 0, 2],
+           [0, 1, 2]])
+    >>> ranks.T
+    array([[2, 1, 2],
+           [1, 1, 2]])
+    """
+    # documents are laid out in rows, which keeps the systems of a document contiguous in memory
+    X = np.ascontiguousarray(np.asarray(scores).T)
+    D, S = X.shape
+    docs = np.arange(D)[:,np.newaxis]
+    # a stable sort keeps tied systems by increasing id
+    order = np.argsort(-X if reverse else X, axis=1, kind='mergesort')
+    ordered = X[docs, order]
+    # a new group starts whenever the score changes
+    groups = np.ones((D, S), int)
+    groups[:,1:] = ordered[:,1:] != ordered[:,:-1]
+    ranks = np.empty((D, S), int)
+    ranks[docs, order] = np.cumsum(groups, axis=1)
+    return order.T, ranks.T
+
+
+def _format_rankings(order, ranks, names, ties=True):
+    """formats rankings as a single string (one document per line)"""
+    order, ranks = order.T, ranks.T
+    D, S = order.shape
+    # each line is made of system names interleaved with separators and terminated by a line break
+    tokens = np.empty((D, 2 * S), dtype=object)
+    tokens[:,0:-1:2] = np.array(names, dtype=object)[order]
+    if ties:
+        ordered = ranks[np.arange(D)[:,np.newaxis], order]
+        tokens[:,1:-1:2] = np.array([' ', ' > '], dtype=object)[(ordered[:,1:] != ordered[:,:-1]).astype(int)]
+    else:
+        tokens[:,1:-1:2] = ' '
+    tokens[:,-1] = '\n'
+    return ''.join(tokens.ravel().tolist())
+
+
+def format_rankings(order, ranks, names, ties=True):
+    """
+    Formats rankings, one string per document.
+
+    Arguments
+    ---------
+    order, ranks: as returned by `rank_systems`
+    names: system names
+    ties: separate groups of tied systems with '>' (otherwise rankings are formatted as total orderings)
+
+    Returns
+    -------
+    a list of strings, e.g. 'A B > C'
+
+    >>> format_rankings(*rank_systems(np.array([[1., 3.], [2., 3.], [1., 0.]])), names=['A', 'B', 'C'])
+    ['B > A C', 'A B > C']
+    """
+    return _format_rankings(order, ranks, names, ties).split('\n')[:-1]
+
+
+def write_rankings(ostream, order, ranks, names):
+    """writes rankings in text format (see `format_rankings`)"""
+    print >> ostream, '#best-to-worst'
+    ostream.write(_format_rankings(order, ranks, names))
+
+
+def write_binary_rankings(output, ranks, names):
+    """
+    Writes rankings in binary format: a columnar store (see `discourse.colstore`) indexed by system names
+    whose columns are document ids and ranks[s,d] (using the smallest integer type that fits).
+
+    Arguments
+    ---------
+    output: a path or a binary output stream
+    ranks: as returned by `rank_systems`
+    names: system names
+    """
+    write_columns(output, 
+            [('doc', np.arange(ranks.shape[1])), ('ranks', ranks.astype(np.min_scalar_type(ranks.max() if ranks.size else 0)))],
+            systems=list(names))
+
+
+def read_binary_rankings(path):
+    """
+    Reads rankings in binary format (see `write_binary_rankings`).
+
+    Returns
+    -------
+    ranks[s,d] (a read-only memory map), system names
+    """
+    store = ColumnStore(path)
+    return store['ranks'], store.systems
 
 
 def main(args):
@@ -23,31 +170,16 @@ def main(args):
 
     systems = list(args.named_system)
     [systems.append((os.path.basename(path), path)) for path in args.systems]
-
     if not systems:
         return 
-    
-    results = []
-    for sysname, path in systems:
-        results.append(np.loadtxt(path)[:,args.column])
-        logging.debug('%s: %d documents', sysname, len(results[-1]))
-    
-    # checks that every system produced the same number of documents
-    n_docs = [len(R) for R in results]
-    if len(frozenset(n_docs)) != 1:
-        raise Exception("Not all files contain the same number of documents (could you be mixing different language pairs?)")
 
-    # total number of documents
-    n_docs = n_docs[0]
-    # makes the results a numpy array
-    results = np.array(results)
     names = [sysname for sysname, path in systems]
-    print >> args.output, '#best-to-worst'
-    for i in range(n_docs):
-        ranking = partial_ordering(results[:,i], reverse=True, shuf=False)  # random oder for ties
-        print >> args.output, ' > '.join(' '.join(names[sysid] for sysid in group) for r, group in ranking)
-        #ranking = sorted(enumerate(results[:,i]), key=lambda (_, score): score, reverse=True)
-        #print ' '.join(names[sysid] for sysid, score in ranking)
+    scores = load_scores([path for sysname, path in systems], args.column)
+    order, ranks = rank_systems(scores)
+    if args.binary:
+        write_binary_rankings(args.output, ranks, names)
+    else:
+        write_rankings(args.output, order, ranks, names)
 
 
 @command('rankings', 'scripts')
@@ -75,6 +207,10 @@ def argparser(parser=None, func=main):
             type=int, default=1,
             help='output score used to compare documents (0-based)')
 
+    parser.add_argument('--binary',
+            action='store_true',
+            help='write rankings in binary format (a columnar store, see discourse.colstore)')
+
     parser.add_argument('--verbose', '-v',
             action='store_true',
             help='increase the verbosity level')
@@ -86,6 +222,7 @@ def argparser(parser=None, func=main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
 
 
@@ -8,17 +8,36 @@ import numpy as np
 import itertools
 import argparse
 import logging
+import zlib
 import modeleval
 import wmtgold
 from functools import partial
 from tabulate import tabulate
-from scipy import stats
-from collections import namedtuple
-from scipy.stats import spearmanr
+from collections import namedtuple, OrderedDict
 from discourse.util import make_total_ordering
 from discourse import command
+from discourse.executor import Executor
+from discourse.colstore import is_store
+from discourse.rankings import read_binary_rankings
 
-RankerData = namedtuple('RankerData', 'alias systems rankings first intervals comparisons confidence')
+RankerData = namedtuple('RankerData', 'alias systems rankings first intervals comparisons confidence pvalues')
+
+
+def iterrankings(istream):
+    """
+    Parses partial rankings one document at a time (see `read_rankings` for the format).
+
+    Returns
+    -------
+    generator of rankings, each a list of groups of system names (from best to worst)
+    """
+    for line in istream:
+        if line.startswith('#'):
+            continue
+        line = line.strip()
+        if not line: 
+            continue
+        yield [g.split() for g in line.split('>')]
 
 
 def read_rankings(istream, tiebreak=False):
@@ -42,13 +61,7 @@ def read_rankings(istream, tiebreak=False):
     # read in rankings
     system_set = set()
     rankings = []
-    for line in istream:
-        if line.startswith('#'):
-            continue
-        line = line.strip()
-        if not line: 
-            continue
-        groups = [g.split() for g in line.split('>')]
+    for groups in iterrankings(istream):
         rankings.append(groups)
         [system_set.update(g) for g in groups]
 
@@ -69,6 +82,111 @@ def read_rankings(istream, tiebreak=False):
     return R, sorted(system_set)
 
 
+# streamed rankings are read in chunks of this many documents
+_CHUNK_DOCS_ = 1000
+
+
+def load_rankings(path):
+    """
+    Loads rankings from a file in text format (see `read_rankings`) 
+    or in binary format (see `discourse.rankings.write_binary_rankings`), the latter is memory-mapped.
+
+    Returns
+    -------
+    R[d,s] is the ranking of system s for document d (systems are sorted by name)
+    system names
+    """
+    if not is_store(path):
+        with open(path) as fi:
+            return read_rankings(fi)
+    ranks, names = read_binary_rankings(path)
+    systems = sorted(names)
+    if systems != names:  # the text format sorts systems by name
+        ranks = ranks[[names.index(sysname) for sysname in systems]]
+    return ranks.T, systems
+
+
+def binary_ranking_chunks(path, chunk_size=_CHUNK_DOCS_):
+    """
+    Reads the rankings of a ranker in binary format (see `discourse.rankings.write_binary_rankings`), one chunk of documents at a time.
+
+    Returns
+    -------
+    system names (sorted)
+    generator of numpy arrays such that R[d,s] is the ranking of system s for document d (within a chunk)
+    """
+    R, systems = load_rankings(path)
+
+    def chunks():
+        for start in xrange(0, R.shape[0], chunk_size):
+            yield np.array(R[start:start + chunk_size], int)
+
+    return systems, chunks()
+
+
+def text_ranking_chunks(istream, chunk_size=_CHUNK_DOCS_):
+    """
+    Reads the rankings of a ranker in text format (see `read_rankings`), one chunk of documents at a time.
+    Every document must rank the same systems.
+
+    Returns
+    -------
+    system names (those ranked in the first document, sorted)
+    generator of numpy arrays such that R[d,s] is the ranking of system s for document d (within a chunk)
+    """
+    reader = iterrankings(istream)
+    first = next(reader, None)
+    if first is None:
+        raise ValueError('Streams of rankings cannot be empty')
+    systems = sorted(itertools.chain(*first))
+    names2id = {sysname: i for i, sysname in enumerate(systems)}
+
+    def chunks():
+        R = np.zeros((chunk_size, len(systems)), int)
+        n = 0
+        for groups in itertools.chain([first], reader):
+            for r, group in enumerate(groups, 1):
+                for sysname in group:
+                    R[n, names2id[sysname]] = r
+            n += 1
+            if n == chunk_size:
+                yield R
+                R = np.zeros_like(R)
+                n = 0
+        if n:
+            yield R[:n]
+
+    return systems, chunks()
+
+
+def merge_ranking_chunks(sources):
+    """
+    Reads the rankings of several rankers in lockstep, one chunk of documents at a time.
+    Rankers must rank the same systems and the same documents (in the same order).
+
+    Arguments
+    ---------
+    sources: one (systems, chunks) per ranker, as returned by `text_ranking_chunks` or `binary_ranking_chunks`
+        (with the same chunk size)
+
+    Returns
+    -------
+    system names
+    generator of numpy arrays such that R[m,d,s] is the ranking ranker m assigns to system s for document d (within a chunk)
+    """
+    systems = sources[0][0]
+    if any(names != systems for names, chunks in sources[1:]):
+        raise ValueError('Rankers must rank the same systems')
+
+    def chunks():
+        for parts in itertools.izip_longest(*[chunks for names, chunks in sources]):
+            if any(part is None or part.shape != parts[0].shape for part in parts):
+                raise ValueError('Rankers must rank the same documents')
+            yield np.array(parts)
+
+    return systems, chunks()
+
+
 def assess_first(rankings):
     """
     Arguments
@@ -79,7 +197,7 @@ def assess_first(rankings):
     first: numpy array such that first[s] is the ratio at wich s is ranked first
     """
     N, M = rankings.shape
-    return np.array([sum(r == 1 for r in rankings[:,s]) for s in xrange(M)], float)/N
+    return (rankings == 1).sum(0).astype(float)/N
 
 
 def assess_comparisons(rankings):
@@ -92,16 +210,9 @@ def assess_comparisons(rankings):
     comparisons: numpy array such that comparisons[s1,s2] is the rate at which s1 ranks strictly higher than s2
     """
     N, M = rankings.shape
-    # comparisons[s1,s2]: how many times s1 ranks better than s2
-    comparisons = np.zeros((M,M))
-    # count
-    for d in xrange(N):
-        for s1, s2 in itertools.combinations(range(M), 2):
-            # we ignore ties
-            if rankings[d,s1] < rankings[d,s2]:
-                comparisons[s1,s2] += 1
-            elif rankings[d,s2] < rankings[d,s1]:
-                comparisons[s2,s1] += 1
+    # comparisons[s1,s2]: how many times s1 ranks better than s2 (ties are ignored)
+    # the comparison is broadcast to a (N,M,M) tensor and reduced over documents
+    comparisons = (rankings[:,:,np.newaxis] < rankings[:,np.newaxis,:]).sum(0).astype(float)
 
     # return normalised counts
     return comparisons/N
@@ -115,54 +226,728 @@ def get_confidence_intervals(assessments, p_value=0.05):
     return assessments[(l, u),:].transpose()
 
 
-def bootstrap_resampling(R, rounds, metric):
+# bootstrap rounds are drawn in blocks of roughly this many document indices (or weights)
+_BLOCK_SIZE_ = 1 << 20
+
+
+def resample_blocks(N, rounds, rng=np.random, block_size=_BLOCK_SIZE_):
     """
-    Computes confidence intervals by bootstrap resampling
+    Draws bootstrap samples in blocks.
+
+    A block of k rounds is a (k, N) matrix of document indices drawn with replacement.
+    Blocks consume the random stream exactly as `rounds` sequential calls to `rng.choice(N, size=N, replace=True)` would,
+    thus results do not change for the same seed.
+
+    Arguments
+    ---------
+    N: number of documents
+    rounds: number of bootstrap rounds
+    rng: a RandomState (or the numpy.random module, that is, the global RandomState)
+    block_size: (maximum) number of indices in a block
+
+    Returns
+    -------
+    generator of index matrices
+
+    >>> rng = np.random.RandomState(1)
+    >>> sequential = [rng.choice(50, size=50, replace=True) for i in xrange(30)]
+    >>> np.array_equal(np.concatenate(list(resample_blocks(50, 30, np.random.RandomState(1), block_size=200))), sequential)
+    True
     """
-    N, M = R.shape
-    assessments = []
-    for i in xrange(rounds):
-        batch = np.random.choice(N, size=N, replace=True)
-        assessments.append(metric(R[batch,:]))
-    return np.sort(assessments, 0)
+    k = max(1, block_size // max(N, 1))
+    for start in xrange(0, rounds, k):
+        yield rng.randint(0, N, size=(min(k, rounds - start), N))
 
 
-def paired_bootstrap_resampling(R, rounds, metric):
+def resample_weights(batch):
     """
+    Converts a block of bootstrap samples into (multinomial) weights.
+
     Arguments
     ---------
-    R such that T[m,d,s] is the ranking model m assigns to system s for document d 
+    batch: (k, N) matrix of document indices (see `resample_blocks`)
+
+    Returns
+    -------
+    (k, N) matrix such that W[i,d] is the number of times document d is in sample i
+    """
+    k, N = batch.shape
+    offsets = (np.arange(k) * N)[:,np.newaxis]
+    return np.bincount((batch + offsets).ravel(), minlength=k * N).reshape(k, N).astype(float)
+
+
+def poisson_totals(stats, rounds, rng=np.random, totals=None, block_size=_BLOCK_SIZE_):
     """
+    Poisson bootstrap: every document takes part in every round with a weight drawn from Poisson(1).
+
+    Weights are drawn document by document (a row of `rounds` weights per document),
+    thus totals do not depend on how documents are chunked (e.g. in-memory vs streamed).
+
+    Arguments
+    ---------
+    stats: per-document statistics S[d,k] (documents along the first axis)
+    rounds: number of bootstrap rounds
+    rng: a RandomState
+    totals: weighted totals (T, w) accumulated so far (for streams of documents)
+
+    Returns
+    -------
+    T[i,k]: weighted sum of the statistics for round i
+    w[i]: total weight of round i
+    """
+    N, K = stats.shape
+    T, w = totals if totals is not None else (np.zeros((rounds, K)), np.zeros(rounds))
+    chunk = max(1, block_size // max(rounds, 1))
+    for start in xrange(0, N, chunk):
+        W = rng.poisson(1.0, size=(min(chunk, N - start), rounds)).astype(float)
+        T += W.T.dot(stats[start:start + chunk].astype(float))
+        w += W.sum(0)
+    return T, w
+
+
+def weighted_totals(W, stats, block_size=_BLOCK_SIZE_):
+    """
+    W.dot(stats) for weights W[i,d] and per-document statistics S[d,k] which may be stored compactly (e.g. as uint8),
+    statistics are converted to float a block of documents (of about block_size values) at a time.
+
+    >>> W, S = np.arange(6.).reshape(2, 3), np.array([[0, 1], [1, 1], [1, 0]], dtype=np.uint8)
+    >>> weighted_totals(W, S, block_size=2).tolist()
+    [[3.0, 1.0], [9.0, 7.0]]
+    """
+    if stats.dtype == float:
+        return W.dot(stats)
+    N, K = stats.shape
+    T = np.zeros((W.shape[0], K))
+    chunk = max(1, block_size // max(K, 1))
+    for start in xrange(0, N, chunk):
+        T += W[:,start:start + chunk].dot(stats[start:start + chunk].astype(float))
+    return T
+
+
+def first_statistics(rankings):
+    """per-document statistics for `assess_first`: S[d,s] = 1 if s is ranked first in d"""
+    return (rankings == 1).astype(float)
+
+
+def first_weighted(T, w, shape):
+    """recovers `assess_first` from weighted totals of `first_statistics`"""
+    return T / w[:,np.newaxis]
+
+
+def comparisons_statistics(rankings):
+    """
+    per-document statistics for `assess_comparisons`: S[d,s1*M+s2] = 1 if s1 ranks strictly higher than s2 in d
+
+    Statistics are stored as bytes (M*M per document), they are converted to float a block at a time when weighted
+    (see `weighted_totals` and `poisson_totals`):
+
+    >>> R = np.random.RandomState(0).rand(50, 4).argsort(1) + 1
+    >>> S = comparisons_statistics(R)
+    >>> S.dtype, S.shape, S.nbytes
+    (dtype('uint8'), (50, 16), 800)
+
+    Statistics are weighted by a block of bootstrap samples at a time (see `assess_blocks`),
+    which gives the assessments of the samples drawn sequentially from the same random stream:
+
+    >>> rng = np.random.RandomState(1)
+    >>> sequential = [assess_comparisons(R[rng.choice(50, size=50, replace=True)]) for i in xrange(30)]
+    >>> np.allclose(bootstrap_assessments(R, 30, assess_comparisons, np.random.RandomState(1)), sequential)
+    True
+    """
+    N, M = rankings.shape
+    # the comparison is written straight into a byte array (sparing a boolean copy of it)
+    S = np.empty((N, M, M), dtype=np.uint8)
+    np.less(rankings[:,:,np.newaxis], rankings[:,np.newaxis,:], out=S)
+    return S.reshape(N, M * M)
+
+
+def comparisons_weighted(T, w, shape):
+    """recovers `assess_comparisons` from weighted totals of `comparisons_statistics`"""
+    M = shape[-1]
+    return (T / w[:,np.newaxis]).reshape(len(T), M, M)
+
+
+# metrics which are averages of per-document statistics: metric -> (statistics, weighted)
+# a bootstrap sample is then a vector of per-document weights (rather than a copy of the rankings)
+_WEIGHTED_METRICS_ = dict(modeleval.WEIGHTED_METRICS)
+_WEIGHTED_METRICS_.update({
+        assess_first: (first_statistics, first_weighted),
+        assess_comparisons: (comparisons_statistics, comparisons_weighted)
+        })
+
+
+def weighted_metric(metric):
+    """
+    Returns (statistics, weighted) for a metric (possibly a partial application, e.g. of `modeleval.top1`) 
+    which can be computed from weighted per-document statistics, or None.
+    """
+    func, kwargs = metric, {}
+    if isinstance(metric, partial) and not metric.args:
+        func, kwargs = metric.func, metric.keywords or {}
+    try:
+        statistics, weighted = _WEIGHTED_METRICS_[func]
+    except (KeyError, TypeError):
+        return None
+    return partial(statistics, **kwargs), partial(weighted, **kwargs)
+
+
+# bootstrap schemes
+MULTINOMIAL = 'multinomial'
+POISSON = 'poisson'
+
+
+def assess_blocks(R, rounds, metric, rng=np.random, scheme=MULTINOMIAL, axis=0):
+    """
+    Assesses bootstrap samples of R using a metric.
+
+    Metrics known to `weighted_metric` are computed for whole blocks of samples from per-document statistics
+    (computed once) weighted by how many times each document was sampled:
+        * MULTINOMIAL: weights are derived from resampled indices (the classic bootstrap, see `resample_blocks`)
+        * POISSON: weights are drawn from Poisson(1) (see `poisson_totals`)
+    Other metrics are applied to each (multinomial) sample in turn.
+
+    Arguments
+    ---------
+    R: rankings, documents along a given axis
+    rounds: number of bootstrap rounds
+    metric: a function of rankings
+    rng: a RandomState
+    scheme: MULTINOMIAL or POISSON
+    axis: the axis of documents
+
+    Returns
+    -------
+    generator of arrays of assessments (one per block), the first dimension indexes bootstrap rounds
+    """
+    weighted = weighted_metric(metric)
+    if weighted is not None:
+        statistics, finalise = weighted
+        stats = statistics(R)
+        if scheme == POISSON:
+            T, w = poisson_totals(stats, rounds, rng)
+            yield finalise(T, w, R.shape)
+        else:
+            for batch in resample_blocks(stats.shape[0], rounds, rng):
+                W = resample_weights(batch)
+                yield finalise(weighted_totals(W, stats), W.sum(1), R.shape)
+    elif scheme == POISSON:
+        raise ValueError('The Poisson bootstrap requires a metric which averages per-document statistics')
+    else:
+        for batch in resample_blocks(R.shape[axis], rounds, rng):
+            yield np.array([metric(R.take(sample, axis=axis)) for sample in batch])
+
+
+def count_wins(assessments):
+    """wins[m1,m2]: in how many rounds m1 is assessed strictly better than m2, given assessments[i,m]"""
+    return (assessments[:,:,np.newaxis] > assessments[:,np.newaxis,:]).sum(0)
+
+
+def count_pairwise_wins(assessments):
+    """wins[s1,s2]: in how many rounds the assessment of (s1, s2) is strictly higher than that of (s2, s1), given assessments[i,s1,s2]"""
+    return (assessments > assessments.transpose(0, 2, 1)).sum(0)
+
+
+def bootstrap_assessments(R, rounds, metric, rng=np.random, scheme=MULTINOMIAL):
+    """assessments of bootstrap samples in the order they were drawn (see `bootstrap_resampling`)"""
+    return np.concatenate(list(assess_blocks(R, rounds, metric, rng, scheme)))
+
+
+def paired_bootstrap_wins(R, rounds, metric, rng=np.random, scheme=MULTINOMIAL):
+    """wins[m1,m2]: how many times model m1 is assessed strictly better than m2 (see `paired_bootstrap_resampling`)"""
     M, D, S = R.shape
     wins = np.zeros((M, M))
-    for i in xrange(rounds):
-        batch = np.random.choice(D, size=D, replace=True)
-        assessments = metric(R[:,batch,:])
+    for assessments in assess_blocks(R, rounds, metric, rng, scheme, axis=1):
+        # count victories (for all pairs of models at once)
+        wins += count_wins(assessments)
+    return wins
+
+
+def paired_bootstrap_pairwise_wins(R, rounds, pairwise_metric, rng=np.random, scheme=MULTINOMIAL):
+    """wins[s1,s2]: how many times the assessment of (s1, s2) is strictly higher than that of (s2, s1) (see `paired_bootstrap_resampling_pairwise`)"""
+    N, M = R.shape
+    wins = np.zeros((M, M))
+    for assessments in assess_blocks(R, rounds, pairwise_metric, rng, scheme):
         # count victories
-        for m1, m2 in itertools.combinations(range(M), 2):
-            if assessments[m1] > assessments[m2]:
-                wins[m1,m2] += 1
-            elif assessments[m2] > assessments[m1]:
-                wins[m2,m1] += 1
-    return wins/rounds
+        wins += count_pairwise_wins(assessments)
+    return wins
+
+
+def bootstrap_resampling(R, rounds, metric, rng=np.random, scheme=MULTINOMIAL):
+    """
+    Computes confidence intervals by bootstrap resampling
+
+    Arguments
+    ---------
+    R[d,s]: the ranking of system s in document d
+    rounds: number of bootstrap samples
+    metric: a function of rankings (e.g. `assess_first`)
+    rng: a RandomState (defaults to numpy's global RandomState)
+    scheme: MULTINOMIAL or POISSON (see `assess_blocks`)
+
+    Returns
+    -------
+    assessments sorted along the first dimension (one per round)
+    """
+    return np.sort(bootstrap_assessments(R, rounds, metric, rng, scheme), 0)
 
 
-def paired_bootstrap_resampling_pairwise(R, rounds, pairwise_metric):
+def paired_bootstrap_resampling(R, rounds, metric, rng=np.random, scheme=MULTINOMIAL):
+    """
+    Arguments
+    ---------
+    R such that T[m,d,s] is the ranking model m assigns to system s for document d 
+    rng: a RandomState (defaults to numpy's global RandomState)
+    scheme: MULTINOMIAL or POISSON (see `assess_blocks`)
+
+    Returns
+    -------
+    wins[m1,m2]: the rate at which model m1 is assessed strictly better than m2
+    """
+    return paired_bootstrap_wins(R, rounds, metric, rng, scheme)/rounds
+
+
+def paired_bootstrap_resampling_pairwise(R, rounds, pairwise_metric, rng=np.random, scheme=MULTINOMIAL):
     """
     Paired bootstrap resampling using a pairwise metric
+
+    Returns
+    -------
+    wins[s1,s2]: the rate at which the assessment of (s1, s2) is strictly higher than that of (s2, s1)
     """
-    N, M = R.shape
-    wins = np.zeros((M, M))
-    for i in xrange(rounds):
-        batch = np.random.choice(N, size=N, replace=True)
-        assessments = pairwise_metric(R[batch,:])
-        # count victories
-        for s1, s2 in itertools.combinations(range(M), 2):
-            if assessments[s1,s2] > assessments[s2,s1]:
-                wins[s1,s2] += 1
-            elif assessments[s2,s1] > assessments[s1,s2]:
-                wins[s2,s1] += 1
-    return wins/rounds
+    return paired_bootstrap_pairwise_wins(R, rounds, pairwise_metric, rng, scheme)/rounds
+
+
+# Approximate randomization (paired permutation) tests: under the null hypothesis two labels (two systems of a ranker,
+# or two models) are exchangeable within a document, thus swapping them in a random subset of documents
+# yields a statistic as extreme as the observed one about as often as the p-value.
+
+
+def swap_blocks(N, rounds, rng=np.random, block_size=_BLOCK_SIZE_):
+    """
+    Draws swap masks in blocks.
+
+    Returns
+    -------
+    generator of (k, N) matrices such that F[i,d] = 1 if labels are swapped in document d in permutation i
+    """
+    k = max(1, block_size // max(N, 1))
+    for start in xrange(0, rounds, k):
+        yield rng.randint(0, 2, size=(min(k, rounds - start), N)).astype(float)
+
+
+# permuted statistics within these tolerances of the observed one count as being as extreme:
+# an absolute one for differences of counts (between systems), a relative one for differences of metrics (between models)
+_AR_ABSOLUTE_TOLERANCE_ = 1e-9
+_AR_RELATIVE_TOLERANCE_ = 1e-9
+
+
+def randomization_pairwise_counts(R, rounds, metric=None, rng=np.random, scheme=None):
+    """
+    Approximate randomization test between every pair of systems (s1, s2) of a ranker.
+
+    The statistic is the difference between how often s1 ranks strictly higher than s2 and the converse (see `assess_comparisons`),
+    swapping s1 and s2 in a document flips the sign of that document's contribution,
+    thus all pairs are tested at once by a (k,N) by (N,pairs) product of sign masks and per-document differences.
+
+    Arguments
+    ---------
+    R[d,s]: the ranking of system s in document d
+    rounds: number of permutations
+    metric: unused (tests are always based on pairwise comparisons)
+    rng: a RandomState
+    scheme: unused (see `Resampler`)
+
+    Returns
+    -------
+    counts[s1,s2]: in how many permutations the statistic is at least as extreme as the observed one (symmetric)
+    """
+    N, S = R.shape
+    s1, s2 = np.triu_indices(S, 1)
+    diff = ((R[:,s1] < R[:,s2]).astype(float) - (R[:,s2] < R[:,s1]))  # (N,pairs)
+    observed = np.abs(diff.sum(0)) - _AR_ABSOLUTE_TOLERANCE_
+    counts = np.zeros(len(s1))
+    for F in swap_blocks(N, rounds, rng):
+        counts += (np.abs((1 - 2 * F).dot(diff)) >= observed).sum(0)
+    C = np.zeros((S, S))
+    np.fill_diagonal(C, rounds)  # a system is always as good as itself
+    C[s1, s2] = counts
+    C[s2, s1] = counts
+    return C
+
+
+def randomization_counts(R, rounds, metric, rng=np.random, scheme=None):
+    """
+    Approximate randomization test between every pair of models (m1, m2) assessed by a metric.
+
+    The statistic is the absolute difference between the assessments of m1 and m2.
+    The metric must average per-document statistics (see `weighted_metric`) laid out model by model,
+    then swapping m1 and m2 in a subset of documents moves (the sum of) their statistics in those documents 
+    from one model to the other, and a block of permutations amounts to a matrix product.
+    As in `randomization_pairwise_counts`, all pairs are tested at once (under the same swap masks).
+
+    Arguments
+    ---------
+    R[m,d,s]: the ranking model m assigns to system s in document d
+    rounds: number of permutations
+    metric: a function of R (e.g. `modeleval.top1`)
+    rng: a RandomState
+    scheme: unused (see `Resampler`)
+
+    Returns
+    -------
+    counts[m1,m2]: in how many permutations the statistic is at least as extreme as the observed one (symmetric)
+
+    >>> R = np.random.RandomState(0).rand(2, 40, 4).argsort(2) + 1
+    >>> C = randomization_counts(R[[0, 0, 1]], 100, partial(modeleval.top1, sysid=0, exclusive=False), np.random.RandomState(1))
+    >>> C[0,1], C[0,2] == C[2,0], C[0,2] <= 100  # identical models are never told apart
+    (100.0, True, True)
+    """
+    weighted = weighted_metric(metric)
+    if weighted is None:
+        raise ValueError('Approximate randomization requires a metric which averages per-document statistics')
+    statistics, finalise = weighted
+    M, N, S = R.shape
+    stats = statistics(R).reshape(N, M, -1)
+    K = stats.shape[2]
+    T = stats.sum(0)  # (M,K)
+    observed = finalise(T.reshape(1, -1), np.array([float(N)]), R.shape)[0]
+    m1, m2 = np.triu_indices(M, 1)
+    pairs = np.arange(len(m1))
+    C = np.zeros((M, M))
+    np.fill_diagonal(C, rounds)  # a model is always as good as itself
+    if not len(pairs):
+        return C
+    delta = (stats[:,m2,:] - stats[:,m1,:]).reshape(N, -1)  # moves m2's statistics to m1 (and vice versa), pair by pair
+    threshold = np.abs(observed[m1] - observed[m2]) * (1 - _AR_RELATIVE_TOLERANCE_)
+    counts = np.zeros(len(pairs))
+    # blocks hold about as many permuted totals as blocks of swap masks hold weights
+    block_size = N * max(1, _BLOCK_SIZE_ // (len(pairs) * M * K))
+    for F in swap_blocks(N, rounds, rng, block_size):
+        k = F.shape[0]
+        shift = F.dot(delta).reshape(k, len(pairs), K)
+        Tp = np.tile(T, (k, len(pairs), 1, 1))  # Tp[i,p]: totals of permutation i for pair p
+        Tp[:,pairs,m1,:] += shift
+        Tp[:,pairs,m2,:] -= shift
+        A = finalise(Tp.reshape(k * len(pairs), M * K), np.repeat(float(N), k * len(pairs)), R.shape).reshape(k, len(pairs), M)
+        counts += (np.abs(A[:,pairs,m1] - A[:,pairs,m2]) >= threshold).sum(0)
+    C[m1, m2] = counts
+    C[m2, m1] = counts
+    return C
+
+
+def randomization_pvalues(counts, rounds):
+    """p-values (with the usual add-one correction) given how many of a number of permutations were at least as extreme"""
+    return (counts + 1) / (rounds + 1.0)
+
+
+def approximate_randomization(R, rounds, metric, rng=np.random):
+    """
+    Returns
+    -------
+    pvalues[m1,m2]: p-value of the test between models m1 and m2 (see `randomization_counts`)
+    """
+    return randomization_pvalues(randomization_counts(R, rounds, metric, rng), rounds)
+
+
+def approximate_randomization_pairwise(R, rounds, rng=np.random):
+    """
+    Returns
+    -------
+    pvalues[s1,s2]: p-value of the test between systems s1 and s2 (see `randomization_pairwise_counts`)
+    """
+    return randomization_pvalues(randomization_pairwise_counts(R, rounds, rng=rng), rounds)
+
+
+# rounds of bootstrap resampling are split into streams of (at most) this many rounds
+_STREAM_ROUNDS_ = 100
+
+
+def derive_streams(seed, key, rounds, stream_rounds=_STREAM_ROUNDS_):
+    """
+    Splits the rounds of a bootstrap identified by key (a string) into streams.
+
+    Returns
+    -------
+    a list of (seed, rounds), where a stream's seed is derived from the global seed, the key and the position of the stream
+    """
+    key = zlib.crc32(key) & 0xffffffff
+    return [([seed, key, i], min(stream_rounds, rounds - start)) 
+            for i, start in enumerate(xrange(0, rounds, stream_rounds))]
+
+
+def _run_stream(kernel, R, rounds, metric, seed, scheme):
+    """runs a kernel (e.g. `bootstrap_assessments`) with its own random stream"""
+    return kernel(R, rounds, metric, np.random.RandomState(seed), scheme)
+
+
+def interval_error(assessments, p_value=0.05):
+    """
+    Monte-Carlo standard error of the bounds of `get_confidence_intervals`.
+
+    The error is distribution-free: the rank of the empirical quantile q is (approximately) binomial,
+    thus order statistics one standard deviation (sqrt(N q (1-q)) ranks) away from it span about two standard errors.
+
+    Arguments
+    ---------
+    assessments: sorted along the first dimension (one per round), see `bootstrap_resampling`
+    p_value: see `get_confidence_intervals`
+
+    Returns
+    -------
+    the standard error of each system (the largest across its two bounds)
+    """
+    N = assessments.shape[0]
+    error = np.zeros(assessments.shape[1:])
+    for q in (p_value/2, 1 - p_value/2):
+        k = np.sqrt(N * q * (1 - q))
+        lower = int(max(0, np.floor(N * q - k)))
+        upper = int(min(N - 1, np.ceil(N * q + k)))
+        error = np.maximum(error, (assessments[upper] - assessments[lower]) / 2)
+    return error
+
+
+def rate_error(wins, rounds):
+    """the Monte-Carlo standard error of each win rate (wins out of a number of rounds)"""
+    rates = wins / float(rounds)
+    return np.sqrt(rates * (1 - rates) / rounds)
+
+
+# in adaptive mode, a bootstrap runs at least this many rounds before it may stop
+_MIN_ROUNDS_ = 200
+
+
+class Resampler(object):
+    """
+    Reproducible (and possibly parallel) bootstrap resampling.
+
+    The rounds of a bootstrap are split into streams of fixed size, each stream draws from its own RandomState 
+    whose seed is derived from the global seed, a key which identifies the bootstrap (e.g. the ranker and the metric), 
+    and the position of the stream (see `derive_streams`). 
+    Streams run as tasks of an executor (if any) and their results are merged in order,
+    thus, for a given seed, results do not depend on the number of workers.
+
+    In adaptive mode (i.e. given a precision) the number of rounds is an upper bound and every cell of an estimate
+    (the confidence interval of a system, or the win rate of a pair) stops on its own:
+    streams are merged in order, a cell takes no more rounds as soon as its Monte-Carlo standard error is within precision,
+    and a bootstrap stops once all of its cells have. 
+    The result of a cell is that of a fixed bootstrap with as many rounds as the cell took (see `spent`),
+    which again does not depend on the number of workers.
+
+    >>> R = np.random.RandomState(0).rand(80, 5).argsort(1) + 1
+    >>> resampler = Resampler(3, precision=0.02, min_rounds=100)
+    >>> rates = resampler.paired_bootstrap_resampling_pairwise('comparisons', R, 5000, assess_comparisons)
+    >>> rounds, cells, error = resampler.spent['comparisons']
+    >>> cells.min() < rounds, (error <= 0.02).all()
+    (True, True)
+    >>> s1, s2 = np.unravel_index(cells.argmin(), cells.shape)  # a cell which stopped early
+    >>> fixed = Resampler(3).paired_bootstrap_resampling_pairwise('comparisons', R, cells.min(), assess_comparisons)
+    >>> rates[s1, s2] == fixed[s1, s2]
+    True
+    """
+
+    def __init__(self, seed, executor=None, stream_rounds=_STREAM_ROUNDS_, scheme=MULTINOMIAL, precision=None, min_rounds=_MIN_ROUNDS_):
+        self.seed = seed
+        self.executor = executor
+        self.stream_rounds = stream_rounds
+        self.scheme = scheme
+        self.precision = precision
+        self.min_rounds = min_rounds
+        # key -> (rounds spent, rounds taken by each cell, Monte-Carlo standard error of each cell)
+        self.spent = OrderedDict()
+
+    def streams(self, key, rounds):
+        """returns a list of (seed, rounds) for the streams of a bootstrap identified by key (a string)"""
+        return derive_streams(self.seed, key, rounds, self.stream_rounds)
+
+    def _run_block(self, kernel, R, metric, block):
+        if self.executor is None:
+            return [_run_stream(kernel, R, n, metric, seed, self.scheme) for seed, n in block]
+        tasks = [self.executor.submit(_run_stream, kernel, R, n, metric, seed, self.scheme) for seed, n in block]
+        return [task.result() for task in tasks]
+
+    def run(self, key, kernel, R, rounds, metric, error):
+        """
+        Runs the streams of a kernel and returns their results in order along with how many of them each cell takes.
+        error(results, spent) is the Monte-Carlo standard error of every cell of the estimate given the results so far,
+        in adaptive mode streams run (one block of streams per worker at a time) until the error of every cell 
+        has been within precision, a cell takes the streams merged until then.
+
+        Returns
+        -------
+        results: a list of stream results (in order)
+        used: used[c] is how many of those results make up cell c
+        ends: ends[i] is the number of rounds in the first i+1 streams
+        """
+        streams = self.streams(key, rounds)
+        ends = np.cumsum([n for seed, n in streams])
+        if self.precision is None:
+            results = self._run_block(kernel, R, metric, streams)
+            used = np.zeros(np.shape(error(results, rounds)), int) + len(results)
+            errors = error(results, rounds)
+        else:
+            block_size = self.executor.workers if self.executor is not None else 1
+            results = []
+            used = None
+            for start in xrange(0, len(streams), block_size):
+                block = streams[start:start + block_size]
+                for (seed, n), result in itertools.izip(block, self._run_block(kernel, R, metric, block)):
+                    results.append(result)
+                    current = error(results, ends[len(results) - 1])
+                    if used is None:
+                        used = np.zeros(current.shape, int)
+                        errors = np.zeros(current.shape)
+                    # open cells take this stream, those within precision are closed
+                    open_cells = used == 0
+                    errors[open_cells] = current[open_cells]
+                    if ends[len(results) - 1] >= self.min_rounds:
+                        used[open_cells & (current <= self.precision)] = len(results)
+                    if used.all():
+                        break  # later streams in the block are discarded
+                if used.all():
+                    break
+            # cells which never got within precision take every round
+            used[used == 0] = len(results)
+        cells = ends[used - 1]
+        self.spent[key] = (int(cells.max()), cells, errors)
+        logging.debug('%s: %d rounds (%d to %d per cell, error=%f)', key, cells.max(), cells.min(), cells.max(), errors.max())
+        return results, used, ends
+
+    @staticmethod
+    def _sum(results, used):
+        """sums stream results cell by cell, each cell over the streams it takes"""
+        return sum(np.where(i < used, result, 0) for i, result in enumerate(results))
+
+    def confidence_intervals(self, key, R, rounds, metric, p_value=0.05):
+        """see `bootstrap_resampling` and `get_confidence_intervals` (cells are systems)"""
+        error = lambda results, spent: interval_error(np.sort(np.concatenate(results), 0), p_value)
+        results, used, ends = self.run(key, bootstrap_assessments, R, rounds, metric, error)
+        return np.array([get_confidence_intervals(np.sort(np.concatenate(results[:n])[:,s:s + 1], 0), p_value)[0]
+            for s, n in enumerate(used)])
+
+    def paired_bootstrap_resampling(self, key, R, rounds, metric):
+        """see `paired_bootstrap_resampling`"""
+        error = lambda results, spent: rate_error(sum(results), spent)
+        results, used, ends = self.run(key, paired_bootstrap_wins, R, rounds, metric, error)
+        return self._sum(results, used)/ends[used - 1]
+
+    def paired_bootstrap_resampling_pairwise(self, key, R, rounds, pairwise_metric):
+        """see `paired_bootstrap_resampling_pairwise`"""
+        error = lambda results, spent: rate_error(sum(results), spent)
+        results, used, ends = self.run(key, paired_bootstrap_pairwise_wins, R, rounds, pairwise_metric, error)
+        return self._sum(results, used)/ends[used - 1]
+
+    def approximate_randomization(self, key, R, rounds, metric):
+        """see `approximate_randomization` (streams draw swap masks rather than bootstrap samples)"""
+        error = lambda results, spent: rate_error(sum(results), spent)
+        results, used, ends = self.run(key, randomization_counts, R, rounds, metric, error)
+        return randomization_pvalues(self._sum(results, used), ends[used - 1])
+
+    def approximate_randomization_pairwise(self, key, R, rounds):
+        """see `approximate_randomization_pairwise`"""
+        error = lambda results, spent: rate_error(sum(results), spent)
+        results, used, ends = self.run(key, randomization_pairwise_counts, R, rounds, None, error)
+        return randomization_pvalues(self._sum(results, used), ends[used - 1])
+
+    def table(self, tablefmt='plain'):
+        """
+        the rounds spent by each bootstrap (or permutation test), the fewest rounds taken by one of its cells
+        and the largest Monte-Carlo standard error (in percentage points) of its cells
+        """
+        return tabulate([[key, rounds, cells.min(), error.max() * 100] for key, (rounds, cells, error) in self.spent.iteritems()],
+                headers=['bootstrap', 'rounds', 'min rounds', 'error'],
+                tablefmt=tablefmt,
+                floatfmt='.3f')
+
+
+class _StreamedAssessment(object):
+    """Weighted totals of the statistics of a metric, for unit weights and for the rounds of a Poisson bootstrap"""
+
+    def __init__(self, metric, ranker, streams):
+        weighted = weighted_metric(metric)
+        if weighted is None:
+            raise ValueError('Streamed bootstrap requires a metric which averages per-document statistics')
+        self.statistics, self.weighted = weighted
+        self.ranker = ranker
+        self.rngs = [(np.random.RandomState(seed), n) for seed, n in streams]
+        self.totals = [None] * len(streams)
+        self.T = 0.0
+        self.w = 0.0
+        self.shape = None
+
+    def update(self, R):
+        if self.ranker is not None:
+            R = R[self.ranker]
+        stats = self.statistics(R)
+        self.shape = R.shape
+        self.T = self.T + stats.sum(0, dtype=float)
+        self.w += stats.shape[0]
+        for i, (rng, n) in enumerate(self.rngs):
+            self.totals[i] = poisson_totals(stats, n, rng, self.totals[i])
+
+    def point(self):
+        return self.weighted(self.T[np.newaxis], np.array([self.w]), self.shape)[0]
+
+    def samples(self):
+        return np.concatenate([self.weighted(T, w, self.shape) for T, w in self.totals])
+
+    def wins(self, counter):
+        """wins (see `count_wins` or `count_pairwise_wins`) counted one stream of rounds at a time"""
+        return sum(counter(self.weighted(T, w, self.shape)) for T, w in self.totals)
+
+
+class StreamedBootstrap(object):
+    """
+    Poisson bootstrap over a stream of documents, rankings are never held in memory.
+
+    Assessments are declared upfront (see `add`), then chunks of documents are streamed through (see `update`).
+    Every assessment keeps weighted totals of its per-document statistics for each bootstrap round.
+    Streams of rounds are seeded as in `Resampler`, thus for a given seed 
+    results are the same as those of a `Resampler` using the POISSON scheme (on the same rankings).
+
+    >>> R = np.random.RandomState(0).rand(2, 60, 4).argsort(2) + 1
+    >>> bootstrap = StreamedBootstrap(7, 250)
+    >>> bootstrap.add('comparisons', assess_comparisons, ranker=0)
+    >>> for start in xrange(0, 60, 25):
+    ...     bootstrap.update(R[:,start:start + 25])
+    >>> resampler = Resampler(7, scheme=POISSON)
+    >>> np.allclose(bootstrap.paired_bootstrap_resampling_pairwise('comparisons'),
+    ...     resampler.paired_bootstrap_resampling_pairwise('comparisons', R[0], 250, assess_comparisons))
+    True
+    """
+
+    def __init__(self, seed, rounds, stream_rounds=_STREAM_ROUNDS_):
+        self.seed = seed
+        self.rounds = rounds
+        self.stream_rounds = stream_rounds
+        self.assessments = {}
+
+    def add(self, key, metric, ranker=None):
+        """
+        Declares an assessment identified by key (a string).
+        The metric takes the rankings of a ranker (R[d,s]) or, if ranker is None, of all rankers (R[m,d,s]).
+        """
+        self.assessments[key] = _StreamedAssessment(metric, ranker, derive_streams(self.seed, key, self.rounds, self.stream_rounds))
+
+    def update(self, R):
+        """streams a chunk of documents through: R[m,d,s] is the ranking ranker m assigns to system s in document d"""
+        for assessment in self.assessments.itervalues():
+            assessment.update(R)
+
+    def assess(self, key):
+        """the assessment over all documents"""
+        return self.assessments[key].point()
+
+    def bootstrap_resampling(self, key):
+        """see `bootstrap_resampling`"""
+        return np.sort(self.assessments[key].samples(), 0)
+
+    def paired_bootstrap_resampling(self, key):
+        """see `paired_bootstrap_resampling`"""
+        return self.assessments[key].wins(count_wins).astype(float)/self.rounds
+
+    def paired_bootstrap_resampling_pairwise(self, key):
+        """see `paired_bootstrap_resampling_pairwise`"""
+        return self.assessments[key].wins(count_pairwise_wins).astype(float)/self.rounds
 
 
 def get_refsysid(systems, suffix='ref'):
@@ -174,18 +959,33 @@ def get_refsysid(systems, suffix='ref'):
     return refs[0]
 
 
-def test_ranker(ranker, rankings, systems, rounds=1000, p_value=0.95):
+def test_ranker(ranker, rankings, systems, rounds=1000, p_value=0.95, resampler=None, ar_rounds=0):
     """
     Compares diferent systems as ranked by a given model.
+    Bootstrap samples are drawn by a `Resampler` (if given) or from numpy's global RandomState.
+    With ar_rounds > 0, pairs of systems are also compared by approximate randomization (see `randomization_pairwise_counts`).
     """
     # 1) FIRST
     first = assess_first(rankings)
-    f_assessments = bootstrap_resampling(rankings, rounds, metric=assess_first)
-    intervals = get_confidence_intervals(f_assessments, p_value)
+    if resampler is None:
+        intervals = get_confidence_intervals(bootstrap_resampling(rankings, rounds, metric=assess_first), p_value)
+    else:
+        intervals = resampler.confidence_intervals('first:' + ranker, rankings, rounds, metric=assess_first, p_value=p_value)
 
     # 2) COMPARISONS
     comparisons = assess_comparisons(rankings)
-    confidence = paired_bootstrap_resampling_pairwise(rankings, rounds, pairwise_metric=assess_comparisons)
+    if resampler is None:
+        confidence = paired_bootstrap_resampling_pairwise(rankings, rounds, pairwise_metric=assess_comparisons)
+    else:
+        confidence = resampler.paired_bootstrap_resampling_pairwise('comparisons:' + ranker, rankings, rounds, pairwise_metric=assess_comparisons)
+
+    # 3) APPROXIMATE RANDOMIZATION
+    pvalues = None
+    if ar_rounds > 0:
+        if resampler is None:
+            pvalues = approximate_randomization_pairwise(rankings, ar_rounds)
+        else:
+            pvalues = resampler.approximate_randomization_pairwise('ar:' + ranker, rankings, ar_rounds)
     
     return RankerData(alias=ranker, 
             rankings=rankings, 
@@ -193,28 +993,26 @@ def test_ranker(ranker, rankings, systems, rounds=1000, p_value=0.95):
             first=first, 
             intervals=intervals, 
             comparisons=comparisons, 
-            confidence=confidence)
+            confidence=confidence,
+            pvalues=pvalues)
 
 
-def test_all_rankers(rankers, rounds, p_value):
+def test_all_rankers(rankers, rounds, p_value, resampler=None, ar_rounds=0):
     # test each ranker
     rankers_data = []
     for ranker, path in rankers:
         logging.info('Comparing systems using %s: %s', ranker, path)
-        rankings, systems = read_rankings(open(path))
-        rankers_data.append(test_ranker(ranker, rankings, systems, rounds, p_value))
+        rankings, systems = load_rankings(path)
+        rankers_data.append(test_ranker(ranker, rankings, systems, rounds, p_value, resampler, ar_rounds))
     return rankers_data
 
 
-def modelcmp(rankers, args, alias, header, metric, scale=100):
-    systems = rankers[0].systems
-    refsysid = rankers[0].systems.index(args.refsys)
-    rankers_names = [ranker.alias for ranker in rankers]
-    cmp_id = '_'.join(sorted(ranker.alias for ranker in rankers))
-
-    R = np.array([ranker.rankings for ranker in rankers])
-    logging.info('Assessing models: %s', alias)
-    model_assessments = metric(R) * scale # assess_models(R, refsysid) 
+def write_modelcmp(args, rankers_names, alias, header, model_assessments, confidence, pvalues=None):
+    """
+    writes the assessments of the models (and the confidence with which one model is better than another)
+    as well as p-values of approximate randomization tests (if any)
+    """
+    cmp_id = '_'.join(sorted(rankers_names))
     model_table = sorted(np.column_stack((rankers_names, model_assessments)),
             key=lambda row: float(row[1]), 
             reverse=True)
@@ -224,17 +1022,52 @@ def modelcmp(rankers, args, alias, header, metric, scale=100):
                     headers=['model', header],
                     tablefmt=fmt,
                     floatfmt=".2f")
-    logging.info('Confidence: %s', alias)
-    confidence = paired_bootstrap_resampling(R, args.rounds, metric=metric) * 100
     for fmt in args.tablefmt:
         with open('{0}.modelcmp-{1}-confidence.{2}.{3}'.format(args.output, alias, cmp_id, fmt), 'w') as fo:
             print >> fo, tabulate(np.column_stack((rankers_names, confidence)),
                     headers=rankers_names,
                     tablefmt=fmt,
                     floatfmt=".2f")
+    if pvalues is not None:
+        for fmt in args.tablefmt:
+            with open('{0}.modelcmp-{1}-ar.{2}.{3}'.format(args.output, alias, cmp_id, fmt), 'w') as fo:
+                print >> fo, tabulate(np.column_stack((rankers_names, pvalues)),
+                        headers=rankers_names,
+                        tablefmt=fmt,
+                        floatfmt=".4f")
+
+
+def modelcmp(rankers, args, alias, header, metric, scale=100, resampler=None):
+    rankers_names = [ranker.alias for ranker in rankers]
+
+    R = np.array([ranker.rankings for ranker in rankers])
+    logging.info('Assessing models: %s', alias)
+    model_assessments = metric(R) * scale # assess_models(R, refsysid) 
+    logging.info('Confidence: %s', alias)
+    if resampler is None:
+        confidence = paired_bootstrap_resampling(R, args.rounds, metric=metric) * 100
+    else:
+        confidence = resampler.paired_bootstrap_resampling('modelcmp:' + alias, R, args.rounds, metric=metric) * 100
+    pvalues = None
+    if args.ar > 0:
+        logging.info('Approximate randomization: %s', alias)
+        if resampler is None:
+            pvalues = approximate_randomization(R, args.ar, metric=metric)
+        else:
+            pvalues = resampler.approximate_randomization('ar:modelcmp:' + alias, R, args.ar, metric=metric)
+    write_modelcmp(args, rankers_names, alias, header, model_assessments, confidence, pvalues)
     return model_assessments
     
 
+def model_metrics(refsysid):
+    """the metrics by which models are compared: a list of (alias, metric)"""
+    return [('refgt', partial(modeleval.ranks_higher, sysid=refsysid, strictly=True)),
+            ('refge', partial(modeleval.ranks_higher, sysid=refsysid, strictly=False)),
+            ('firstx', partial(modeleval.top1, sysid=refsysid, exclusive=True)),
+            ('first', partial(modeleval.top1, sysid=refsysid, exclusive=False)),
+            ('EW', partial(modeleval.expected_win, sysid=refsysid))]
+
+
 def main(args):
     
     if args.throw:
@@ -247,7 +1080,105 @@ def main(args):
             format='%(asctime)s %(levelname)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
 
 
-    rankers = test_all_rankers(args.ranker, args.rounds, args.pvalue)
+    # bootstrap rounds are split into streams seeded from --seed, which run in parallel with --jobs
+    # for a given seed, results do not depend on the number of jobs
+    seed = args.seed if args.seed is not None else np.random.RandomState().randint(2**31)
+    logging.info('Seed: %d', seed)
+    if args.stream:
+        # rankings are never held in memory, this requires the Poisson bootstrap (see `StreamedBootstrap`)
+        if args.bootstrap != POISSON:
+            logging.info('Streaming rankings: using the Poisson bootstrap')
+        if args.jobs > 1:
+            logging.info('Streaming rankings: ignoring --jobs')
+        if args.precision is not None:
+            logging.info('Streaming rankings: ignoring --precision (all rounds are accumulated in a single pass)')
+        if args.ar > 0:
+            logging.info('Streaming rankings: ignoring --ar (permutation tests require the rankings in memory)')
+        compare_stream(args, seed)
+    else:
+        # in adaptive mode --rounds is an upper bound (see `Resampler`)
+        precision = args.precision / 100 if args.precision is not None else None
+        if args.jobs > 1:
+            with Executor(args.jobs) as executor:
+                resampler = Resampler(seed, executor, scheme=args.bootstrap, precision=precision, min_rounds=args.min_rounds)
+                compare(args, resampler)
+        else:
+            resampler = Resampler(seed, scheme=args.bootstrap, precision=precision, min_rounds=args.min_rounds)
+            compare(args, resampler)
+        logging.info('Rounds spent: %d (bootstrap samples and permutations)', sum(rounds for rounds, cells, error in resampler.spent.itervalues()))
+        if precision is not None:
+            for fmt in args.tablefmt:
+                with open('{0}.rounds.{1}'.format(args.output, fmt), 'w') as fo:
+                    print >> fo, resampler.table(fmt)
+
+
+def compare(args, resampler=None):
+    """runs the comparisons requested in the command line (see `argparser`)"""
+
+    rankers = test_all_rankers(args.ranker, args.rounds, args.pvalue, resampler, args.ar)
+
+    def assess_models(alias, metric):
+        return modelcmp(rankers, args, alias, alias, metric=metric, resampler=resampler)
+
+    report(args, rankers, assess_models)
+
+
+def compare_stream(args, seed):
+    """
+    Runs the comparisons requested in the command line (see `argparser`) in a single pass over the rankings.
+    For a given seed, results are those of `compare` with a `Resampler` using the Poisson bootstrap.
+    """
+    aliases = [ranker for ranker, path in args.ranker]
+    for ranker, path in args.ranker:
+        logging.info('Streaming rankings of %s: %s', ranker, path)
+    # each ranker is read in its own format (binary rankings are memory-mapped)
+    istreams = []
+    sources = []
+    for ranker, path in args.ranker:
+        if is_store(path):
+            sources.append(binary_ranking_chunks(path))
+        else:
+            istreams.append(open(path))
+            sources.append(text_ranking_chunks(istreams[-1]))
+    systems, chunks = merge_ranking_chunks(sources)
+
+    bootstrap = StreamedBootstrap(seed, args.rounds)
+    for m, ranker in enumerate(aliases):
+        bootstrap.add('first:' + ranker, assess_first, ranker=m)
+        bootstrap.add('comparisons:' + ranker, assess_comparisons, ranker=m)
+    if args.refsys is not None:
+        for alias, metric in model_metrics(systems.index(args.refsys)):
+            bootstrap.add('modelcmp:' + alias, metric)
+    n_docs = 0
+    for R in chunks:
+        bootstrap.update(R)
+        n_docs += R.shape[1]
+    [istream.close() for istream in istreams]
+    logging.info('Streamed %d documents', n_docs)
+
+    rankers = [RankerData(alias=ranker,
+            rankings=None,
+            systems=systems,
+            first=bootstrap.assess('first:' + ranker),
+            intervals=get_confidence_intervals(bootstrap.bootstrap_resampling('first:' + ranker), args.pvalue),
+            comparisons=bootstrap.assess('comparisons:' + ranker),
+            confidence=bootstrap.paired_bootstrap_resampling_pairwise('comparisons:' + ranker),
+            pvalues=None) for ranker in aliases]
+
+    def assess_models(alias, metric):
+        model_assessments = bootstrap.assess('modelcmp:' + alias) * 100
+        confidence = bootstrap.paired_bootstrap_resampling('modelcmp:' + alias) * 100
+        write_modelcmp(args, aliases, alias, alias, model_assessments, confidence)
+        return model_assessments
+
+    report(args, rankers, assess_models)
+
+
+def report(args, rankers, assess_models):
+    """
+    Writes the comparisons of systems (per ranker) and of models.
+    Models are assessed by assess_models(alias, metric) which returns one assessment per ranker.
+    """
 
     for r, ranker in enumerate(rankers):
         # clean up system names
@@ -279,6 +1210,14 @@ def main(args):
                         tablefmt=fmt,
                         floatfmt=".2f")
 
+        if ranker.pvalues is not None:
+            for fmt in args.tablefmt:
+                with open('{0}.syscmp-ar.{1}.{2}'.format(args.output, ranker.alias, fmt), 'w') as fo:
+                    print >> fo, tabulate(np.column_stack((short_names, ranker.pvalues)),
+                            headers=short_names,
+                            tablefmt=fmt,
+                            floatfmt=".4f")
+
         # 3) reference wins
         if args.refsys is not None:
             refsysid = ranker.systems.index(args.refsys)
@@ -304,7 +1243,6 @@ def main(args):
     #rankings = np.array([ranker.rankings for ranker in rankers]).transpose((1,2,0))[:,refsysid,:]
     if args.refsys is not None:
         system_names = rankers[0].systems
-        R = np.array([ranker.rankings for ranker in rankers])
 
         for metricname in args.metric:
             if metricname == 'ranks_higher':
@@ -323,13 +1261,10 @@ def main(args):
             #A = modelcmp(rankers, args, infix, infix, metric=metricfunc)
             
 
-        A1 = modelcmp(rankers, args, 'refgt', 'refgt', metric=partial(modeleval.ranks_higher, sysid=refsysid, strictly=True))
-        A2 = modelcmp(rankers, args, 'refge', 'refge', metric=partial(modeleval.ranks_higher, sysid=refsysid, strictly=False))
-        A3 = modelcmp(rankers, args, 'firstx', 'firstx', metric=partial(modeleval.top1, sysid=refsysid, exclusive=True))
-        A4 = modelcmp(rankers, args, 'first', 'first', metric=partial(modeleval.top1, sysid=refsysid, exclusive=False))
-        A5 = modelcmp(rankers, args, 'EW', 'EW', metric=partial(modeleval.expected_win, sysid=refsysid))
-        H = ['refgt', 'refge', 'firstx', 'first', 'EW']
-        ALL = [rankers_names, A1, A2, A3, A4, A5]
+        metrics = model_metrics(rankers[0].systems.index(args.refsys))
+        assessments = [assess_models(alias, metric) for alias, metric in metrics]
+        H = [alias for alias, metric in metrics]
+        ALL = [rankers_names] + assessments
         #if args.pair in wmtgold.WMT14_RANKINGS:
         #    gold=np.array([wmtgold.WMT14_RANKINGS[args.pair][sysname] for sysname in system_names], float)
         #    A6 = modelcmp(rankers, args, 'gold', 'gold', scale=1.0, metric=partial(modeleval.rho, sysid=refsysid, gold_rankings=gold))
@@ -396,10 +1331,33 @@ def argparser(parser=None, func=main):
     parser.add_argument('--ranker', 
             default=[],
             nargs=2, action='append',
-            help='ranker and rankings')
+            help='ranker and rankings (in text or binary format, see discourse.rankings)')
     parser.add_argument('--rounds', 
             type=int, default=1000,
             help='number of rounds in bootstrap resampling')
+    parser.add_argument('--precision',
+            type=float,
+            help='adaptive bootstrap: each confidence interval (or win rate of a comparison) stops as soon as its Monte-Carlo standard error '
+            'is within this many percentage points, --rounds is then an upper bound (rounds spent are reported in OUTPUT.rounds.FMT)')
+    parser.add_argument('--min-rounds',
+            type=int, default=_MIN_ROUNDS_,
+            help='adaptive bootstrap: minimum number of rounds')
+    parser.add_argument('--seed',
+            type=int,
+            help='seeds bootstrap resampling (by default a random seed is chosen and logged)')
+    parser.add_argument('--jobs', '-j',
+            type=int, default=1,
+            help='number of processes running bootstrap resampling')
+    parser.add_argument('--bootstrap',
+            type=str, default=MULTINOMIAL, choices=[MULTINOMIAL, POISSON],
+            help='resampling scheme: multinomial (classic) or poisson (per-document weights drawn from Poisson(1))')
+    parser.add_argument('--stream',
+            action='store_true',
+            help='stream rankings (in lockstep across rankers) rather than loading them into memory, implies --bootstrap poisson')
+    parser.add_argument('--ar',
+            type=int, default=0, metavar='ROUNDS',
+            help='number of permutations in approximate randomization tests between systems and between models '
+            '(p-values are written to OUTPUT.syscmp-ar.* and OUTPUT.modelcmp-*-ar.*), 0 disables the tests')
     parser.add_argument('--pvalue', '-p',
             type=float, default=0.05,
             help='p-value')
@@ -424,4 +1382,5 @@ def argparser(parser=None, func=main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
@@ -0,0 +1,322 @@
+"""
+Hyperparameter sweeps: runs the pipeline for every configuration in a grid of hyperparameters.
+
+Configurations share whatever they have in common (see `plan`):
+
+    * d-sequences depend only on the depth
+    * IBM model 1 depends on the depth, the number of iterations and --unk
+    * A. Louis's counts depend on the depth, --unk and --insertion (the smoothing constant is only used at decoding time)
+    * the entity grid model depends only on the salience
+    * a frozen vocabulary (--min-count and --top-k) depends only on the depth, and it is shared by all syntax-based configurations
+
+Every shared artifact is computed once, configuration-specific work (decoding and evaluation) runs in parallel,
+and the sweep ends with one table of results (one row per configuration).
+
+Example:
+
+    python -m discourse.sweep ws --data data --training newstest2014.de-en.ref --test newstest2014.de-en \
+        --ibm1 --alouis --depth 2 3 --m1 10 30 --smoothing 0.001 0.01 0.1 --unk 0 1
+
+The layout of the workspace is that of `discourse.pipeline`, thus configurations can be rerun (or inspected) with the pipeline.
+
+@author: wilkeraziz
+"""
+
+import os
+import logging
+import argparse
+import itertools
+import shutil
+import numpy as np
+from functools import partial
+from discourse import command
+from discourse import modeleval
+from discourse.significance import load_rankings, get_refsysid
+from discourse.pipeline import make_namespace, Track, run_tracks, save_report, STAGE_MODULES
+from discourse.pipeline import dseqs_track, ibm1_track, alouis_track, grid_track, train_alouis
+from discourse.executor import Executor
+from discourse.instrument import RunReport, stage
+from discourse.util import tabulate
+
+
+def unique(values):
+    """removes repeated values preserving order"""
+    return [v for i, v in enumerate(values) if v not in values[:i]]
+
+
+def configure(args, **params):
+    """
+    Returns the arguments of a single pipeline run,
+    hyperparameters take their first value in the grid unless specified.
+    """
+    config = dict(vars(args))
+    config.update(namespace=False,
+            depth=args.depth[0],
+            m1=args.m1[0],
+            smoothing=args.smoothing[0],
+            unk=bool(args.unk[0]),
+            insertion=bool(args.insertion[0]),
+            salience=args.salience[0])
+    config.update(params)
+    return argparse.Namespace(**config)
+
+
+def plan(args):
+    """
+    Plans the union of artifacts required by the grid of hyperparameters.
+
+    Returns
+    -------
+    depths: d-sequences to be extracted
+    experiments: a list of (model, shared, params) where
+        params is a dictionary of hyperparameters that identify a configuration
+        and configurations with the same `shared` key share a trained model
+    """
+    depths = set()
+    experiments = []
+    if args.ibm1:
+        for depth, m1, unk in itertools.product(unique(args.depth), unique(args.m1), unique(args.unk)):
+            depths.add(depth)
+            params = dict(depth=depth, m1=m1, unk=bool(unk))
+            experiments.append(('ibm1', (depth, m1, unk), params))
+    if args.alouis:
+        for depth, unk, insertion, c in itertools.product(unique(args.depth), unique(args.unk), unique(args.insertion), unique(args.smoothing)):
+            depths.add(depth)
+            params = dict(depth=depth, unk=bool(unk), insertion=bool(insertion), smoothing=c)
+            experiments.append(('alouis', (depth, unk, insertion), params))
+    if args.grid:
+        for salience in unique(args.salience):
+            experiments.append(('grid', (salience,), dict(salience=salience)))
+    return sorted(depths), experiments
+
+
+def share_file(source, target, overwrite=False):
+    """makes a file available under another path (a hard link where possible)"""
+    if os.path.exists(target):
+        if not overwrite:
+            return
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def alouis_counts_track(args, namespace, executor):
+    with stage('train:alouis', corpus=args.training):
+        train_alouis(args, namespace, executor)
+
+
+def alouis_shared_track(args, namespace, source, executor):
+    """decodes and evaluates A. Louis's model using counts gathered for another configuration (source namespace)"""
+    if not args.dry_run and namespace.alouis_model != source.alouis_model:
+        share_file(source.dseq_unigrams, namespace.dseq_unigrams, overwrite=args.retrain)
+        share_file(source.dseq_bigrams, namespace.dseq_bigrams, overwrite=args.retrain)
+    # the model has been trained by the track which gathered the counts
+    alouis_track(argparse.Namespace(**dict(vars(args), retrain=False)), namespace, executor)
+
+
+def assess(eval_dir, args):
+    """
+    Assesses the rankings of a configuration with respect to the reference system (see `discourse.modeleval`).
+
+    Returns
+    -------
+    number of systems, number of documents, how often the reference ranks first, how often it ranks higher than other systems
+    (empty cells if there is nothing to be assessed)
+    """
+    path = '{0}/{1}/rankings'.format(eval_dir, args.test)
+    if not args.test or not os.path.exists(path):
+        return ['', '', '', '']
+    R, systems = load_rankings(path)
+    try:
+        refsysid = systems.index(args.refsys) if args.refsys else get_refsysid(systems)
+    except Exception:
+        logging.info('No reference system in %s', path)
+        return [len(systems), R.shape[0], '', '']
+    R = R[np.newaxis,:,:]
+    return [len(systems), R.shape[1], modeleval.top1(R, refsysid)[0] * 100, modeleval.ranks_higher(R, refsysid)[0] * 100]
+
+
+def main(args):
+
+    logging.basicConfig(
+            level=(logging.DEBUG if args.verbose else logging.INFO),
+            format='%(asctime)s %(levelname)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+
+    depths, experiments = plan(args)
+    if not experiments:
+        logging.info('Nothing to be done (choose at least one model: --ibm1, --alouis, --grid)')
+        return
+    logging.info('%d configurations sharing %d d-sequence sets and %d models',
+            len(experiments), len(depths), len(frozenset((model, shared) for model, shared, _ in experiments)))
+
+    report = RunReport(workspace=args.workspace, training=args.training, test=args.test, jobs=args.jobs, sweep=len(experiments))
+    # a dry run submits no task, thus it forks no worker
+    executor = Executor(args.jobs, modules=STAGE_MODULES, start=not args.dry_run)
+
+    # d-sequences: one track per depth
+    dseqs = {}
+    for depth in depths:
+        config = configure(args, depth=depth)
+        dseqs[depth] = Track('dseqs{0}'.format(depth), partial(dseqs_track, config, make_namespace(config, []), executor))
+    tracks = dseqs.values()
+
+    # one track per configuration, configurations of A. Louis's model wait for the track that gathers their counts
+    counts = {}
+    results = []
+    for model, shared, params in experiments:
+        config = configure(args, **params)
+        namespace = make_namespace(config, [model])
+        name = os.path.relpath(getattr(namespace, model), args.workspace)
+        requires = [dseqs[config.depth]] if model != 'grid' else []
+        if model == 'ibm1':
+            tracks.append(Track(name, partial(ibm1_track, config, namespace, executor), requires))
+        elif model == 'alouis':
+            if shared not in counts:
+                counts[shared] = (Track(name + ':counts', partial(alouis_counts_track, config, namespace, executor), requires), namespace)
+                tracks.append(counts[shared][0])
+            source_track, source = counts[shared]
+            tracks.append(Track(name, partial(alouis_shared_track, config, namespace, source, executor), [source_track]))
+        else:
+            tracks.append(Track(name, partial(grid_track, config, namespace, executor), requires))
+        results.append((model, params, getattr(namespace, model + '_eval')))
+
+    with report.activate():
+        failed = run_tracks(tracks, executor)
+    save_report(report, executor, failed, '{0}/reports/sweep'.format(args.workspace), args.dry_run)
+
+    # consolidated results
+    keys = ['depth', 'm1', 'unk', 'smoothing', 'insertion', 'salience']
+    rows = [[model] + [params.get(key, '') for key in keys] + assess(eval_dir, args) + [os.path.relpath(eval_dir, args.workspace)]
+            for model, params, eval_dir in results]
+    headers = ['model'] + keys + ['systems', 'docs', 'ref first (%)', 'ref higher (%)', 'eval']
+    print tabulate(rows, headers=headers, floatfmt='.2f')
+    if args.test and not args.dry_run:
+        for fmt in args.tablefmt:
+            with open('{0}/sweep.{1}.{2}'.format(args.workspace, args.test, fmt), 'w') as fo:
+                print >> fo, tabulate(rows, headers=headers, tablefmt=fmt, floatfmt='.2f')
+
+    if failed:
+        raise Exception('Some tracks failed: %s' % ' '.join(track.name for track in failed))
+
+
+@command('sweep', 'pipeline')
+def argparser(parser=None, func=main):
+    if parser is None:
+        parser = argparse.ArgumentParser(prog='sweep')
+
+    parser.description = 'Runs the pipeline for a grid of hyperparameters (sharing intermediate artifacts)'
+    parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
+
+    parser.add_argument('workspace',
+            type=str,
+            help='where everything happens')
+    parser.add_argument('--data',
+            type=str, default='../data',
+            help='data folder (where we find corpora: text and parse trees)')
+    parser.add_argument('--training',
+            type=str, default='potet.ref',
+            help='training corpus')
+    parser.add_argument('--dev',
+            type=str,
+            help='dev corpus')
+    parser.add_argument('--test',
+            type=str,
+            help='test corpus')
+    parser.add_argument('--jobs',
+            type=int, default=10,
+            help='number of workers (shared by all configurations)')
+    parser.add_argument('--dry-run', '-n',
+            action='store_true',
+            help='only stage operations')
+    parser.add_argument('--alias',
+            type=str, default='',
+            help='name the experiment (re model)')
+    parser.add_argument('--verbose', '-v',
+            action='store_true',
+            help='increase the verbosity level')
+    parser.add_argument('--retrain',
+            action='store_true',
+            help='overwrites existing models')
+    parser.add_argument('--retest',
+            action='store_true',
+            help='overwrites existing results')
+    parser.add_argument('--subprocess',
+            action='store_true',
+            help='run trainers as external processes (python -m ...) rather than as library functions in forked processes')
+    parser.add_argument('--shards',
+            type=int, default=0,
+            help='split the files of a stage (d-sequence extraction and decoding) into about so many tasks with the same number of sentences, '
+            'rather than one task per file (files are indexed, see discourse.docindex)')
+
+    # models
+    model_group = parser.add_argument_group('Models')
+    model_group.add_argument('--ibm1',
+            action='store_true',
+            help='uses IBM model 1')
+    model_group.add_argument('--m1-config',
+            type=str, default='',
+            help='additional options to dicourse.syntax_based.ibm1')
+    model_group.add_argument('--alouis',
+            action='store_true',
+            help="uses A. Louis's model")
+    model_group.add_argument('--alouis-config',
+            type=str, default='',
+            help='additional options to dicourse.syntax_based.alouis')
+    model_group.add_argument('--grid',
+            action='store_true',
+            help="uses Grid model")
+    model_group.add_argument('--min-count',
+            type=int, default=0,
+            help='freeze a vocabulary of the patterns which occur at least so many times in the training data (see discourse.vocabulary)')
+    model_group.add_argument('--top-k',
+            type=int, default=0,
+            help='freeze a vocabulary of (at most) the so many most frequent patterns in the training data (see discourse.vocabulary)')
+
+    # the grid of hyperparameters
+    grid_group = parser.add_argument_group('Hyperparameters (each option takes one or more values)')
+    grid_group.add_argument('--depth',
+            type=int, nargs='+', default=[2],
+            help='depth of d-sequences')
+    grid_group.add_argument('--m1',
+            type=int, nargs='+', default=[30],
+            help='ibm model 1 iterations')
+    grid_group.add_argument('--smoothing', '-c',
+            type=float, nargs='+', default=[0.001],
+            help="smoothing constant of A. Louis's model")
+    grid_group.add_argument('--insertion', '-i',
+            type=int, nargs='+', default=[0], choices=[0, 1],
+            help="models insertion in A. Louis's model (0: no, 1: yes)")
+    grid_group.add_argument('--unk', '-u',
+            type=int, nargs='+', default=[0], choices=[0, 1],
+            help='replaces singletons by an unk token (0: no, 1: yes)')
+    grid_group.add_argument('--salience',
+            type=int, nargs='+', default=[0],
+            help='ignore at training less salient entities in a document')
+
+    # eval
+    eval_group = parser.add_argument_group('Evaluation')
+    eval_group.add_argument('--column', '-k',
+            type=int, default=1,
+            help='output score used to compare documents (0-based)')
+    eval_group.add_argument('--refsys',
+            type=str,
+            help='choose a reference system (by default the system whose name ends with "ref")')
+    eval_group.add_argument('--binary',
+            action='store_true',
+            help='decoders write scores and evaluation writes rankings as columnar stores (see discourse.colstore) rather than text')
+    eval_group.add_argument('--tablefmt',
+            default=['plain'], action='append',
+            choices=['plain', 'pipes', 'latex', 'simple', 'grid'],
+            help='add an output tabulate format')
+
+    if func is not None:
+        parser.set_defaults(func=func)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = argparser().parse_args()
+    args.func(args)
@@ -28,11 +28,13 @@ import math
 import sys
 import logging
 from collections import defaultdict
-from scipy.optimize import minimize_scalar
 import argparse
 import numpy as np
-from discourse.util import bar, pairwise, ibm_pairwise, read_documents, encode_documents, find_least_common
+from discourse.util import bar, iterdocuments, encode_documents, unk_least_common, write_table
+from discourse.encoded import load_corpus
+from discourse.vocabulary import load_vocab, freeze
 from discourse import command
+from discourse import instrument
 
 def count(T, V, insertion=False, null=0):
     """
@@ -40,7 +42,7 @@ def count(T, V, insertion=False, null=0):
 
     Arguments
     ---------
-    T: training data encoded as numpy arrays of ids
+    T: training data encoded as a `util.RaggedCorpus` of ids
     V: size of the vocabulary (which might include a null symbol)
     insertion: whether or not insertion is considered (in which case the null symbol takes id 0 in the vocabulary)
 
@@ -53,16 +55,12 @@ def count(T, V, insertion=False, null=0):
     U = np.zeros(V)
     B = np.zeros((V, V))
 
-    getpairs = ibm_pairwise if insertion else pairwise
-
     # counting
-    for D in bar(T, msg='Counting patterns'):
-        if insertion:  # if we have null tokens we count one occurrence for each sentence in the document (that can head a pair of sentences)
-            U[null] += len(D) - 1
-        for Sa in D:
-            for u in Sa:
-                U[u] += 1
-        for Sa, Sb in getpairs(D):
+    U += T.token_counts(V)
+    if insertion:  # if we have null tokens we count one occurrence for each sentence in the document (that can head a pair of sentences)
+        U[null] += (T.document_lengths() - 1).sum()
+    for i in bar(xrange(len(T)), maxval=len(T), msg='Counting patterns'):
+        for Sa, Sb in T.pairs(i, null=insertion):
             for u, v in itertools.product(Sa, Sb):
                 B[u,v] += 1
 
@@ -75,7 +73,7 @@ def loglikelihood(T, U, B, c=0, insertion=False):
 
     Arguments
     ---------
-    T: training data encoded by `encode_documents`
+    T: training data encoded by `util.encode_documents`
     U: unigram counts as produced by `count`
     B: bigram counts as produced by `count`
     c: smoothing constant (in absolute discounting smoothing)
@@ -84,11 +82,9 @@ def loglikelihood(T, U, B, c=0, insertion=False):
     """
     ll = 0.0
     
-    getpairs = ibm_pairwise if insertion else pairwise
-
-    for D in bar(T, maxval=len(T), msg='log likelihood'):
+    for i in bar(xrange(len(T)), maxval=len(T), msg='log likelihood'):
         # for each sentence pair
-        for Sa, Sb in getpairs(D):  # if insertion=True, then getpairs=ibm_pairwise, consequently, Sa[0] is the null word
+        for Sa, Sb in T.pairs(i, null=insertion):  # if insertion=True, then Sa[0] is the null word
             # for each pattern in the second sentence of the pair
             for v in Sb:
                 # sum up the contributions of the pattern v conditioned on each pattern u in the first sentence of the pair
@@ -106,53 +102,101 @@ def minimize(T, U, B, insertion):
         logging.info('average likelihood: %f', -ll/len(T))
         return -ll/len(T)
 
+    from scipy.optimize import minimize_scalar  # scipy is slow to import
     return minimize_scalar(f, bounds=(0.0, 1.0), args=(T, U, B, insertion), method='bounded')
 
 
-def main(args):
-    """load data and optimise the likelihood"""
-    logging.basicConfig(
-            level=(logging.DEBUG if args.verbose else logging.INFO), 
-            format='%(levelname)s %(message)s')
+def train_model(istream, output, smoothing=0.0, insertion=False, boundary=False, unk=False, frozen=None):
+    """
+    Gathers unigram and bigram counts and dumps them to '<output>.unigrams' and '<output>.bigrams'.
+
+    Arguments
+    ---------
+    istream: training corpus in doctext format (any iterable of lines, e.g. an open file or `util.iterfiles`),
+        documents are encoded as they are read, thus memory is bounded by the encoded corpus
+    output: prefix for output files
+    smoothing: smoothing constant (only used to report the likelihood of the training data)
+    insertion: whether or not insertion is considered
+    boundary: add document boundary tokens
+    unk: replace the least common patterns by an unk token
+    frozen: path to a frozen vocabulary (see `discourse.vocabulary`), patterns out of it are replaced by an unk token
+
+    Returns
+    -------
+    encoded corpus, unigram counts and bigram counts
+    """
 
-    # read in documents
+    # read in documents and encode them using flat arrays of ids
     logging.info('Reading documents in ...')
-    documents = read_documents(sys.stdin, args.boundary)
-    logging.info('%d documents, on average %.2f sentences per document', len(documents), np.mean([len(D)for D in documents]))
+    T, vocab = encode_documents(iterdocuments(istream, boundary))
+    return train_encoded(T, vocab, output, smoothing, insertion, unk, frozen)
+
+
+def train_encoded(T, vocab, output, smoothing=0.0, insertion=False, unk=False, frozen=None):
+    """
+    Gathers unigram and bigram counts from an encoded corpus (e.g. memory-mapped by `discourse.encoded.load_corpus`)
+    and dumps them. See `train_model` for the arguments.
+    """
+    logging.info('%d documents, on average %.2f sentences per document', len(T), np.mean(T.document_lengths()))
+    instrument.count(documents=len(T), sentences=T.num_sentences(), patterns=T.num_patterns())
     
-    least_common, min_count = find_least_common(documents) if args.unk else (frozenset(), 0)
-    if args.unk:
+    if frozen:
+        T, vocab = freeze(T, vocab, load_vocab(frozen))
+        logging.info('Frozen vocabulary: %s', frozen)
+    elif unk:
+        T, vocab, least_common, min_count = unk_least_common(T, vocab)
         logging.info('Least common patterns: frequency=%d patterns=%d', min_count, len(least_common))
    
-    # decide whether or not there will be a null symbol
-    # encode documents using numpy array of ids
-    T, vocab = encode_documents(documents, ignore=least_common)
-   
     # gather unigram and bigram counts
     logging.info('Counting ...')    
-    U, B = count(T, len(vocab), insertion=args.insertion)
+    U, B = count(T, len(vocab), insertion=insertion)
     logging.info('%d unigrams, %d bigrams', U.size, B.size)
 
     # compute log likelihood
     logging.info('Computing likelihood ...')
-    ll = loglikelihood(T, U, B, args.smoothing, args.insertion)
-    logging.info('Negative log likelihood %f with c=%f and insertion=%s', -ll, args.smoothing, args.insertion)
+    ll = loglikelihood(T, U, B, smoothing, insertion)
+    logging.info('Negative log likelihood %f with c=%f and insertion=%s', -ll, smoothing, insertion)
     
     # dumps U and B in a nice format
-    tokens = [t for t, i in sorted(vocab.iteritems(), key=lambda (t, i): i)]
+    tokens = np.array([t for t, i in sorted(vocab.iteritems(), key=lambda (t, i): i)], dtype=object)
     V = len(tokens)
-    logging.info('Writing unigrams to: %s', '{0}.unigrams'.format(args.output))
-    with open('{0}.unigrams'.format(args.output), 'w') as fu:
-        print >> fu, '#pattern\t#count'
-        for u, n in sorted(enumerate(U), key=lambda (u, n): n, reverse=True):
-            print >> fu, '{0}\t{1}'.format(tokens[u], n)
-    logging.info('Writing bigrams to: %s', '{0}.bigrams'.format(args.output))
-    with open('{0}.bigrams'.format(args.output), 'w') as fb:
-        print >> fb, '#trigger\t#pattern\t#count'
+    logging.info('Writing unigrams to: %s', '{0}.unigrams'.format(output))
+    with open('{0}.unigrams'.format(output), 'w') as fu:
+        # most frequent first (ties in order of ids)
+        order = np.argsort(-U, kind='mergesort')
+        write_table(fu, '#pattern\t#count', [tokens[order], U[order]])
+    logging.info('Writing bigrams to: %s', '{0}.bigrams'.format(output))
+    with open('{0}.bigrams'.format(output), 'w') as fb:
+        fb.write('#trigger\t#pattern\t#count\n')
         for u in xrange(V):
-            # we iterate over triggers so that the most likely ones come first
-            for v in sorted(itertools.ifilter(lambda v: B[u,v], xrange(V)), key=lambda v: B[u,v], reverse=True):
-                print >> fb, '{0}\t{1}\t{2}'.format(tokens[u], tokens[v], B[u,v])
+            # we iterate over triggers so that the most likely ones come first (ties in order of ids)
+            W = np.flatnonzero(B[u])
+            W = W[np.argsort(-B[u,W], kind='mergesort')]
+            write_table(fb, None, [np.repeat(tokens[u], len(W)), tokens[W], B[u,W]])
+
+    return T, U, B
+
+
+def main(args):
+    """load data and optimise the likelihood"""
+    logging.basicConfig(
+            level=(logging.DEBUG if args.verbose else logging.INFO), 
+            format='%(levelname)s %(message)s')
+
+    if args.files:
+        T, vocab = load_corpus(args.files, args.boundary)
+        T, U, B = train_encoded(T, vocab, args.output, 
+                smoothing=args.smoothing, 
+                insertion=args.insertion, 
+                unk=args.unk, 
+                frozen=args.vocab)
+    else:
+        T, U, B = train_model(sys.stdin, args.output, 
+                smoothing=args.smoothing, 
+                insertion=args.insertion, 
+                boundary=args.boundary, 
+                unk=args.unk, 
+                frozen=args.vocab)
 
     # legacy options: optimise likelihood
     if args.mle:
@@ -172,6 +216,9 @@ def argparser(parser=None, func=main):
     parser.add_argument('output', 
             type=str,
             help="prefix for output files")
+    parser.add_argument('--files', nargs='+',
+            type=str,
+            help='read the training corpus from doctext files (rather than stdin) through their encodings (see discourse.encoded)')
     parser.add_argument('--insertion', '-i',
             action='store_true',
             help='allows for insertion (obviating the need for a smoothing constant)')
@@ -184,6 +231,9 @@ def argparser(parser=None, func=main):
     parser.add_argument('--unk', '-u',
             action='store_true',
             help='replaces singletons by an unk token')
+    parser.add_argument('--vocab',
+            type=str,
+            help='a frozen vocabulary (see discourse.vocabulary), patterns out of it are replaced by an unk token (overrides --unk)')
     parser.add_argument('--mle',
             action='store_true',
             help="chooses c to maximise the data's likelihood (useless, note that this will retrieve the MLE solution, i.e. c=0)")
@@ -198,5 +248,6 @@ def argparser(parser=None, func=main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
 
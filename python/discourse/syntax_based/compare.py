@@ -21,6 +21,7 @@ import shlex
 import numpy as np
 import os
 from tabulate import tabulate
+from discourse.rankings import rank_systems, format_rankings
 
 
 def parse_args():
@@ -117,13 +118,12 @@ def main(args):
         first = np.zeros(len(names), float)
         print >> fo, '#doc\t#best-to-worst'
 
-        # computes and stores rankings
+        # computes and stores rankings (ties are broken in favour of the system listed first)
         # and counts how many times each system ranked first
-        for i in range(n_docs):
-            ranking = sorted(enumerate(results[:,i]), key=lambda (s, r): r, reverse=True)
-            first_sys, first_score = ranking[0]
-            first[first_sys] += 1
-            print >> fo, '{0}\t{1}'.format(i, ' '.join(names[s] for s, r in ranking))
+        order, ranks = rank_systems(results)
+        first += np.bincount(order[0], minlength=len(names))
+        for i, ranking in enumerate(format_rankings(order, ranks, names, ties=False)):
+            print >> fo, '{0}\t{1}'.format(i, ranking)
         
         # normalise
         first /= first.sum()
@@ -8,11 +8,21 @@ Extract d-sequences from PTB-style parse trees (see Louis and Nekova, 2012).
 import string
 import argparse
 import sys
-from nltk.tree import Tree
-from discourse.doctext import writedoctext, iterdoctext
+from discourse.doctext import writedoctext, iterdoctext, LineBuffer
 from discourse import command
 
 
+def _parse_tree(ptb_str):
+    """parses a PTB-formatted string into an nltk.tree.Tree (nltk is imported on demand, it is slow to import)"""
+    from nltk.tree import Tree
+    return Tree.fromstring(ptb_str)
+
+
+def _is_node(t):
+    """whether a child is a node (rather than a leaf, that is, a string)"""
+    return not isinstance(t, basestring)
+
+
 def _find_subtrees(tree, depth, target_depth, subtrees):
     """
     Recursively searches for subtrees at a certain depth.
@@ -25,9 +35,9 @@ def _find_subtrees(tree, depth, target_depth, subtrees):
     subtrees: list of subtrees at the target depth
     """
     if depth + 1 == target_depth:
-        subtrees.extend(t for t in tree if isinstance(t, Tree))
+        subtrees.extend(t for t in tree if _is_node(t))
     else:
-        [_find_subtrees(t, depth + 1, target_depth, subtrees) for t in tree if isinstance(t, Tree)]
+        [_find_subtrees(t, depth + 1, target_depth, subtrees) for t in tree if _is_node(t)]
 
 
 def find_subtrees(tree, depth):
@@ -44,6 +54,7 @@ def find_subtrees(tree, depth):
     list of nlt.tree.Tree objects representing the selected subtrees
 
     >>> ptb_str = "(ROOT (S (NP (DT The) (VBG following)) (VP (VBP are) (NP (NP (JJ major) (NN news) (NNS items)) (PP (IN in) (NP (NP (VBG leading) (JJ Turkish) (NNS newspapers)) (PP (IN on) (NP (NNP Monday))))))) (. .)))"
+    >>> from nltk.tree import Tree
     >>> ptb_tree = Tree.fromstring(ptb_str)   
     >>> subtrees = find_subtrees(ptb_str, 2)  # find_subtrees accepts strings
     >>> [t.label() for t in subtrees]         # and it returns a list of subtrees (ojbects of the kind nlt.tree.Tree)
@@ -56,7 +67,7 @@ def find_subtrees(tree, depth):
     ['NP', 'PP']
     """
     if isinstance(tree, str):
-        tree = Tree.fromstring(tree)
+        tree = _parse_tree(tree)
     subtrees = []
     _find_subtrees(tree, 0, depth, subtrees)
     return subtrees
@@ -105,7 +116,7 @@ def dseqs(tree, depth=2, no_punc=True, lexicalised=False, child_phrase='leftmost
     """
     # convert input to nlt.tree.Tree if str
     if isinstance(tree, str):
-        tree = Tree.fromstring(tree)
+        tree = _parse_tree(tree)
     
     # deal with punctuation
     if no_punc:
@@ -141,7 +152,7 @@ def dseqs(tree, depth=2, no_punc=True, lexicalised=False, child_phrase='leftmost
             continue
         
         child_label = None
-        if isinstance(child, Tree):  # child is a node
+        if _is_node(child):  # child is a node
             child_label = child.label()
         elif lexicalised:  # child is a leaf and we are lexicalising items
             child_label = child
@@ -157,7 +168,8 @@ def dseqs(tree, depth=2, no_punc=True, lexicalised=False, child_phrase='leftmost
 
 
 def main(args):
-    # reads in documents
+    # reads in documents (d-sequences are written in large chunks)
+    output = LineBuffer(args.output)
     for trees, attrs in iterdoctext(args.input):
         # generator of d-sequences
         sequences = (dseqs(tree, 
@@ -168,9 +180,10 @@ def main(args):
                         backoff=['*']) 
                     for tree in trees)
         # writes d-sequences
-        writedoctext(args.output, 
+        writedoctext(output, 
                 (' '.join(patterns) for patterns in sequences),
                 **attrs)
+    output.flush()
 
 
 @command('dseq', 'analysis')
@@ -202,6 +215,7 @@ def argparser(parser=None, func=main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
 
 
@@ -42,15 +42,18 @@ import logging
 import itertools
 import argparse
 import numpy as np
-from discourse.util import bar, ibm_pairwise, read_documents, encode_documents, find_least_common
+from discourse.util import bar, iterdocuments, encode_documents, unk_least_common, write_table
+from discourse.encoded import load_corpus
+from discourse.vocabulary import load_vocab, freeze
 from discourse import command
+from discourse import instrument
 
 def loglikelihood(corpus, T, progress=False):
     """computes -log(likelihood(T))"""
     L = np.zeros(len(corpus))
-    for i, D in bar(enumerate(corpus), maxval=len(corpus), none=not progress, msg='log likelihood'):
-        # for each sentence pair
-        for E, F in ibm_pairwise(D):
+    for i in bar(xrange(len(corpus)), maxval=len(corpus), none=not progress, msg='log likelihood'):
+        # for each sentence pair (E is prefixed with the null symbol)
+        for E, F in corpus.pairs(i, null=True):
             # for each pattern in the second sentence of the pair
             for f in F:
                 # sum up the contributions of the pattern v conditioned on each pattern u in the first sentence of the pair
@@ -64,7 +67,7 @@ def ibm1(corpus, V, max_iterations, min_gain, progress=False):
     
     Arguments
     ---------
-    corpus: training data encoded using numpy arrays of vocab ids (integers) 
+    corpus: training data encoded as a `util.RaggedCorpus` of vocab ids (integers) 
         where the id 0 represents the null symbol
     V: vocabulary size
     max_iterations: maximum number of iterations (current convergence criterion)
@@ -85,9 +88,9 @@ def ibm1(corpus, V, max_iterations, min_gain, progress=False):
         C = np.zeros((V, V), float)  # C[f,e] = c(f,e)
         N = np.zeros(V, float)       # N[e] = c(e)
         # E-step
-        for D in bar(corpus, none=not progress, msg='E-step'):
-            # for each sentence pair
-            for E, F in ibm_pairwise(D):
+        for i in bar(xrange(len(corpus)), maxval=len(corpus), none=not progress, msg='E-step'):
+            # for each sentence pair (E is prefixed with the null symbol)
+            for E, F in corpus.pairs(i, null=True):
                 Z = np.zeros(V, float)  # Z[fi] = \sum_j t(fi|ej)
                 # normalising factor 
                 for f in F:
@@ -112,47 +115,93 @@ def ibm1(corpus, V, max_iterations, min_gain, progress=False):
     return T, LL
 
      
-def main(args):
-    
-    logging.basicConfig(
-            level=(logging.DEBUG if args.verbose else logging.INFO), 
-            format='%(asctime)s %(levelname)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+def train_model(istream, ostream, max_iterations=50, min_gain=np.log(10), boundary=False, unk=False, progress=False, ll=None, frozen=None):
+    """
+    Trains IBM model 1 and dumps its estimates.
 
-    # read documents 
+    Arguments
+    ---------
+    istream: training corpus in doctext format (any iterable of lines, e.g. an open file or `util.iterfiles`),
+        documents are encoded as they are read, thus memory is bounded by the encoded corpus
+    ostream: where the estimates are written to
+    max_iterations, min_gain: convergence criteria of EM
+    boundary: add document boundary tokens
+    unk: replace the least common patterns by an unk token
+    progress: display progress information
+    ll: path to a file where the progression of the likelihood is stored
+    frozen: path to a frozen vocabulary (see `discourse.vocabulary`), patterns out of it are replaced by an unk token
+    """
+
+    # maps tokens to integer ids (0 is reserved for a special <null> symbol)
+    # and encodes the training data using flat arrays of vocab ids
     logging.info('Reading documents in...')
-    documents = read_documents(args.input, args.boundary)
-    logging.info('%d documents read', len(documents))
+    corpus, vocab = encode_documents(iterdocuments(istream, boundary))
+    train_encoded(corpus, vocab, ostream, max_iterations, min_gain, unk, progress, ll, frozen)
 
-    least_common, min_count = find_least_common(documents) if args.unk else (frozenset(), 0)
-    if args.unk:
-        logging.info('Least common patterns: frequency=%d patterns=%d', min_count, len(least_common))
 
-    # maps tokens to integer ids (0 is reserved for a special <null> symbol)
-    # and encodes the training data using numpy arrays of vocab ids
-    logging.info('Making vocab')
-    corpus, vocab = encode_documents(documents, ignore=least_common)
+def train_encoded(corpus, vocab, ostream, max_iterations=50, min_gain=np.log(10), unk=False, progress=False, ll=None, frozen=None):
+    """
+    Trains IBM model 1 on an encoded corpus (e.g. memory-mapped by `discourse.encoded.load_corpus`) and dumps its estimates.
+    See `train_model` for the arguments.
+    """
+    logging.info('%d documents read', len(corpus))
+    instrument.count(documents=len(corpus), sentences=corpus.num_sentences(), patterns=corpus.num_patterns())
+
+    if frozen:
+        corpus, vocab = freeze(corpus, vocab, load_vocab(frozen))
+        logging.info('Frozen vocabulary: %s', frozen)
+    elif unk:
+        corpus, vocab, least_common, min_count = unk_least_common(corpus, vocab)
+        logging.info('Least common patterns: frequency=%d patterns=%d', min_count, len(least_common))
     logging.info('%d tokens read (including <null> and <unk>)', len(vocab))
 
     # estimates parameters T[f,e] = t(f|e)
     # where (e, f) are syntactic patterns occurring in adjacent sentences in a document
-    T, LL = ibm1(corpus, len(vocab), args.max_iterations, args.min_gain, args.progress)
+    T, LL = ibm1(corpus, len(vocab), max_iterations, min_gain, progress)
     T = np.nan_to_num(T)
     
     # store the log-likelihood values
-    if args.ll:
-        with open(args.ll, 'w') as fo:
-            [fo.write('{0}\n'.format(ll)) for ll in LL]
+    if ll:
+        with open(ll, 'w') as fo:
+            [fo.write('{0}\n'.format(l)) for l in LL]
 
     # dumps T in a nice format
-    tokens = [t for t, i in sorted(vocab.iteritems(), key=lambda (t, i): i)]
+    tokens = np.array([t for t, i in sorted(vocab.iteritems(), key=lambda (t, i): i)], dtype=object)
     V = len(tokens)
     # we print a header so that the meaning of each column is clear
-    print >> args.output, '#trigger\t#pattern\t#p(pattern|trigger)'  # note that e=trigger and f=pattern 
+    ostream.write('#trigger\t#pattern\t#p(pattern|trigger)\n')  # note that e=trigger and f=pattern 
     # we iterate over f in no particular order (simply that of the vocabulary ids)
     for f in xrange(V):
-        # we iterate over triggers so that the most likely ones come first
-        for e in sorted(itertools.ifilter(lambda e: T[f,e], xrange(V)), key=lambda e: T[f,e], reverse=True):
-            print >> args.output, '{0}\t{1}\t{2}'.format(tokens[e], tokens[f], T[f,e])
+        # we iterate over triggers so that the most likely ones come first (ties in order of ids)
+        E = np.flatnonzero(T[f])
+        E = E[np.argsort(-T[f,E], kind='mergesort')]
+        write_table(ostream, None, [tokens[E], np.repeat(tokens[f], len(E)), T[f,E]])
+
+     
+def main(args):
+    
+    logging.basicConfig(
+            level=(logging.DEBUG if args.verbose else logging.INFO), 
+            format='%(asctime)s %(levelname)s %(message)s', datefmt='%m/%d/%Y %H:%M:%S')
+
+    if args.files:
+        corpus, vocab = load_corpus(args.files, args.boundary)
+        train_encoded(corpus, vocab, args.output, 
+                max_iterations=args.max_iterations, 
+                min_gain=args.min_gain, 
+                unk=args.unk, 
+                progress=args.progress, 
+                ll=args.ll, 
+                frozen=args.vocab)
+    else:
+        train_model(args.input, args.output, 
+                max_iterations=args.max_iterations, 
+                min_gain=args.min_gain, 
+                boundary=args.boundary, 
+                unk=args.unk, 
+                progress=args.progress, 
+                ll=args.ll, 
+                frozen=args.vocab)
 
 
 @command('ibm1', 'syntax-based')
@@ -171,6 +220,9 @@ def argparser(parser=None, func=main):
     parser.add_argument('output', nargs='?', 
             type=argparse.FileType('w'), default=sys.stdout,
             help='output IBM1 estimates')
+    parser.add_argument('--files', nargs='+',
+            type=str,
+            help='read the training corpus from doctext files (rather than input) through their encodings (see discourse.encoded)')
     parser.add_argument('--ll',
             type=str,
             help='store the progression of the likelihood')
@@ -186,6 +238,9 @@ def argparser(parser=None, func=main):
     parser.add_argument('--unk', '-u',
             action='store_true',
             help='replaces singletons by an unk token')
+    parser.add_argument('--vocab',
+            type=str,
+            help='a frozen vocabulary (see discourse.vocabulary), patterns out of it are replaced by an unk token (overrides --unk)')
     parser.add_argument('--progress', '-p',
             action='store_true',
             help='display progress information')
@@ -200,6 +255,7 @@ def argparser(parser=None, func=main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
 
 
@@ -11,19 +11,24 @@ import numpy as np
 import traceback
 from itertools import izip
 from collections import defaultdict
-from multiprocessing import Pool
-from functools import partial
-from discourse.util import register_token, read_documents, encode_documents, encode_test_documents, ibm_pairwise, smart_open
+from discourse.util import register_token, read_documents, encode_test_documents, smart_open, write_table
+from discourse.executor import borrow, load_once
 from discourse import command
+from discourse import instrument
+from discourse.colstore import write_columns
+from discourse.docindex import map_shards
+from discourse.encoded import load_encoded, test_mapping
+from discourse.vocabulary import load_vocab
 
 
-def load_model(path, null='<null>', unk='<unk>'):
+def load_model(path, frozen=None, null='<null>', unk='<unk>'):
     """
     Loads a model stored in a file.
 
     Arguments
     ---------
     path: path to file containing the T table (as produced by ibm.py)
+    frozen: path to the frozen vocabulary the model was trained with (see `discourse.vocabulary`), if any
     null_symbol: symbol that should get id 0
     
     Returns
@@ -33,7 +38,7 @@ def load_model(path, null='<null>', unk='<unk>'):
     """
     with open(path) as fi:
         header = next(fi)
-        vocab = defaultdict()
+        vocab = load_vocab(frozen) if frozen else defaultdict()
         register_token(null, vocab)  # makes sure <null> gets id 0
         register_token(unk, vocab)  # makes sure <null> gets id 1
         entries = []
@@ -50,6 +55,15 @@ def load_model(path, null='<null>', unk='<unk>'):
     return T, vocab
 
 
+def model_boundaries(path, frozen=None):
+    """whether a model (see `load_model`) uses document boundary tokens, its table is not built"""
+    if frozen and '<doc>' in load_vocab(frozen):
+        return True
+    with open(path) as fi:
+        header = next(fi)
+        return any('<doc>' in line.split('\t')[:2] for line in fi)
+
+
 def loglikelihood(corpus, T):
     """
     Computes -log(likelihood(T))
@@ -58,9 +72,9 @@ def loglikelihood(corpus, T):
     because it has to deal with unknown patterns.
     """
     L = np.zeros(len(corpus))
-    for i, D in enumerate(corpus):
-        # for each sentence pair
-        for E, F in ibm_pairwise(D):
+    for i in xrange(len(corpus)):
+        # for each sentence pair (E is prefixed with the null symbol)
+        for E, F in corpus.pairs(i, null=True):
             # for each pattern in the second sentence of the pair
             for f in F:
                 # sum up the contributions of the pattern v conditioned on each pattern u in the first sentence of the pair
@@ -75,11 +89,11 @@ def wrapped_loglikelihood(corpus, T):
         raise Exception(''.join(traceback.format_exception(*sys.exc_info())))
 
 
-def decode(model, istream, ostream, estream=sys.stderr):
+def decode(model, istream, ostream, estream=sys.stderr, frozen=None):
 
     # reads in the model
     logging.info('Loading model: %s', model)
-    T, vocab = load_model(model)
+    T, vocab = load_model(model, frozen)
     logging.info('%d patterns and %d entries', len(vocab), T.size)
 
     # detect whether document boundary tokens were used in the model
@@ -96,58 +110,101 @@ def decode(model, istream, ostream, estream=sys.stderr):
     L = loglikelihood(test, T)
 
     # dumps scores
-    print >> ostream, '#doc\t#logprob\t#sentences\t#s_normalised\t#patterns\t#p_normalised'
-    for i, ll in enumerate(L):
-        num_sentences = len(test[i])
-        num_patterns = sum(len(row) for row in test[i])
-        print >> ostream, '{0}\t{1}\t{2}\t{3}\t{4}\t{5}'.format(i, ll, num_sentences, 
-                ll/num_sentences, num_patterns, ll/num_patterns)
+    num_sentences = test.document_lengths()
+    num_patterns = test.pattern_counts()
+    write_table(ostream, '#doc\t#logprob\t#sentences\t#s_normalised\t#patterns\t#p_normalised', 
+            [np.arange(len(L)), L, num_sentences, L/num_sentences, num_patterns, L/num_patterns])
     print >> estream, '#sum\t#mean'
     print >> estream, '{0}\t{1}'.format(L.sum(), np.mean(L))
   
 
-def decode_many(model, ipaths, opaths, jobs, estream=sys.stderr):
-
-    # reads in the model
-    logging.info('Loading model: %s', model)
-    T, vocab = load_model(model)
-    logging.info('%d patterns and %d entries', len(vocab), T.size)
+def score_file((ipath, first, last), model, frozen=None):
+    """
+    Scores the documents in a file (or only documents first to last-1).
+    The model is loaded at most once per process (see `discourse.executor.load_once`).
 
+    Returns
+    -------
+    the log likelihood, the number of sentences and the number of patterns of each document
+    """
+    T, vocab = load_once(load_model, model, frozen)
     # detect whether document boundary tokens were used in the model
     boundaries = '<doc>' in vocab
 
-    # reads in the test documents
-    logging.info('Reading test documents in (boundaries=%s) ...', boundaries)
+    # loads the encoding of the test documents (see `discourse.encoded`) and maps it to the model's vocabulary
+    corpus, tokens = load_encoded(ipath, boundaries)
+    test = corpus[first:last].translate(test_mapping(tokens, vocab))
+    logging.info('%s: %d test documents read', ipath, len(test))
+
+    # computes the log likelihood of each document
+    L = loglikelihood(test, T)
+
+    num_sentences = test.document_lengths()
+    num_patterns = test.pattern_counts()
+    instrument.count(documents=len(test), sentences=int(num_sentences.sum()), patterns=int(num_patterns.sum()))
+    return L, num_sentences, num_patterns
+
+
+def write_scores(opath, L, num_sentences, num_patterns, binary=False):
+    """Writes scores out, in text format or, if binary, as a columnar store (see `discourse.colstore`)"""
+    if binary:
+        # dumps scores as columns (in the order of the text format)
+        num_sentences = num_sentences.astype(float)
+        num_patterns = num_patterns.astype(float)
+        write_columns(opath, [('doc', np.arange(len(L))), ('logprob', L), ('sentences', num_sentences), 
+            ('s_normalised', L/num_sentences), ('patterns', num_patterns), ('p_normalised', L/num_patterns)])
+    else:
+        with smart_open(opath, 'w') as ostream:
+            # dumps scores (formatted column-wise)
+            write_table(ostream, '#doc\t#logprob\t#sentences\t#s_normalised\t#patterns\t#p_normalised', 
+                    [np.arange(len(L)), L, num_sentences, L/num_sentences, num_patterns, L/num_patterns])
 
-    tests = [None] * len(ipaths)
-    for i, ipath in enumerate(ipaths):
-        documents = read_documents(smart_open(ipath), boundaries)  
-        logging.info('%s: %d test documents read', ipath, len(documents))
-        # encode test documents using the model's vocabulary
-        tests[i] = encode_test_documents(documents, vocab)
 
-    # computes the log likelihood of each document in each test file
-    pool = Pool(jobs)
-    all_L = pool.map(partial(wrapped_loglikelihood, T=T), tests)
+def decode_file((ipath, opath), model, binary=False, frozen=None):
+    """
+    Scores the documents in a file and writes their scores out (see `write_scores`).
+
+    Returns
+    -------
+    the sum and the mean of the log likelihood of the documents
+    """
+    L, num_sentences, num_patterns = score_file((ipath, 0, None), model, frozen)
+    write_scores(opath, L, num_sentences, num_patterns, binary)
+    return L.sum(), np.mean(L)
+
+
+def decode_many(model, ipaths, opaths, jobs, estream=sys.stderr, executor=None, binary=False, shards=0, frozen=None):
+    """
+    Decodes several files in parallel (one task per file).
+    If an executor is given, its (warm) workers are used, otherwise a pool of `jobs` workers is created and shut down at the end.
+    With shards, files are rather split into about so many tasks with the same number of sentences
+    (see `discourse.docindex.map_shards`), whose scores are gathered and written out here.
+    """
+    logging.info('Decoding %d files with: %s', len(ipaths), model)
+    with borrow(executor, jobs, [__name__]) as executor:
+        if not shards:
+            results = executor.map(decode_file, zip(ipaths, opaths), model=model, binary=binary, frozen=frozen)
+        else:
+            # test files are encoded once (see `discourse.encoded`), so that shards only memory-map their encoding
+            boundaries = model_boundaries(model, frozen)
+            for ipath in ipaths:
+                load_encoded(ipath, boundaries)
+            results = []
+            for opath, parts in izip(opaths, map_shards(executor, score_file, ipaths, shards, model=model, frozen=frozen)):
+                L, num_sentences, num_patterns = [np.concatenate(column) for column in zip(*parts)]
+                write_scores(opath, L, num_sentences, num_patterns, binary)
+                results.append((L.sum(), np.mean(L)))
 
     print >> estream, '#file\t#sum\t#mean'
-    for ipath, opath, test, L in izip(ipaths, opaths, tests, all_L):
-        with smart_open(opath, 'w') as ostream:
-            # dumps scores
-            print >> ostream, '#doc\t#logprob\t#sentences\t#s_normalised\t#patterns\t#p_normalised'
-            for i, ll in enumerate(L):
-                num_sentences = len(test[i])
-                num_patterns = sum(len(row) for row in test[i])
-                print >> ostream, '{0}\t{1}\t{2}\t{3}\t{4}\t{5}'.format(i, ll, num_sentences, 
-                        ll/num_sentences, num_patterns, ll/num_patterns)
-            print >> estream, '{0}\t{1}\t{2}'.format(opath, L.sum(), np.mean(L))
+    for opath, (total, mean) in izip(opaths, results):
+        print >> estream, '{0}\t{1}\t{2}'.format(opath, total, mean)
 
 
 def main(args):
     logging.basicConfig(
             level=(logging.DEBUG if args.verbose else logging.INFO), 
             format='%(levelname)s %(message)s')
-    decode(args.model, args.input, args.output)
+    decode(args.model, args.input, args.output, frozen=args.vocab)
     
 
 @command('ibm1_decoder', 'syntax-based')
@@ -169,6 +226,9 @@ def argparser(parser=None, func=main):
     parser.add_argument('output', nargs='?', 
             type=argparse.FileType('w'), default=sys.stdout,
             help='document log probabilities')
+    parser.add_argument('--vocab',
+            type=str,
+            help='the frozen vocabulary the model was trained with (see discourse.vocabulary), whose ids are kept')
     parser.add_argument('--verbose', '-v',
             action='store_true',
             help='increase the verbosity level')
@@ -180,4 +240,5 @@ def argparser(parser=None, func=main):
 
 
 if __name__ == '__main__':
-    main(argparser().parse_args())
+    args = argparser().parse_args()
+    args.func(args)
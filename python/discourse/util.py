@@ -11,30 +11,23 @@ Also check my docstrings ;)
 import sys
 import itertools
 import numpy as np
-import gzip
 import glob
 import random
+from array import array
 from collections import defaultdict, Counter
 
-try:
-    from progressbar import ProgressBar, AnimatedMarker, Percentage, Timer, ETA, Bar
-    _PROGRESSBAR_ = True
-except:
-    _PROGRESSBAR_ = False
-    
-try:
-    import tabulate as tab
-    _TABULATE_ = True
-except:
-    _TABULATE_ = False
-
 from doctext import iterdoctext
+from discourse.pgzip import open_gzip
 
 
 def bar(iterable, msg='', maxval=None, none=False):
     """wraps an iterable with a progress bar"""
-    # if progressbar is installed we use it
-    if not _PROGRESSBAR_ or none:
+    if none:
+        return iterable
+    # if progressbar is installed we use it (it is imported on demand to keep start-up cheap)
+    try:
+        from progressbar import ProgressBar, Percentage, Timer, ETA, Bar
+    except ImportError:
         return iterable
     widgets=[msg, Bar(), ' ', Percentage(), ' ', Timer(), ' ', ETA()]
     if maxval is None:
@@ -46,7 +39,11 @@ def bar(iterable, msg='', maxval=None, none=False):
 
 def tabulate(*args, **kwargs):
     """wraps a call to tabulate.tabulate if available"""
-    return tab.tabulate(*args, **kwargs) if _TABULATE_ else 'Tip: consider installing tabulate for nice summaries at the end of some processes'
+    try:
+        import tabulate as tab
+    except ImportError:
+        return 'Tip: consider installing tabulate for nice summaries at the end of some processes'
+    return tab.tabulate(*args, **kwargs)
 
 
 def pairwise(iterable):
@@ -74,7 +71,8 @@ def ibm_pairwise(document, e0=0):
 
     Returns
     -------
-    A generator of sentence pairs where e0..en is the first sentence and f1..fm is the second one (and e0 is inserted by this method)
+    A generator of sentence pairs where e0..en is the first sentence and f1..fm is the second one (and e0 is inserted by this method),
+    note that e0..en is a new array (an encoded corpus offers the same pairs without copies, see `RaggedCorpus.pairs`)
 
     >>> doc = [[1], [2,3,4], [5]]
     >>> list(ibm_pairwise(doc))
@@ -140,13 +138,29 @@ def _partial_ordering(elements, shuf=True, reverse=False):
     return tuple(i for i, e in sorted(enumerate(elements), key=lambda (i, e): e, cmp=my_cmp, reverse=reverse))
 
 
-def read_documents(istream, doc_boundaries=False):
-    """reads documents from an input stream"""
+def iterdocuments(istream, doc_boundaries=False):
+    """iterates over documents in an input stream (each document is a list of tokenised sentences)"""
     def wrap_doc(sentences):
         """wraps a doc with document tags if requested"""
         return itertools.chain(['<doc>'], sentences, ['</doc>']) if doc_boundaries else sentences
 
-    return [[line.split() for line in wrap_doc(lines)] for lines, attrs in iterdoctext(istream)]
+    return ([line.split() for line in wrap_doc(lines)] for lines, attrs in iterdoctext(istream))
+
+
+def read_documents(istream, doc_boundaries=False):
+    """reads documents from an input stream"""
+    return list(iterdocuments(istream, doc_boundaries))
+
+
+def iterfiles(paths):
+    """
+    Streams the lines of several files (possibly gzipped), one file after the other.
+    Files are opened lazily and closed as soon as they are consumed.
+    """
+    for path in paths:
+        with smart_open(path) as fi:
+            for line in fi:
+                yield line
 
 
 def register_token(t, vocab):
@@ -167,66 +181,358 @@ def find_least_common(T):
     return frozenset(u for u, c in itertools.takewhile(lambda (u, c): c == n, reversed(sorted_pairs))), n
 
 
+class RaggedCorpus(object):
+    """
+    A corpus of documents (lists of sentences of token ids) laid out as flat arrays:
+
+        data[sentences[s]+1:sentences[s+1]]         ids of the sth sentence
+        data[sentences[s]]                          the null symbol (id 0)
+        sentences[documents[d]:documents[d+1]+1]    boundaries of the sentences of the dth document
+
+    Every sentence is stored once, preceded by a null slot, thus a sentence and the sentence prefixed by the null symbol
+    (the triggers of IBM models, see `ibm_pairwise`) are both views of `data`: iterating over pairs allocates no arrays.
+    A document is materialised on demand as a list of views of `data` (nothing is copied),
+    slicing a corpus (by documents) shares all arrays with it, and arrays may be memory-mapped (see `discourse.encoded`).
+
+    >>> C = RaggedCorpus(np.array([0, 1, 0, 2, 3, 4, 0, 5, 0, 6]), np.array([0, 2, 6, 8, 10]), np.array([0, 2, 4]))
+    >>> [[S.tolist() for S in D] for D in C]
+    [[[1], [2, 3, 4]], [[5], [6]]]
+    >>> [(E.tolist(), F.tolist()) for E, F in C.pairs(0)]
+    [([1], [2, 3, 4])]
+    >>> [(E.tolist(), F.tolist()) for E, F in C.pairs(1, null=True)]
+    [([0, 5], [6])]
+    >>> C[1:].num_sentences(), C[1:].num_patterns(), [[S.tolist() for S in D] for D in C[1:]]
+    (2, 2, [[[5], [6]]])
+    >>> C.token_counts(7).tolist()
+    [0, 1, 1, 1, 1, 1, 1]
+    """
+
+    # the id stored in the slot which precedes every sentence
+    null = 0
+
+    def __init__(self, data, sentences, documents):
+        # memory maps are turned into plain views (arithmetic on memory maps is slower)
+        self.data = data.view(np.ndarray)
+        self.sentences = sentences.view(np.ndarray)
+        self.documents = documents.view(np.ndarray)
+
+    def __len__(self):
+        return len(self.documents) - 1
+
+    def __getitem__(self, key):
+        """the dth document (a list of sentences), or a range of documents (a RaggedCorpus)"""
+        if isinstance(key, slice):
+            i, j, step = key.indices(len(self))
+            assert step == 1, 'Only contiguous ranges of documents are supported'
+            return RaggedCorpus(self.data, self.sentences, self.documents[i:max(i, j) + 1])
+        if key < 0:
+            key += len(self)
+        a, b = int(self.documents[key]), int(self.documents[key + 1])
+        offsets = self.sentences[a:b + 1].tolist()
+        data = self.data
+        return [data[offsets[k] + 1:offsets[k + 1]] for k in xrange(b - a)]
+
+    def __iter__(self):
+        data = self.data
+        first = int(self.documents[0])
+        offsets = self.sentences[first:int(self.documents[-1]) + 1].tolist()
+        documents = (self.documents - first).tolist()
+        for a, b in itertools.izip(documents[:-1], documents[1:]):
+            yield [data[offsets[k] + 1:offsets[k + 1]] for k in xrange(a, b)]
+
+    def pairs(self, d, null=False):
+        """
+        Adjacent sentences (E, F) of the dth document (views of `data`).
+        With null, E is prefixed by the null symbol (see `ibm_pairwise`).
+        """
+        a, b = int(self.documents[d]), int(self.documents[d + 1])
+        offsets = self.sentences[a:b + 1].tolist()
+        data = self.data
+        skip = 0 if null else 1
+        return [(data[offsets[k] + skip:offsets[k + 1]], data[offsets[k + 1] + 1:offsets[k + 2]]) for k in xrange(b - a - 1)]
+
+    def num_sentences(self):
+        return int(self.documents[-1] - self.documents[0])
+
+    def num_patterns(self):
+        return int(self.sentences[self.documents[-1]] - self.sentences[self.documents[0]]) - self.num_sentences()
+
+    def _region(self):
+        """the part of `data` spanned by this corpus (null slots included)"""
+        return self.data[self.sentences[self.documents[0]]:self.sentences[self.documents[-1]]]
+
+    def token_counts(self, minlength=0):
+        """the number of occurrences of each id (null slots excluded)"""
+        counts = np.bincount(self._region(), minlength=max(minlength, self.null + 1))
+        counts[self.null] -= self.num_sentences()
+        return counts
+
+    def sentence_lengths(self):
+        """the number of tokens in each sentence"""
+        return np.diff(self.sentences[self.documents[0]:self.documents[-1] + 1]) - 1
+
+    def document_lengths(self):
+        """the number of sentences in each document"""
+        return np.diff(self.documents)
+
+    def pattern_counts(self):
+        """the number of tokens in each document"""
+        return np.diff(self.sentences[self.documents]) - self.document_lengths()
+
+    def compact(self):
+        """an equivalent corpus whose offsets start from 0 (data is shared)"""
+        first = self.documents[0]
+        return RaggedCorpus(self._region(), self.sentences[first:self.documents[-1] + 1] - self.sentences[first], self.documents - first)
+
+    def translate(self, mapping):
+        """
+        a (compact) copy of this corpus whose ids are replaced by mapping[id] (null slots are kept)
+
+        >>> C = RaggedCorpus(np.array([0, 1, 0, 2, 3, 4, 0, 5, 0, 6]), np.array([0, 2, 6, 8, 10]), np.array([0, 2, 4]))
+        >>> T = C[1:].translate(np.array([9, 8, 7, 6, 5, 4, 3]))  # null slots are kept even if mapping[null] is not null
+        >>> T.data.tolist(), T.sentences.tolist(), [(E.tolist(), F.tolist()) for E, F in T.pairs(0, null=True)]
+        ([0, 4, 0, 3], [0, 2, 4], [([0, 4], [3])])
+        >>> T = RaggedCorpus(np.array([0, 0, 1]), np.array([0, 1, 3]), np.array([0, 2])).translate(np.array([5, 6]))
+        >>> T.data.tolist(), [(E.tolist(), F.tolist()) for E, F in T.pairs(0, null=True)]  # an empty sentence is a null slot
+        ([0, 0, 6], [([0], [6])])
+        """
+        C = self.compact()
+        data = mapping[C.data]
+        data[C.sentences[:-1]] = self.null
+        return RaggedCorpus(data, C.sentences, C.documents)
+
+
 def encode_documents(T, null='<null>', unk='<unk>', ignore=frozenset()):
     """
-    Encodes the corpus using numpy arrays of integers.
+    Encodes the corpus as flat arrays of integers (see `RaggedCorpus`), documents are encoded as they are read.
 
     Arguments
     ---------
-    T: corpus as returned by `read_documents`
-    null: null symbol, if not None, it will get id 0
+    T: an iterable of documents (each a list of tokenised sentences), e.g. `iterdocuments`
+    null: null symbol, it will get id 0
+    unk: unk symbol, it will get id 1
+    ignore: tokens replaced by unk
 
     Returns
     -------
-    corpus and vocab (a defaultdict)
+    corpus (a RaggedCorpus) and vocab (a defaultdict)
 
     >>> doc = [['a'], ['b', 'c', 'd', 'b', 'c'], ['e']]
-    >>> corpus = [doc]
-    >>> T1, V1 = encode_documents(corpus)
-    >>> T1 
-    array([[array([0]), array([1, 2, 3, 1, 2]), array([4])]], dtype=object)
-    >>> V1['a'] # note how 'a' gets assigned id 0
-    0
-    >>> len(V1) # and there will be 5 unique words in the vocabulary
-    5
-    >>> T2, V2 = encode_documents(corpus, '<null>')
-    >>> T2  # note how the first token won't be 0, because that's reserved for the null token
-    array([[array([1]), array([2, 3, 4, 2, 3]), array([5])]], dtype=object)
-    >>> len(V2) # note how the vocabulary is bigger now (due to the null symbol)
-    6
-    >>> V2['<null>'] # and finally, the null symbol is assigned id 0
-    0
-    
+    >>> T1, V1 = encode_documents([doc])
+    >>> [[S.tolist() for S in D] for D in T1]  # note how the first token gets id 2 (0 and 1 are reserved for null and unk)
+    [[[2], [3, 4, 5, 3, 4], [6]]]
+    >>> len(V1), V1['<null>'], V1['<unk>']
+    (7, 0, 1)
+    >>> T2, V2 = encode_documents([doc, []], ignore=frozenset(['d', 'e']))
+    >>> [[S.tolist() for S in D] for D in T2]
+    [[[2], [3, 4, 1, 3, 4], [1]], []]
+    """
+    vocab = defaultdict()
+    register_token(null, vocab)  # make sure id=0 refers to the NULL token
+    register_token(unk, vocab)
+    unk_id = vocab[unk]
+    get = vocab.get
+    data = array('i')
+    sentences = array('l', [0])
+    documents = array('l', [0])
+    for D in T:
+        for S in D:
+            data.append(RaggedCorpus.null)
+            for t in S:
+                i = get(t)
+                if i is None:
+                    if t in ignore:
+                        i = unk_id
+                    else:
+                        i = vocab[t] = len(vocab)
+                data.append(i)
+            sentences.append(len(data))
+        documents.append(len(sentences) - 1)
+    return _ragged(data, sentences, documents), vocab
+
+
+def encode_docviews(views, doc_boundaries=False, null='<null>', unk='<unk>', ignore=frozenset()):
+    """
+    Encodes documents read as views (see `doctext.iterdocviews`), this is equivalent to
+    `encode_documents(iterdocuments(istream, doc_boundaries), null, unk, ignore)` but a document is tokenised in one go
+    (a single split of its text, in which line breaks become markers of sentences) and its tokens are looked up at once,
+    thus there is no Python loop per sentence or per token (other than new tokens).
+    The text must not contain NUL bytes (the marker).
+
+    >>> from StringIO import StringIO
+    >>> from doctext import iterdocviews
+    >>> text = '# id=1\\na b  a\\n c \\n\\n# id=2\\n\\n# id=3\\nd b\\n'
+    >>> for boundaries in [False, True]:
+    ...     C1, V1 = encode_docviews(iterdocviews(StringIO(text), chunk_size=8), boundaries, ignore=frozenset(['d']))
+    ...     C2, V2 = encode_documents(iterdocuments(StringIO(text), boundaries), ignore=frozenset(['d']))
+    ...     print [[S.tolist() for S in D] for D in C1], V1 == V2, C1.data.tolist() == C2.data.tolist()
+    [[[2, 3, 2], [4]], [], [[1, 3]]] True True
+    [[[2], [3, 4, 3], [5], [6]], [[2], [6]], [[2], [1, 4], [6]]] True True
     """
     vocab = defaultdict()
     register_token(null, vocab)  # make sure id=0 refers to the NULL token
     register_token(unk, vocab)
-    wrap_token = lambda t: t if t not in ignore else unk
-    # register all tokens
-    encoded = np.array([[np.array([register_token(wrap_token(t), vocab) for t in S], int) for S in D] for D in T])
-    return encoded, vocab
+    # ids of tokens, ignored tokens and the marker of sentences (a negative id, replaced by null in the end)
+    lookup = dict(vocab)
+    lookup.update((t, vocab[unk]) for t in ignore if t not in vocab)
+    lookup['\0'] = -1
+    get = lookup.get
+    data = array('i')
+    documents = array('l', [0])
+    n = 0
+    for view in views:
+        k = len(view)
+        text = '\0 ' + view.buffer[int(view.starts[0]):int(view.ends[-1])].replace('\n', ' \0 ') if k else ''
+        if doc_boundaries:
+            text = '\0 <doc> {0} \0 </doc>'.format(text)
+            k += 2
+        tokens = text.split()
+        ids = map(get, tokens)
+        if None in ids:  # new tokens are registered in order of first occurrence
+            try:
+                j = ids.index(None)
+                while True:
+                    i = get(tokens[j])
+                    if i is None:
+                        i = vocab[tokens[j]] = lookup[tokens[j]] = len(vocab)
+                    ids[j] = i
+                    j = ids.index(None, j + 1)
+            except ValueError:  # no more
+                pass
+        data.extend(ids)
+        n += k
+        documents.append(n)
+    data = np.frombuffer(data, dtype=np.int32).copy() if data else np.zeros(0, np.int32)
+    sentences = np.flatnonzero(data == -1)
+    data[sentences] = RaggedCorpus.null
+    return RaggedCorpus(data, np.append(sentences, len(data)), np.array(documents, dtype=np.int64)), vocab
+
+
+def _ragged(data, sentences, documents):
+    """a RaggedCorpus from arrays of ids and offsets (array.array)"""
+    return RaggedCorpus(np.frombuffer(data, dtype=np.int32) if data else np.zeros(0, np.int32),
+            np.array(sentences, dtype=np.int64), np.array(documents, dtype=np.int64))
+
+
+def unk_least_common(T, vocab, null='<null>', unk='<unk>'):
+    """
+    Replaces the least common tokens in an encoded corpus by the unk symbol.
+    This is equivalent to `encode_documents(T, ignore=find_least_common(T)[0])`, 
+    but it only requires one pass over the raw documents (the one that produced the encoded corpus).
+
+    Arguments
+    ---------
+    T: corpus as returned by `encode_documents` 
+    vocab: vocabulary as returned by `encode_documents`
+
+    Returns
+    -------
+    corpus (a copy), vocab, least common tokens and their frequency
+
+    >>> T, V = encode_documents([[['a', 'b'], ['b', 'c']], [['b', 'd']]])
+    >>> T, V, least_common, n = unk_least_common(T, V)
+    >>> [[S.tolist() for S in D] for D in T]
+    [[[1, 2], [2, 1]], [[2, 1]]]
+    >>> sorted(least_common), n
+    (['a', 'c', 'd'], 1)
+    >>> sorted(V.iteritems(), key=lambda (t, i): i)
+    [('<null>', 0), ('<unk>', 1), ('b', 2)]
+    """
+    counts = T.token_counts(len(vocab))
+    mapping, new_vocab, least_common, n = unk_mapping(counts, vocab, null, unk)
+    if mapping is None:
+        return T, vocab, least_common, n
+    return T.translate(mapping.astype(np.int32)), new_vocab, least_common, n
+
+
+def unk_mapping(counts, vocab, null='<null>', unk='<unk>'):
+    """
+    Maps the least common tokens (given the count of each id) to the unk symbol, see `unk_least_common`.
+
+    Returns
+    -------
+    mapping (new id of each old id, or None if nothing was observed), new vocab, least common tokens and their frequency
+    """
+    V = len(vocab)
+    observed = np.flatnonzero(counts)
+    if not observed.size:
+        return None, vocab, frozenset(), 0
+    n = counts[observed].min()
+    # maps old ids to new ids (we keep the relative order of the surviving tokens)
+    mapping = np.zeros(V, int)
+    new_vocab = defaultdict()
+    register_token(null, new_vocab)
+    register_token(unk, new_vocab)
+    tokens = [t for t, i in sorted(vocab.iteritems(), key=lambda (t, i): i)]
+    least_common = frozenset(tokens[i] for i in observed[counts[observed] == n])
+    for i in sorted(vocab.itervalues()):
+        t = tokens[i]
+        mapping[i] = new_vocab[unk] if t in least_common else register_token(t, new_vocab)
+    return mapping, new_vocab, least_common, n
 
 
 def encode_test_documents(T, vocab, unk='<unk>'):
     """
-    Encodes test documents into numpy arrays of ids with a fixed (training) vocab.
-    New symbols are assigned id -1.
+    Encodes test documents as flat arrays of ids (see `RaggedCorpus`) with a fixed (training) vocab.
+    New symbols are assigned the id of unk.
 
-    >>> vocab = {'<null>':0, 'a':1, 'b':2, 'c':3}
+    >>> vocab = {'<null>':0, '<unk>':1, 'a':2, 'b':3, 'c':4}
     >>> T = [[['a'], ['b', 'c', 'd', 'b', 'c'], ['e']]]
-    >>> encode_test_documents(T, vocab)
-    array([[array([1]), array([ 2,  3, -1,  2,  3]), array([-1])]], dtype=object)
+    >>> [[S.tolist() for S in D] for D in encode_test_documents(T, vocab)]
+    [[[2], [3, 4, 1, 3, 4], [1]]]
     """
     assert unk in vocab, 'Your vocab does not assign an id to unknonw symbols'
-    unk_id = vocab['<unk>']
-    return np.array([[np.array([vocab.get(t, unk_id) for t in S], int) for S in D] for D in T])
+    unk_id = vocab[unk]
+    get = vocab.get
+    data = array('i')
+    sentences = array('l', [0])
+    documents = array('l', [0])
+    for D in T:
+        for S in D:
+            data.append(RaggedCorpus.null)
+            data.extend([get(t, unk_id) for t in S])
+            sentences.append(len(data))
+        documents.append(len(sentences) - 1)
+    return _ragged(data, sentences, documents)
 
 
 def smart_open(path, *args, **kwargs):
+    """
+    Opens a file, gzipped files (.gz) are written as blocks compressed in parallel
+    and read with blocks decompressed in parallel (see `discourse.pgzip`).
+    """
     if path.endswith('.gz'):
-        return gzip.open(path, *args, **kwargs)
+        return open_gzip(path, *args, **kwargs)
     else:
         return open(path, *args, **kwargs)
 
+# rows formatted at a time by write_table
+_TABLE_ROWS_ = 1 << 16
+
+
+def format_columns(*columns):
+    """
+    Formats columns (lists or numpy arrays) as tab-separated lines, values are formatted as by '{0}'.format.
+
+    >>> format_columns(np.arange(2), ['a', 'b'], np.array([0.5, 1/3.]))
+    '0\\ta\\t0.5\\n1\\tb\\t0.333333333333\\n'
+    """
+    # numpy scalars are formatted as python scalars, thus arrays are turned into lists first
+    columns = [map(str, c.tolist() if isinstance(c, np.ndarray) else c) for c in columns]
+    return ''.join(['\t'.join(row) + '\n' for row in itertools.izip(*columns)])
+
+
+def write_table(ostream, header, columns, rows=_TABLE_ROWS_):
+    """
+    Writes a header line and then tab-separated lines (see `format_columns`),
+    so many rows are formatted at a time and written with a single write.
+    """
+    if header is not None:
+        ostream.write(header + '\n')
+    n = len(columns[0]) if columns else 0
+    for i in xrange(0, n, rows):
+        ostream.write(format_columns(*[c[i:i + rows] for c in columns]))
+
+
 if __name__ == '__main__':
     print >> sys.stderr, __doc__
@@ -0,0 +1,197 @@
+"""
+Frozen vocabularies: the patterns (tokens) a model is trained with, selected by frequency.
+
+A vocabulary is built in a single pass over the training files (or none at all if their encodings are up to date,
+see `discourse.encoded`), keeping patterns which occur at least `min_count` times and/or the `top_k` most frequent ones.
+It is saved as a text file (one pattern and its count per line, in order of ids, '<null>' and '<unk>' first),
+which trainers and decoders load (see their --vocab option) so that patterns out of the vocabulary are replaced by '<unk>'.
+Note that models have V^2 parameters, thus shrinking V is the easiest way to shrink them.
+
+Example:
+
+    tokens, counts = count_tokens(training_files, boundary=True)
+    save_vocab('vocab', *select_tokens(tokens, counts, min_count=2))
+    corpus, vocab = freeze(*load_corpus(training_files, boundary=True), frozen=load_vocab('vocab'))
+
+@author: wilkeraziz
+"""
+
+import logging
+import argparse
+import numpy as np
+from collections import defaultdict
+from discourse import command
+from discourse.util import register_token, write_table
+from discourse.encoded import load_encoded, test_mapping
+
+
+def count_tokens(paths, boundary=False, null='<null>', unk='<unk>'):
+    """
+    Counts the patterns in doctext files in a single pass (through their encodings, see `discourse.encoded.load_encoded`).
+
+    Returns
+    -------
+    tokens (in order of first occurrence, null and unk first) and counts (a numpy array aligned with tokens)
+    """
+    vocab = defaultdict()
+    register_token(null, vocab)
+    register_token(unk, vocab)
+    counts = np.zeros(len(vocab), int)
+    for path in paths:
+        corpus, tokens = load_encoded(path, boundary)
+        mapping = np.array([register_token(t, vocab) for t in tokens], dtype=int)
+        counts.resize(len(vocab))
+        # ids are unique within a file, thus there are no repeated indices
+        counts[mapping] += corpus.token_counts(len(tokens))
+    return [t for t, i in sorted(vocab.iteritems(), key=lambda (t, i): i)], counts
+
+
+def select_tokens(tokens, counts, min_count=0, top_k=0, reserved=frozenset()):
+    """
+    Selects patterns by frequency, the ones left out count towards unk (the second token).
+    The first two tokens (null and unk) and reserved tokens are always kept, and the order of the tokens is preserved.
+
+    Arguments
+    ---------
+    tokens: as returned by `count_tokens`
+    counts: as returned by `count_tokens`
+    min_count: keep patterns which occur at least so many times (0 keeps all of them)
+    top_k: keep at most so many patterns (null, unk and reserved tokens excluded), the most frequent ones (0 means no limit)
+    reserved: tokens which are always kept (e.g. document boundary tokens, which decoders look for)
+
+    Returns
+    -------
+    tokens and counts
+
+    >>> tokens, counts = ['<null>', '<unk>', 'a', 'b', 'c', 'd'], np.array([0, 0, 3, 1, 2, 2])
+    >>> select_tokens(tokens, counts, min_count=2)
+    (['<null>', '<unk>', 'a', 'c', 'd'], array([0, 1, 3, 2, 2]))
+    >>> select_tokens(tokens, counts, top_k=2)  # ties are broken by order of first occurrence
+    (['<null>', '<unk>', 'a', 'c'], array([0, 3, 3, 2]))
+    >>> select_tokens(tokens, counts, min_count=3, reserved=['b'])
+    (['<null>', '<unk>', 'a', 'b'], array([0, 4, 3, 1]))
+    >>> select_tokens(tokens, [0, 0, 2, 2, 2, 2], top_k=3)  # all tied: the first three to occur
+    (['<null>', '<unk>', 'a', 'b', 'c'], array([0, 2, 2, 2, 2]))
+    >>> select_tokens(tokens, counts, top_k=1, reserved=['d'])  # reserved tokens do not take up places
+    (['<null>', '<unk>', 'a', 'd'], array([0, 3, 3, 2]))
+    >>> select_tokens(tokens, counts, min_count=2, top_k=10)  # fewer candidates than places
+    (['<null>', '<unk>', 'a', 'c', 'd'], array([0, 1, 3, 2, 2]))
+    """
+    counts = np.asarray(counts)
+    always = np.zeros(len(tokens), bool)
+    always[:2] = True
+    always[[i for i, t in enumerate(tokens) if t in reserved]] = True
+    keep = counts >= min_count
+    if top_k:
+        # a stable sort, thus ties are broken by order of first occurrence
+        candidates = np.flatnonzero(keep & ~always)
+        ranked = candidates[np.argsort(-counts[candidates], kind='mergesort')]
+        keep[ranked[top_k:]] = False
+    keep |= always
+    selected = np.flatnonzero(keep)
+    new_counts = counts[selected]
+    new_counts[1] += counts.sum() - new_counts.sum()
+    return [tokens[i] for i in selected], new_counts
+
+
+def save_vocab(path, tokens, counts):
+    """saves a vocabulary (tokens and their counts in order of ids)"""
+    with open(path, 'w') as fo:
+        write_table(fo, '#pattern\t#count', [tokens, counts])
+
+
+def load_vocab(path):
+    """
+    Loads a frozen vocabulary.
+
+    Returns
+    -------
+    vocab: defaultdict mapping a pattern (str) into an id (int), as returned by `util.encode_documents`
+    """
+    vocab = defaultdict()
+    with open(path) as fi:
+        header = next(fi)
+        for line in fi:
+            line = line.strip()
+            if not line:
+                continue
+            t, n = line.split('\t')
+            register_token(t, vocab)
+    return vocab
+
+
+def freeze(corpus, vocab, frozen, unk='<unk>'):
+    """
+    Maps an encoded corpus (and its vocab) to a frozen vocabulary, patterns out of it are replaced by unk.
+
+    Returns
+    -------
+    corpus (a copy) and the frozen vocab
+    """
+    tokens = [t for t, i in sorted(vocab.iteritems(), key=lambda (t, i): i)]
+    return corpus.translate(test_mapping(tokens, frozen, unk)), frozen
+
+
+def build_vocab(paths, output, boundary=False, min_count=0, top_k=0):
+    """
+    Counts the patterns in doctext files, selects them by frequency and saves the vocabulary (see `select_tokens`).
+
+    Returns
+    -------
+    the number of patterns counted and the number of patterns kept (null and unk included)
+    """
+    tokens, counts = count_tokens(paths, boundary)
+    selected, new_counts = select_tokens(tokens, counts, min_count, top_k, 
+            reserved=frozenset(['<doc>', '</doc>']) if boundary else frozenset())
+    save_vocab(output, selected, new_counts)
+    logging.info('Vocabulary %s: %d patterns out of %d (%d occurrences replaced by unk)',
+            output, len(selected), len(tokens), new_counts[1] - counts[1])
+    return len(tokens), len(selected)
+
+
+def main(args):
+    logging.basicConfig(
+            level=(logging.DEBUG if args.verbose else logging.INFO),
+            format='%(levelname)s %(message)s')
+    before, after = build_vocab(args.input, args.output, args.boundary, args.min_count, args.top_k)
+    print '{0}\t{1}\t{2}'.format(args.output, before, after)
+
+
+@command('vocab', 'preprocessing')
+def argparser(parser=None, func=main):
+    """parse command line arguments"""
+
+    if parser is None:
+        parser = argparse.ArgumentParser(prog='vocab')
+
+    parser.description = 'Build a frozen vocabulary (selected by frequency) for the syntax-based models'
+    parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
+
+    parser.add_argument('output',
+            type=str,
+            help='where the vocabulary is saved')
+    parser.add_argument('input', nargs='+',
+            type=str,
+            help='training files in doctext format (plain or gzipped), counted through their encodings (see discourse.encoded)')
+    parser.add_argument('--boundary', '-b',
+            action='store_true',
+            help='add document boundary tokens')
+    parser.add_argument('--min-count',
+            type=int, default=0,
+            help='keep patterns which occur at least so many times')
+    parser.add_argument('--top-k',
+            type=int, default=0,
+            help='keep at most so many patterns, the most frequent ones (0 means no limit)')
+    parser.add_argument('--verbose', '-v',
+            action='store_true',
+            help='increase the verbosity level')
+
+    if func is not None:
+        parser.set_defaults(func=func)
+
+    return parser
+
+
+if __name__ == '__main__':
+    args = argparser().parse_args()
+    args.func(args)
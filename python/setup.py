@@ -2,6 +2,6 @@ from setuptools import setup
 
 setup(
         name='discourse',
-        packages=['discourse', 'discourse.preprocessing', 'discourse.entity_based', 'discourse.syntax_based','corpus'],
+        packages=['discourse', 'discourse.preprocessing', 'discourse.entity_based', 'discourse.syntax_based', 'discourse.benchmark', 'corpus'],
         py_modules=['discotools']
 )